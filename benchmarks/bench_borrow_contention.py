@@ -0,0 +1,131 @@
+"""
+借书争用基准测试: 大量并发读者同时借同一本书，比较 BORROW_MODE 的两种实现:
+- locking: SELECT ... FOR UPDATE 锁定图书行，再插入借阅记录 (行锁跨两次往返一直持有到提交)
+- optimistic: 单条 INSERT ... SELECT ... WHERE available_stock > 0，冲突时重试
+
+直接在应用上下文中调用 app.BORROW_MODES 中的借书函数 (与 /loans/borrow 相同的代码路径，不含模板渲染)，
+连接来自应用的连接池。测试时新建一本库存为 --stock 的图书，结束后删除它和它的借阅记录:
+    python benchmarks/bench_borrow_contention.py --borrowers 200 --requests 4000 --stock 2000
+请求数多于库存时，后面的请求测量的是 "库存不足" 的失败路径。
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def setup_book(db, stock):
+    """新建压测用的图书和读者，返回 (book_id, reader_id)。"""
+    suffix = f"{os.getpid()}-{time.time_ns() % 10 ** 8}"  # isbn 最长 20 个字符
+    book = db.query_db("INSERT INTO books (title, author, isbn, total_stock, available_stock) "
+                       "VALUES ('压测热门图书', '压测', %s, %s, %s) RETURNING book_id",
+                       [f'BENCH-{suffix}', stock, stock], one=True)
+    reader = db.query_db("INSERT INTO readers (name, reader_number) VALUES ('压测读者', %s) RETURNING reader_id",
+                         [f'BENCH-{suffix}'], one=True)
+    db.get_db().commit()
+    return book[0], reader[0]
+
+
+def cleanup(db, book_id, reader_id):
+    db.query_db("DELETE FROM loans WHERE book_id = %s", [book_id], commit=True)
+    db.query_db("DELETE FROM books WHERE book_id = %s", [book_id], commit=True)
+    db.query_db("DELETE FROM readers WHERE reader_id = %s", [reader_id], commit=True)
+
+
+def run_mode(app, db, mode, borrowers, total_requests, stock):
+    """用 borrowers 个线程共发起 total_requests 次借书，返回 (耗时, 延迟列表, 各结果的次数)。"""
+    borrow = app.BORROW_MODES[mode]
+    with app.app.app_context():
+        book_id, reader_id = setup_book(db, stock)
+    latencies = []
+    outcomes = {}
+    counter = iter(range(total_requests))
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(borrowers + 1)
+
+    def worker():
+        start_barrier.wait()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            start = time.perf_counter()
+            with app.app.app_context():
+                conn = db.get_db()
+                cur = conn.cursor()
+                try:
+                    outcome = borrow(conn, cur, book_id, reader_id, '2030-01-01')
+                except Exception as e:
+                    conn.rollback()
+                    outcome = type(e).__name__
+                finally:
+                    cur.close()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(borrowers)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    with app.app.app_context():
+        available = db.query_db("SELECT available_stock FROM books WHERE book_id = %s", [book_id], one=True)[0]
+        loans = db.query_db("SELECT COUNT(*) FROM loans WHERE book_id = %s", [book_id], one=True)[0]
+        cleanup(db, book_id, reader_id)
+    if loans != outcomes.get(app.BORROW_OK, 0) or available != stock - loans:
+        raise RuntimeError(f"{mode}: 库存与借阅记录不一致 (借出 {loans}，剩余库存 {available})")
+    return duration, latencies, outcomes
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--borrowers', type=int, default=200, help='并发借书的线程数')
+    parser.add_argument('--requests', type=int, default=4000, help='总借书次数')
+    parser.add_argument('--stock', type=int, default=None, help='图书的库存 (默认等于 --requests，全部成功)')
+    parser.add_argument('--pool-size', type=int, default=50, help='应用连接池的最大连接数')
+    parser.add_argument('--modes', default='locking,optimistic', help='要比较的 BORROW_MODE，逗号分隔')
+    options = parser.parse_args()
+    stock = options.requests if options.stock is None else options.stock
+
+    # 在导入应用之前设置连接池大小，关闭缓存失效通知的监听线程；
+    # 等锁本来就是要测量的部分，调高慢查询阈值，避免慢查询日志和 EXPLAIN 干扰结果
+    os.environ['DB_POOL_MAX_SIZE'] = str(options.pool_size)
+    os.environ.setdefault('CACHE_LISTEN', 'false')
+    os.environ.setdefault('SLOW_QUERY_THRESHOLD_MS', '60000')
+    from personal_library import app, db
+
+    print(f"{options.borrowers} 个并发借书者，{options.requests} 次借书，库存 {stock}，连接池 {options.pool_size}")
+    print(f"{'模式':<12}{'借书/秒':>10}{'成功':>8}{'库存不足':>10}{'错误':>8}{'p50 (毫秒)':>12}{'p99 (毫秒)':>12}")
+    for mode in options.modes.split(','):
+        duration, latencies, outcomes = run_mode(app, db, mode, options.borrowers, options.requests, stock)
+        errors = sum(count for outcome, count in outcomes.items()
+                     if outcome not in (app.BORROW_OK, app.BORROW_OUT_OF_STOCK))
+        print(f"{mode:<12}{len(latencies) / duration:>10.0f}{outcomes.get(app.BORROW_OK, 0):>8}"
+              f"{outcomes.get(app.BORROW_OUT_OF_STOCK, 0):>10}{errors:>8}"
+              f"{statistics.median(latencies) * 1000:>12.2f}{percentile(latencies, 0.99) * 1000:>12.2f}")
+        if errors:
+            print(f"  错误: {outcomes}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+行类型基准测试: 比较 query_db 支持的几种 row_factory (dict/namedtuple/record/tuple)
+取回并遍历大量行时的速度和内存占用。
+
+查询使用 generate_series 生成与 books 表相同形状的行，不依赖现有数据:
+    python benchmarks/bench_row_factories.py --rows 100000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from personal_library import db  # noqa: E402
+from personal_library.app import app  # noqa: E402
+
+QUERY = """
+SELECT g AS book_id, 'title ' || g AS title, 'author ' || mod(g, 5000) AS author,
+       'SYN' || lpad(g::text, 10, '0') AS isbn, 'publisher ' || mod(g, 200) AS publisher,
+       1950 + mod(g, 75) AS publication_year, 'category' AS category,
+       3 + mod(g, 5) AS total_stock, 3 + mod(g, 5) AS available_stock
+FROM generate_series(1, %s) AS g
+"""
+
+
+def run_factory(row_factory, rows, repeat):
+    """
+    返回 (最快一次的耗时, 结果集占用的内存字节数)。
+    每次都按列名读取每行的两列，模拟模板渲染 (namedtuple 只能按属性访问)。
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = db.query_db(QUERY, [rows], row_factory=row_factory)
+        if row_factory == 'tuple':
+            title, stock = result.columns['title'], result.columns['available_stock']
+            for row in result:
+                row[title], row[stock]
+        elif row_factory == 'namedtuple':
+            for row in result:
+                row.title, row.available_stock
+        else:
+            for row in result:
+                row['title'], row['available_stock']
+        best = min(best, time.perf_counter() - start)
+        del result
+
+    tracemalloc.start()
+    result = db.query_db(QUERY, [rows], row_factory=row_factory)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='每次查询的行数')
+    parser.add_argument('--repeat', type=int, default=3, help='每种行类型重复次数，取最快一次')
+    options = parser.parse_args()
+
+    print(f"{options.rows} 行 x 9 列")
+    print(f"{'行类型':<12}{'行/秒':>12}{'内存 (MB)':>12}{'每行字节':>10}")
+    with app.app_context():
+        for row_factory in db.ROW_FACTORIES:
+            seconds, memory = run_factory(row_factory, options.rows, options.repeat)
+            print(f"{row_factory:<12}{options.rows / seconds:>12.0f}{memory / 2**20:>12.1f}"
+                  f"{memory / options.rows:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
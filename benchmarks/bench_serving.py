@@ -0,0 +1,132 @@
+"""
+服务模式压测: 分别以 WSGI (hypercorn 运行 Flask 应用，请求在线程池中执行) 和
+ASGI (personal_library.asgi，只读页面在事件循环上异步执行) 启动服务，
+用相同的并发请求压测只读页面，比较吞吐量和延迟。
+
+数据库需要已有数据 (例如先运行 insert_books.py 或 flask import-books)。
+为了测量数据库访问本身，压测时关闭缓存 (CACHE_BACKEND=null):
+    python benchmarks/bench_serving.py --concurrency 64 --requests 4000
+"""
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MODES = {
+    'wsgi': 'personal_library.app:app',
+    'asgi': 'personal_library.asgi:application',
+}
+
+DEFAULT_PATHS = [
+    '/books',
+    '/books/1',
+    '/loans/active',
+    '/loans/overdue',
+    '/search/reader_loans/1',
+    '/search/book_loans/1',
+]
+
+
+def start_server(mode, port, db_pool_size):
+    env = dict(os.environ, CACHE_BACKEND='null', CACHE_LISTEN='false', DB_POOL_MAX_SIZE=str(db_pool_size))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'hypercorn', MODES[mode], '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        env=env, cwd=os.path.join(os.path.dirname(__file__), '..'))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} 服务启动超时")
+
+
+def run_load(port, paths, concurrency, total_requests):
+    """用 concurrency 个线程 (每个线程一个长连接) 共发送 total_requests 个请求，返回 (耗时, 延迟列表, 错误数)。"""
+    latencies = []
+    errors = []
+    counter = iter(range(total_requests))
+    lock = threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            start = time.perf_counter()
+            try:
+                conn.request('GET', paths[index % len(paths)])
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors.append(index)
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, len(errors)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='wsgi,asgi', help='要比较的服务模式，逗号分隔')
+    parser.add_argument('--concurrency', type=int, default=64, help='并发连接数')
+    parser.add_argument('--requests', type=int, default=4000, help='每种模式发送的请求数')
+    parser.add_argument('--db-pool-size', type=int, default=20, help='两种模式使用的数据库连接池大小')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--path', action='append', dest='paths', help='压测的路径，可重复；默认覆盖所有只读页面')
+    options = parser.parse_args()
+    paths = options.paths or DEFAULT_PATHS
+
+    results = []
+    for mode in options.modes.split(','):
+        process = start_server(mode, options.port, options.db_pool_size)
+        try:
+            run_load(options.port, paths, options.concurrency, min(200, options.requests))  # 预热
+            elapsed, latencies, errors = run_load(options.port, paths, options.concurrency, options.requests)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        results.append((mode, len(latencies) / elapsed, statistics.median(latencies),
+                        percentile(latencies, 0.99), errors))
+
+    print(f"并发 {options.concurrency}，每种模式 {options.requests} 个请求，路径: {', '.join(paths)}")
+    print(f"{'模式':<6}{'请求/秒':>10}{'p50 (毫秒)':>12}{'p99 (毫秒)':>12}{'错误':>6}")
+    for mode, throughput, p50, p99, errors in results:
+        print(f"{mode:<6}{throughput:>10.1f}{p50 * 1000:>12.1f}{p99 * 1000:>12.1f}{errors:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+启动压测: 在新的 Python 进程中分别测量导入 personal_library.app、create_app() 和
+随后每个页面的第一个请求的耗时，比较不同的 TEMPLATE_CACHE_DIR / WARMUP 配置。
+每种配置运行 --runs 个进程，报告中位数。
+
+数据库需要已有数据 (例如先运行 benchmarks/generate_data.py):
+    python benchmarks/bench_startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_PATHS = ['/books', '/readers', '/loans/active']
+
+# 在子进程中执行: 输出各阶段的耗时 (秒)
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from personal_library.app import create_app
+timings = {'import': time.perf_counter() - start}
+start = time.perf_counter()
+app = create_app()
+timings['create_app'] = time.perf_counter() - start
+client = app.test_client()
+for path in sys.argv[1:]:
+    start = time.perf_counter()
+    response = client.get(path)
+    timings[path] = time.perf_counter() - start
+    assert response.status_code == 200, (path, response.status_code)
+print(json.dumps(timings))
+"""
+
+
+def run_child(paths, env):
+    output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, *paths], env=env, check=True,
+                            capture_output=True, text=True, cwd=os.path.join(os.path.dirname(__file__), '..'))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='每种配置启动的进程数')
+    parser.add_argument('--path', action='append', dest='paths', help='测量第一个请求的路径，可重复')
+    options = parser.parse_args()
+    paths = options.paths or DEFAULT_PATHS
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    base_env = dict(os.environ, PYTHONPATH=root, CACHE_BACKEND='null', CACHE_LISTEN='false',
+                    TEMPLATE_CACHE_DIR='', WARMUP='')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        configs = [
+            ('默认', {}),
+            ('模板缓存', {'TEMPLATE_CACHE_DIR': cache_dir}),
+            ('模板缓存+预热', {'TEMPLATE_CACHE_DIR': cache_dir, 'WARMUP': 'templates,db,cache'}),
+        ]
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'personal_library.app', 'precompile-templates'],
+                       env=dict(base_env, TEMPLATE_CACHE_DIR=cache_dir), check=True, cwd=root,
+                       stdout=subprocess.DEVNULL)
+        results = []
+        for name, overrides in configs:
+            runs = [run_child(paths, dict(base_env, **overrides)) for _ in range(options.runs)]
+            results.append((name, {key: statistics.median(run[key] for run in runs) for key in runs[0]}))
+
+    columns = ['import', 'create_app', *paths]
+    print(f"每种配置 {options.runs} 个进程，中位数 (毫秒)")
+    print(f"{'配置':<12}" + ''.join(f'{column:>14}' for column in columns) + f"{'合计':>10}")
+    for name, timings in results:
+        print(f"{name:<12}" + ''.join(f'{timings[column] * 1000:>14.1f}' for column in columns)
+              + f"{sum(timings.values()) * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+库存触发器基准测试: 比较原来的逐行触发器和语句级 (转换表) 触发器
+在一条语句插入/归还/删除大量借阅记录时的耗时。
+
+在一个临时 schema 中建表测试，结束后删除，不影响应用数据:
+    python benchmarks/bench_stock_triggers.py --loans 100000 --books 1000
+"""
+import argparse
+import os
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+STATEMENT_LEVEL_MIGRATION = os.path.join(os.path.dirname(__file__), '..', 'personal_library',
+                                         'migrations', '006_statement_level_stock_triggers.sql')
+
+TABLES_SQL = """
+CREATE TABLE books (
+    book_id SERIAL PRIMARY KEY,
+    total_stock INTEGER NOT NULL DEFAULT 0,
+    available_stock INTEGER NOT NULL DEFAULT 0,
+    CONSTRAINT chk_available_stock CHECK (available_stock >= 0 AND available_stock <= total_stock)
+);
+CREATE TABLE loans (
+    loan_id SERIAL PRIMARY KEY,
+    book_id INTEGER NOT NULL REFERENCES books(book_id),
+    reader_id INTEGER NOT NULL,
+    loan_date DATE NOT NULL DEFAULT CURRENT_DATE,
+    due_date DATE NOT NULL,
+    return_date DATE DEFAULT NULL
+);
+"""
+
+# 迁移 006 之前的逐行触发器，作为对照
+ROW_LEVEL_TRIGGERS_SQL = """
+CREATE FUNCTION fn_decrement_stock_on_borrow() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.return_date IS NULL THEN
+        UPDATE books SET available_stock = available_stock - 1 WHERE book_id = NEW.book_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER trg_decrement_stock_on_borrow AFTER INSERT ON loans
+FOR EACH ROW EXECUTE FUNCTION fn_decrement_stock_on_borrow();
+
+CREATE FUNCTION fn_update_stock_on_loan_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF OLD.return_date IS NULL AND NEW.return_date IS NOT NULL THEN
+        UPDATE books SET available_stock = available_stock + 1 WHERE book_id = NEW.book_id;
+    ELSIF OLD.return_date IS NOT NULL AND NEW.return_date IS NULL THEN
+        UPDATE books SET available_stock = available_stock - 1 WHERE book_id = NEW.book_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER trg_update_stock_on_loan_change AFTER UPDATE OF return_date ON loans
+FOR EACH ROW EXECUTE FUNCTION fn_update_stock_on_loan_change();
+
+CREATE FUNCTION fn_increment_stock_on_loan_delete() RETURNS TRIGGER AS $$
+BEGIN
+    IF OLD.return_date IS NULL THEN
+        UPDATE books SET available_stock = available_stock + 1 WHERE book_id = OLD.book_id;
+    END IF;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER trg_increment_stock_on_loan_delete AFTER DELETE ON loans
+FOR EACH ROW EXECUTE FUNCTION fn_increment_stock_on_loan_delete();
+"""
+
+# (说明, SQL)，每一步都是一条语句
+STEPS = [
+    ("插入借阅", """
+        INSERT INTO loans (book_id, reader_id, due_date)
+        SELECT 1 + mod(g, %(books)s), g, CURRENT_DATE + 30 FROM generate_series(1, %(loans)s) AS g
+    """),
+    ("批量归还", "UPDATE loans SET return_date = CURRENT_DATE WHERE return_date IS NULL"),
+    ("重新借出", "UPDATE loans SET return_date = NULL"),
+    ("删除借阅", "DELETE FROM loans"),
+]
+
+
+def run_variant(conn, name, triggers_sql, books, loans):
+    """在独立的 schema 中安装一种触发器实现，依次执行 STEPS 并返回每一步的秒数。"""
+    schema = f"bench_stock_{name}_{os.getpid()}"
+    timings = []
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+        try:
+            cur.execute(f"SET search_path TO {schema}")
+            cur.execute(TABLES_SQL)
+            cur.execute(triggers_sql)
+            cur.execute("INSERT INTO books (total_stock, available_stock) "
+                        "SELECT %(stock)s, %(stock)s FROM generate_series(1, %(books)s)",
+                        {'stock': loans, 'books': books})
+            conn.commit()
+            for description, sql in STEPS:
+                start = time.perf_counter()
+                cur.execute(sql, {'books': books, 'loans': loans})
+                conn.commit()
+                timings.append((description, time.perf_counter() - start))
+            cur.execute("SELECT COUNT(*) FROM books WHERE available_stock <> total_stock")
+            if cur.fetchone()[0]:
+                raise RuntimeError(f"{name}: 库存与借阅记录不一致")
+        finally:
+            conn.rollback()
+            cur.execute(f"DROP SCHEMA {schema} CASCADE")
+            cur.execute("RESET search_path")
+            conn.commit()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--loans', type=int, default=100000, help='每条语句影响的借阅记录数')
+    parser.add_argument('--books', type=int, default=1000, help='借阅记录分布在多少本图书上')
+    options = parser.parse_args()
+
+    with open(STATEMENT_LEVEL_MIGRATION, encoding='utf-8') as f:
+        statement_level_sql = f.read()
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        row = run_variant(conn, 'row', ROW_LEVEL_TRIGGERS_SQL, options.books, options.loans)
+        statement = run_variant(conn, 'statement', statement_level_sql, options.books, options.loans)
+    finally:
+        conn.close()
+
+    print(f"{options.loans} 条借阅 / {options.books} 本图书")
+    print(f"{'操作':<8}{'逐行触发器 (秒)':>16}{'语句级触发器 (秒)':>18}{'加速比':>10}")
+    for (description, row_seconds), (_, statement_seconds) in zip(row, statement):
+        print(f"{description:<8}{row_seconds:>16.3f}{statement_seconds:>18.3f}{row_seconds / statement_seconds:>10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+生成基准测试用的合成数据: 图书、读者和借阅记录 (包括已归还、借阅中和逾期的记录)。
+
+会先清空 loans, books, readers 三张表，请只对专门的基准测试数据库运行:
+    python benchmarks/generate_data.py --scale 10k
+    python benchmarks/generate_data.py --scale 1m --yes
+
+数据全部由 generate_series 在数据库中生成，按 chunk 分批提交并报告进度。
+生成规则是确定的，同一规模每次生成的数据相同，便于比较不同版本的测试结果。
+"""
+import argparse
+import os
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# 规模: (图书数, 读者数, 借阅记录数)
+SCALES = {
+    '10k': (10_000, 1_000, 30_000),
+    '1m': (1_000_000, 100_000, 3_000_000),
+    '10m': (10_000_000, 1_000_000, 30_000_000),
+}
+
+# 书名由两个词加编号组成，run_benchmarks.py 的搜索流量也从这里取词
+TITLE_WORDS = ['数据', '系统', '算法', '历史', '文学', '哲学', '经济', '艺术', '科学', '网络',
+               '设计', '原理', '城市', '旅行', '音乐', '心理', '语言', '战争', '自然', '未来',
+               'Python', 'Linux', 'Design', 'Learning', 'History', 'Music', 'Data', 'Cloud']
+CATEGORIES = ['计算机', '文学', '历史', '哲学', '经济', '艺术', '科学', '编程', '人工智能', '科幻']
+
+BOOKS_SQL = """
+INSERT INTO books (title, author, isbn, publisher, publication_year, category, total_stock, available_stock)
+SELECT (%(words)s::text[])[1 + mod(g, %(word_count)s)] || (%(words)s::text[])[1 + mod(g / %(word_count)s, %(word_count)s)]
+           || ' ' || g,
+       '作者' || mod(g * 7, 5000),
+       'SYN' || lpad(g::text, 10, '0'),
+       '出版社' || mod(g, 200),
+       1950 + mod(g, 75),
+       (%(categories)s::text[])[1 + mod(g, %(category_count)s)],
+       3 + mod(g, 5),
+       3 + mod(g, 5)
+FROM generate_series(%(start)s, %(stop)s) AS g
+"""
+
+READERS_SQL = """
+INSERT INTO readers (name, reader_number, contact)
+SELECT '读者' || g, 'R' || lpad(g::text, 9, '0'), 'reader' || g || '@example.com'
+FROM generate_series(%(start)s, %(stop)s) AS g
+"""
+
+# 最后 books / 2 条借阅未归还 (每本书最多一条，不会超出库存)，其中一半已逾期；
+# 其余为已归还的历史记录，借阅日期分布在过去十年。
+LOANS_SQL = """
+INSERT INTO loans (book_id, reader_id, loan_date, due_date, return_date)
+SELECT book_id, reader_id, loan_date, loan_date + 30,
+       CASE WHEN active THEN NULL ELSE loan_date + mod(g, 40) END
+FROM (
+    SELECT g,
+           1 + mod(g - 1, %(books)s) AS book_id,
+           1 + mod((g::bigint - 1) * 7919, %(readers)s) AS reader_id,
+           g > %(loans)s - %(active)s AS active,
+           CASE
+               WHEN g <= %(loans)s - %(active)s THEN CURRENT_DATE - 60 - ((%(loans)s - g::bigint) * 3650 / %(loans)s)::int
+               WHEN mod(g, 2) = 0 THEN CURRENT_DATE - 31 - mod(g, 60)
+               ELSE CURRENT_DATE - mod(g, 29)
+           END AS loan_date
+    FROM generate_series(%(start)s, %(stop)s) AS g
+) AS generated
+"""
+
+
+def insert_chunks(conn, label, sql, total, chunk_size, params):
+    """按 chunk_size 分批执行 INSERT ... SELECT generate_series，每批提交一次。"""
+    start_time = time.monotonic()
+    with conn.cursor() as cur:
+        for start in range(1, total + 1, chunk_size):
+            stop = min(total, start + chunk_size - 1)
+            cur.execute(sql, dict(params, start=start, stop=stop))
+            conn.commit()
+            elapsed = time.monotonic() - start_time
+            print(f"  {label}: {stop}/{total} ({stop / elapsed:.0f} 行/秒)", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='10k', help='数据规模 (图书数)')
+    parser.add_argument('--chunk-size', type=int, default=500_000, help='每批插入的行数')
+    parser.add_argument('--yes', action='store_true', help='不询问，直接清空现有数据')
+    options = parser.parse_args()
+    books, readers, loans = SCALES[options.scale]
+
+    if not options.yes:
+        answer = input(f"将清空 {DATABASE_URL} 中的 loans, books, readers 表，继续吗? [y/N] ")
+        if answer.strip().lower() != 'y':
+            return
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE TABLE loans, books, readers RESTART IDENTITY CASCADE;")
+            # 历史借阅分布在过去十年，先建好对应年份的分区，避免全部落入默认分区
+            cur.execute("SELECT fn_create_loan_partitions(EXTRACT(YEAR FROM CURRENT_DATE)::int - 11, "
+                        "EXTRACT(YEAR FROM CURRENT_DATE)::int + 1);")
+        conn.commit()
+        print(f"生成 {options.scale} 规模数据: {books} 本图书, {readers} 位读者, {loans} 条借阅记录")
+        insert_chunks(conn, '图书', BOOKS_SQL, books, options.chunk_size, {
+            'words': TITLE_WORDS, 'word_count': len(TITLE_WORDS),
+            'categories': CATEGORIES, 'category_count': len(CATEGORIES)})
+        insert_chunks(conn, '读者', READERS_SQL, readers, options.chunk_size, {})
+        insert_chunks(conn, '借阅', LOANS_SQL, loans, options.chunk_size,
+                      {'books': books, 'readers': readers, 'loans': loans, 'active': min(books // 2, loans)})
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE books, readers, loans;")
+        print("完成。")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
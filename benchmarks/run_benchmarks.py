@@ -0,0 +1,301 @@
+"""
+基准测试: 在进程内通过 Flask 测试客户端发送按比例混合的请求 (搜索、浏览、借书、还书、逾期报表)，
+报告每类请求的 p50/p99 延迟、吞吐量和每个请求执行的 SQL 语句数，并把结果保存为 JSON。
+
+先用 generate_data.py 生成数据，然后:
+    python benchmarks/run_benchmarks.py --requests 2000 --save
+    python benchmarks/run_benchmarks.py --requests 2000 --compare benchmarks/results/baseline.json
+
+--compare 时，若某类请求的 p50/p99 比基线慢超过 --threshold，或每请求的查询数增加，以状态码 1 退出，
+可以在发布前的检查中使用。借书和还书会修改数据库，请只对专门的基准测试数据库运行。
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import psycopg2.extensions
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+DEFAULT_MIX = 'search=30,browse=20,book=10,borrow=15,return=15,overdue=10'
+
+
+def parse_mix(value):
+    """把 'search=30,borrow=15' 解析成 {场景: 权重}。"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"未知场景 {name}，可选: {', '.join(SCENARIOS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# --- 统计每个请求执行的 SQL 语句数 ---
+
+_counter = threading.local()
+
+
+def count_queries(cursor_class):
+    """返回 cursor_class 的子类，每次 execute/executemany 都为当前线程计数。"""
+    class CountingCursor(cursor_class):
+        def execute(self, query, vars=None):
+            _counter.queries = getattr(_counter, 'queries', 0) + 1
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            _counter.queries = getattr(_counter, 'queries', 0) + 1
+            return super().executemany(query, vars_list)
+    return CountingCursor
+
+
+def make_counting_connection(base_class, cursor_base):
+    counting_cursors = {}
+
+    class CountingConnection(base_class):
+        def cursor(self, *args, **kwargs):
+            factory = kwargs.get('cursor_factory') or self.cursor_factory or cursor_base
+            if factory not in counting_cursors:
+                counting_cursors[factory] = count_queries(factory)
+            kwargs['cursor_factory'] = counting_cursors[factory]
+            return super().cursor(*args, **kwargs)
+    return CountingConnection
+
+
+# --- 流量场景: scenario(client, rng, state) -> (响应, 请求路径) ---
+
+def scenario_search(client, rng, state):
+    path = f"/books?search={rng.choice(state['words'])}"
+    return client.get(path), path
+
+def scenario_browse(client, rng, state):
+    # 从随机位置开始翻页，相当于用户浏览到列表的任意一页
+    title, book_id = rng.choice(state['book_keys'])
+    path = f"/books?after={state['encode_cursor'](title, book_id)}"
+    return client.get(path), path
+
+def scenario_book(client, rng, state):
+    path = f"/books/{rng.randint(1, state['max_book_id'])}"
+    return client.get(path), path
+
+def scenario_borrow(client, rng, state):
+    due_date = (datetime.date.today() + datetime.timedelta(days=30)).isoformat()
+    path = '/loans/borrow'
+    return client.post(path, data={
+        'book_id': rng.randint(1, state['max_book_id']),
+        'reader_id': rng.randint(1, state['max_reader_id']),
+        'due_date': due_date,
+    }), path
+
+def scenario_return(client, rng, state):
+    with state['lock']:
+        loan_id = state['active_loans'].pop() if state['active_loans'] else None
+    if loan_id is None:
+        return None, None
+    path = f'/loans/return/{loan_id}'
+    return client.post(path), path
+
+def scenario_overdue(client, rng, state):
+    path = '/loans/overdue' if rng.random() < 0.5 else f'/loans/overdue?min_days={rng.randint(1, 30)}'
+    return client.get(path), path
+
+
+SCENARIOS = {
+    'search': scenario_search,
+    'browse': scenario_browse,
+    'book': scenario_book,
+    'borrow': scenario_borrow,
+    'return': scenario_return,
+    'overdue': scenario_overdue,
+}
+
+
+def load_state(app, db, pagination, generate_data, requests):
+    """读取数据规模以及浏览/还书场景需要的样本。"""
+    with app.app_context():
+        max_book_id = db.query_db("SELECT COALESCE(MAX(book_id), 0) FROM books", one=True)[0]
+        max_reader_id = db.query_db("SELECT COALESCE(MAX(reader_id), 0) FROM readers", one=True)[0]
+        counts = db.query_db("SELECT (SELECT COUNT(*) FROM books), (SELECT COUNT(*) FROM readers), "
+                             "(SELECT COUNT(*) FROM loans)", one=True)
+        book_keys = [(row['title'], row['book_id']) for row in db.query_db(
+            "SELECT title, book_id FROM books WHERE book_id = ANY(%s)",
+            [random.Random(0).sample(range(1, max_book_id + 1), min(1000, max_book_id))])]
+        active_loans = [row[0] for row in db.query_db(
+            "SELECT loan_id FROM loans WHERE return_date IS NULL LIMIT %s", [requests])]
+    if not max_book_id or not max_reader_id:
+        raise SystemExit("数据库中没有数据，请先运行 benchmarks/generate_data.py")
+    random.Random(1).shuffle(active_loans)
+    return {
+        'max_book_id': max_book_id,
+        'max_reader_id': max_reader_id,
+        'dataset': {'books': counts[0], 'readers': counts[1], 'loans': counts[2]},
+        'book_keys': book_keys,
+        'active_loans': active_loans,
+        'words': generate_data.TITLE_WORDS,
+        'encode_cursor': pagination.encode_cursor,
+        'lock': threading.Lock(),
+    }
+
+
+def run(app, mix, state, total_requests, concurrency, seed):
+    """用 concurrency 个线程 (每个线程一个测试客户端) 发送 total_requests 个请求，返回原始记录和耗时。"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    records = {name: [] for name in names}
+    records_lock = threading.Lock()
+    per_thread = [total_requests // concurrency + (1 if i < total_requests % concurrency else 0)
+                  for i in range(concurrency)]
+
+    def worker(index, count):
+        rng = random.Random(seed + index)
+        client = app.test_client()
+        for _ in range(count):
+            name = rng.choices(names, weights)[0]
+            _counter.queries = 0
+            start = time.perf_counter()
+            response, _ = SCENARIOS[name](client, rng, state)
+            if response is None:
+                continue  # 没有可归还的借阅
+            response.get_data()  # 流式响应在读取时才执行查询和渲染
+            response.close()
+            elapsed = time.perf_counter() - start
+            ok = response.status_code < 400
+            with records_lock:
+                records[name].append((elapsed, _counter.queries, ok))
+
+    threads = [threading.Thread(target=worker, args=(i, count)) for i, count in enumerate(per_thread)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(records, elapsed):
+    scenarios = {}
+    for name, entries in records.items():
+        if not entries:
+            continue
+        latencies = [entry[0] for entry in entries]
+        scenarios[name] = {
+            'requests': len(entries),
+            'errors': sum(1 for entry in entries if not entry[2]),
+            'p50_ms': statistics.median(latencies) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'mean_ms': statistics.fmean(latencies) * 1000,
+            'queries_per_request': statistics.fmean(entry[1] for entry in entries),
+        }
+    total = sum(item['requests'] for item in scenarios.values())
+    return scenarios, {'requests': total, 'elapsed_s': elapsed, 'throughput': total / elapsed if elapsed else 0.0}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline, threshold):
+    """与基线结果比较，返回回归描述列表。"""
+    regressions = []
+    for name, current in result['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            if current[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f"{name} {metric}: {previous[metric]:.2f} -> {current[metric]:.2f}")
+        if current['queries_per_request'] > previous['queries_per_request'] + 0.01:
+            regressions.append(f"{name} queries_per_request: {previous['queries_per_request']:.2f} -> "
+                               f"{current['queries_per_request']:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000, help='发送的请求总数')
+    parser.add_argument('--concurrency', type=int, default=1, help='并发线程数')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f'场景权重，默认 {DEFAULT_MIX}')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cache', action='store_true', help='启用应用缓存 (默认关闭，以测量数据库访问)')
+    parser.add_argument('--save', action='store_true', help=f'把结果保存到 {RESULTS_DIR}')
+    parser.add_argument('--output', help='把结果保存到指定文件')
+    parser.add_argument('--compare', help='与基线结果文件比较')
+    parser.add_argument('--threshold', type=float, default=0.2, help='延迟超过基线多少比例视为回归')
+    options = parser.parse_args()
+
+    # 必须在导入应用之前设置，缓存后端在导入时创建
+    if not options.cache:
+        os.environ['CACHE_BACKEND'] = 'null'
+        os.environ['CACHE_LISTEN'] = 'false'
+    import generate_data
+    from personal_library import db, pagination
+    from personal_library.app import app
+    app.config['DB_CONNECTION_FACTORY'] = make_counting_connection(
+        app.config.get('DB_CONNECTION_FACTORY') or db.PooledConnection, psycopg2.extensions.cursor)
+    app.config['DB_POOL_MAX_SIZE'] = max(app.config['DB_POOL_MAX_SIZE'], options.concurrency + 1)
+
+    state = load_state(app, db, pagination, generate_data, options.requests)
+    run(app, options.mix, state, min(100, options.requests), options.concurrency, options.seed + 1000)  # 预热
+    records, elapsed = run(app, options.mix, state, options.requests, options.concurrency, options.seed)
+    scenarios, total = summarize(records, elapsed)
+    result = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'dataset': state['dataset'],
+        'options': {'requests': options.requests, 'concurrency': options.concurrency, 'mix': options.mix,
+                    'seed': options.seed, 'cache': options.cache},
+        'total': total,
+        'scenarios': scenarios,
+    }
+
+    print(f"数据: {state['dataset']}，并发 {options.concurrency}，"
+          f"{total['requests']} 个请求，{total['throughput']:.1f} 请求/秒")
+    print(f"{'场景':<8}{'请求数':>8}{'错误':>6}{'p50 (毫秒)':>12}{'p99 (毫秒)':>12}{'查询/请求':>10}")
+    for name, item in scenarios.items():
+        print(f"{name:<8}{item['requests']:>8}{item['errors']:>6}{item['p50_ms']:>12.2f}"
+              f"{item['p99_ms']:>12.2f}{item['queries_per_request']:>10.2f}")
+
+    output = options.output
+    if options.save and not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {output}")
+
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['options']['concurrency'] != options.concurrency or baseline['dataset'] != result['dataset']:
+            print(f"注意: 基线的并发数或数据规模不同 (基线: 并发 {baseline['options']['concurrency']}, "
+                  f"{baseline['dataset']})")
+        regressions = compare(result, baseline, options.threshold)
+        if regressions:
+            print("性能回归:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("与基线相比没有回归。")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import os
 import psycopg2
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
 # 加载 .env 文件中的环境变量
@@ -55,17 +56,17 @@ loans = [
 # 插入数据的 SQL 语句
 insert_book_sql = """
 INSERT INTO books (title, author, isbn, publisher, publication_year, category, total_stock, available_stock)
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
+VALUES %s;
 """
 
 insert_reader_sql = """
 INSERT INTO readers (name, reader_number, contact)
-VALUES (%s, %s, %s);
+VALUES %s;
 """
 
 insert_loan_sql = """
 INSERT INTO loans (book_id, reader_id, due_date, loan_date)
-VALUES (%s, %s, %s, CURRENT_DATE);
+VALUES %s;
 """
 
 def clear_and_insert_data():
@@ -77,43 +78,44 @@ def clear_and_insert_data():
         # 清空数据库
         cur.execute(clear_sql)
 
-        # 插入书籍数据
-        for book in books:
-            cur.execute(insert_book_sql, (
-                book["title"],
-                book["author"],
-                book["isbn"],
-                book["publisher"],
-                book["publication_year"],
-                book["category"],
-                book["total_stock"],
-                book["total_stock"]  # 初始时，available_stock 等于 total_stock
-            ))
+        # 插入书籍数据 (每张表一条多行 INSERT，而不是逐行 execute)
+        execute_values(cur, insert_book_sql, [(
+            book["title"],
+            book["author"],
+            book["isbn"],
+            book["publisher"],
+            book["publication_year"],
+            book["category"],
+            book["total_stock"],
+            book["total_stock"]  # 初始时，available_stock 等于 total_stock
+        ) for book in books])
 
         # 插入读者数据
-        for reader in readers:
-            cur.execute(insert_reader_sql, (
-                reader["name"],
-                reader["reader_number"],
-                reader["contact"]
-            ))
+        execute_values(cur, insert_reader_sql, [(
+            reader["name"],
+            reader["reader_number"],
+            reader["contact"]
+        ) for reader in readers])
 
         # 插入借阅记录
-        for loan in loans:
-            cur.execute(insert_loan_sql, (
-                loan["book_id"],
-                loan["reader_id"],
-                loan["due_date"]
-            ))
-
-        # 更新每本书的 available_stock
+        execute_values(cur, insert_loan_sql, [(
+            loan["book_id"],
+            loan["reader_id"],
+            loan["due_date"]
+        ) for loan in loans], template="(%s, %s, %s, CURRENT_DATE)")
+
+        # 按未归还借阅数校正 available_stock (一次聚合，而不是每本书一个相关子查询)
+        # 没有借阅记录的图书保持插入时的 available_stock = total_stock
         cur.execute("""
             UPDATE books
-            SET available_stock = total_stock - (
-                SELECT COUNT(*)
+            SET available_stock = books.total_stock - active.loan_count
+            FROM (
+                SELECT book_id, COUNT(*) AS loan_count
                 FROM loans
-                WHERE books.book_id = loans.book_id AND loans.return_date IS NULL
-            );
+                WHERE return_date IS NULL
+                GROUP BY book_id
+            ) AS active
+            WHERE books.book_id = active.book_id;
         """)
 
         # 提交事务
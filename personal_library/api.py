@@ -0,0 +1,265 @@
+"""
+版本化的 JSON API (/api/v1)，供其他服务批量读取图书、读者和借阅记录。
+
+- 列表接口使用键集分页: 响应中的 next_cursor/prev_cursor 作为 after/before 参数取下一页/上一页
+- ids=1,2,3 在一条查询中按 ID 批量读取，结果顺序与请求一致，不存在的 ID 列在 missing 中
+- fields=title,author 只返回 (并只查询) 指定字段
+- GET 响应带 ETag，请求带匹配的 If-None-Match 时返回 304
+- 客户端接受 gzip 且响应体超过 API_GZIP_MIN_SIZE 字节时压缩响应
+"""
+import datetime
+import gzip
+import hashlib
+import os
+
+import psycopg2
+from flask import Blueprint, abort, current_app, request
+from werkzeug.exceptions import HTTPException
+
+from . import db, pagination
+
+API_DEFAULTS = {
+    'API_PER_PAGE': 50,          # 列表接口默认每页行数
+    'API_MAX_PER_PAGE': 500,     # limit 参数允许的最大值
+    'API_MAX_IDS': 500,          # ids 参数最多包含的 ID 数
+    'API_GZIP_MIN_SIZE': 1024,   # 小于该字节数的响应不压缩
+    'API_GZIP_LEVEL': 6,
+}
+
+# 每种资源: 表、主键、可选择的字段、键集分页的排序键
+RESOURCES = {
+    'books': {
+        'table': 'books',
+        'id': 'book_id',
+        'fields': ('book_id', 'title', 'author', 'isbn', 'publisher', 'publication_year', 'category',
+                   'total_stock', 'available_stock'),
+        'order': ('title', 'book_id'),
+    },
+    'readers': {
+        'table': 'readers',
+        'id': 'reader_id',
+        'fields': ('reader_id', 'name', 'reader_number', 'contact'),
+        'order': ('reader_id',),
+    },
+    'loans': {
+        'table': 'loans',
+        'id': 'loan_id',
+        'fields': ('loan_id', 'book_id', 'reader_id', 'loan_date', 'due_date', 'return_date'),
+        'order': ('loan_id',),
+    },
+}
+
+# 借阅列表 status 参数对应的条件
+LOAN_STATUS_CONDITIONS = {
+    'active': "return_date IS NULL",
+    'overdue': "return_date IS NULL AND due_date < CURRENT_DATE",
+    'returned': "return_date IS NOT NULL",
+}
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def init_app(app):
+    """按同名环境变量或 app.config 设置 API 配置，并注册蓝图。"""
+    for key, default in API_DEFAULTS.items():
+        app.config.setdefault(key, type(default)(os.environ.get(key, default)))
+    app.register_blueprint(bp)
+
+
+def parse_fields(resource):
+    """解析 fields 参数，返回要输出的字段元组；未指定时返回全部字段。"""
+    value = request.args.get('fields', '').strip()
+    if not value:
+        return resource['fields']
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in resource['fields']]
+    if unknown:
+        abort(400, description=f"未知字段: {', '.join(unknown)}")
+    return fields
+
+
+def parse_ids():
+    """解析 ids 参数 (逗号分隔的整数)，去重并保持顺序；未指定时返回 None。"""
+    value = request.args.get('ids')
+    if value is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(',') if part.strip()))
+    except ValueError:
+        abort(400, description="ids 必须是逗号分隔的整数")
+    if not ids:
+        abort(400, description="ids 不能为空")
+    if len(ids) > current_app.config['API_MAX_IDS']:
+        abort(413, description=f"每次最多读取 {current_app.config['API_MAX_IDS']} 个 ID")
+    return ids
+
+
+def serialize(row, fields):
+    """把查询结果转换成 JSON 对象，日期使用 ISO 8601 格式。"""
+    item = {}
+    for field in fields:
+        value = row[field]
+        if isinstance(value, datetime.date):
+            value = value.isoformat()
+        item[field] = value
+    return item
+
+
+def select_columns(resource, fields):
+    """查询需要的列: 输出字段加上分页排序键。"""
+    return ', '.join(dict.fromkeys(fields + resource['order'] + (resource['id'],)))
+
+
+def multi_get(resource, ids, fields):
+    """用一条 = ANY(...) 查询读取多个 ID。"""
+    rows = db.query_db(
+        f"SELECT {select_columns(resource, fields)} FROM {resource['table']} WHERE {resource['id']} = ANY(%s)",
+        [ids], row_factory='record', readonly=True)
+    found = {row[resource['id']]: row for row in rows}
+    return {
+        'data': [serialize(found[item_id], fields) for item_id in ids if item_id in found],
+        'missing': [item_id for item_id in ids if item_id not in found],
+    }
+
+
+def list_resource(resource, conditions=(), args=()):
+    """
+    按资源的排序键做键集分页，返回一页数据和翻页游标。
+    也可以用 ids 参数改为批量读取。
+    """
+    fields = parse_fields(resource)
+    ids = parse_ids()
+    if ids is not None:
+        return multi_get(resource, ids, fields)
+
+    order = resource['order']
+    per_page = request.args.get('limit', current_app.config['API_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['API_MAX_PER_PAGE']))
+    after = pagination.decode_cursor(request.args.get('after'), len(order))
+    before = pagination.decode_cursor(request.args.get('before'), len(order))
+    order_columns = ', '.join(order)
+    placeholders = ', '.join(['%s'] * len(order))
+
+    def fetch(cursor, backward, limit):
+        page_conditions = list(conditions)
+        page_args = list(args)
+        if cursor is not None:
+            page_conditions.append(
+                f"({order_columns}) {'<' if backward else '>'} ({placeholders})")
+            page_args.extend(cursor)
+        sql = f"SELECT {select_columns(resource, fields)} FROM {resource['table']}"
+        if page_conditions:
+            sql += " WHERE " + " AND ".join(page_conditions)
+        sql += " ORDER BY " + ', '.join(f"{column} DESC" if backward else column for column in order)
+        return db.query_db(sql + " LIMIT %s", page_args + [limit], row_factory='record', readonly=True)
+
+    rows, next_cursor, prev_cursor = pagination.keyset_page(
+        fetch, lambda row: tuple(row[column] for column in order), per_page, after=after, before=before)
+    return {
+        'data': [serialize(row, fields) for row in rows],
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+    }
+
+
+def get_resource(resource, item_id):
+    """按主键读取单个对象。"""
+    fields = parse_fields(resource)
+    row = db.query_db(f"SELECT {select_columns(resource, fields)} FROM {resource['table']} "
+                      f"WHERE {resource['id']} = %s", [item_id], one=True, row_factory='record', readonly=True)
+    if row is None:
+        abort(404, description="未找到该记录")
+    return serialize(row, fields)
+
+
+@bp.route('/books')
+def list_books():
+    """图书列表，支持 search (全文检索)、author、category 筛选。"""
+    conditions = []
+    args = []
+    search_term = request.args.get('search', '').strip()
+    if search_term:
+        conditions.append("(search_vector @@ fn_search_query(%s) OR isbn = %s)")
+        args.extend([search_term, search_term])
+    for column in ('author', 'category'):
+        value = request.args.get(column, '').strip()
+        if value:
+            conditions.append(f"{column} = %s")
+            args.append(value)
+    return list_resource(RESOURCES['books'], conditions, args)
+
+
+@bp.route('/books/<int:book_id>')
+def get_book(book_id):
+    return get_resource(RESOURCES['books'], book_id)
+
+
+@bp.route('/readers')
+def list_readers():
+    """读者列表。"""
+    return list_resource(RESOURCES['readers'])
+
+
+@bp.route('/readers/<int:reader_id>')
+def get_reader(reader_id):
+    return get_resource(RESOURCES['readers'], reader_id)
+
+
+@bp.route('/loans')
+def list_loans():
+    """借阅记录列表，支持 reader_id、book_id 和 status (active/overdue/returned) 筛选。"""
+    conditions = []
+    args = []
+    for column in ('reader_id', 'book_id'):
+        value = request.args.get(column, type=int)
+        if value is not None:
+            conditions.append(f"{column} = %s")
+            args.append(value)
+    status = request.args.get('status')
+    if status:
+        if status not in LOAN_STATUS_CONDITIONS:
+            abort(400, description=f"status 必须是 {', '.join(LOAN_STATUS_CONDITIONS)} 之一")
+        conditions.append(LOAN_STATUS_CONDITIONS[status])
+    return list_resource(RESOURCES['loans'], conditions, args)
+
+
+@bp.route('/loans/<int:loan_id>')
+def get_loan(loan_id):
+    return get_resource(RESOURCES['loans'], loan_id)
+
+
+@bp.errorhandler(HTTPException)
+def handle_http_error(e):
+    return {"error": e.description}, e.code
+
+
+@bp.errorhandler(psycopg2.Error)
+def handle_database_error(e):
+    current_app.logger.error(f"API 查询失败: {e}")
+    return {"error": "Database error"}, 500
+
+
+@bp.after_request
+def finalize_response(response):
+    """
+    为成功的 GET 响应加上 ETag 并处理 If-None-Match，然后按需 gzip 压缩。
+    ETag 根据未压缩的响应体计算；压缩后的表示使用带 -gzip 后缀的 ETag，
+    两种表示各自可以被缓存和验证。
+    """
+    if request.method not in ('GET', 'HEAD') or response.status_code != 200 or response.direct_passthrough:
+        return response
+    body = response.get_data()
+    compress = (len(body) >= current_app.config['API_GZIP_MIN_SIZE']
+                and request.accept_encodings['gzip'] > 0
+                and 'Content-Encoding' not in response.headers)
+    etag = hashlib.sha1(body).hexdigest()
+    if compress:
+        etag += '-gzip'
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True  # 客户端可以缓存，但每次都要用 ETag 重新验证
+    response.set_etag(etag)
+    response.make_conditional(request)
+    if compress and response.status_code == 200:
+        response.set_data(gzip.compress(body, compresslevel=current_app.config['API_GZIP_LEVEL']))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
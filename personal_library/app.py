@@ -1,27 +1,272 @@
+import datetime
 import os
+import threading
+import time
+import click
 import psycopg2
-from flask import Flask, render_template, request, redirect, url_for, flash, g, current_app
-from . import db 
-from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from flask import Flask, render_template, stream_template, request, redirect, url_for, flash, g, current_app
+from flask.cli import AppGroup
+from . import api, cache, db, metrics, pagination, startup, stats, versions
 
-load_dotenv()
 
-app = Flask(__name__)
+class Routes:
+    """
+    记录视图和命令，由 create_app() 注册到新建的应用上。
+    视图函数在导入本模块时只被记录下来，导入本模块不会创建应用 (也不会读取配置或连接数据库)。
+    """
 
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a_default_fallback_secret_key_if_not_set')
+    def __init__(self):
+        self.rules = []
+        self.cli = AppGroup(__name__)
 
-db.init_app(app)
+    def route(self, rule, **options):
+        def decorator(view):
+            self.rules.append((rule, view, options))
+            return view
+        return decorator
 
-@app.cli.command('init-db')
+    def register(self, app):
+        for rule, view, options in self.rules:
+            app.add_url_rule(rule, view_func=view, **options)
+        for command in self.cli.commands.values():
+            app.cli.add_command(command)
+
+
+routes = Routes()
+
+
+def create_app(config=None):
+    """
+    创建并配置应用。配置先取自环境变量 (包括 .env 文件)，再由 config 覆盖。
+    gunicorn 等服务器使用 personal_library.app:create_app()；flask 命令会自动找到这个函数。
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    app = Flask(__name__)
+
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a_default_fallback_secret_key_if_not_set')
+    # 图书列表分页方式: keyset (游标分页) 或 offset (页码分页)
+    app.config['BOOKS_PAGINATION_MODE'] = os.environ.get('BOOKS_PAGINATION_MODE', 'keyset')
+    # 键集分页时总数的计算方式: estimate / cached / exact / none
+    app.config['BOOKS_COUNT_MODE'] = os.environ.get('BOOKS_COUNT_MODE', 'estimate')
+    app.config['BOOKS_COUNT_CACHE_TTL'] = float(os.environ.get('BOOKS_COUNT_CACHE_TTL', 60))
+    # 图书列表页的缓存秒数 (图书详情使用 CACHE_TTL)
+    app.config['BOOKS_LIST_CACHE_TTL'] = float(os.environ.get('BOOKS_LIST_CACHE_TTL', 30))
+    # 批量借还书接口每个请求最多处理的项数
+    app.config['LOANS_BATCH_MAX_ITEMS'] = int(os.environ.get('LOANS_BATCH_MAX_ITEMS', 1000))
+    # 借阅列表每页行数及允许的最大值
+    app.config['LOANS_PER_PAGE'] = int(os.environ.get('LOANS_PER_PAGE', 50))
+    app.config['LOANS_MAX_PER_PAGE'] = int(os.environ.get('LOANS_MAX_PER_PAGE', 1000))
+    # 图书搜索方式: fulltext (全文检索，按相关度排序) 或 substring (ILIKE 子串匹配)
+    app.config['BOOKS_SEARCH_MODE'] = os.environ.get('BOOKS_SEARCH_MODE', 'fulltext')
+    # 统计页面排行榜显示的行数
+    app.config['STATS_TOP_N'] = int(os.environ.get('STATS_TOP_N', 20))
+    # 借书方式: locking (先 SELECT ... FOR UPDATE 锁定图书，再插入) 或 optimistic (单条条件 INSERT，失败时重试)
+    app.config['BORROW_MODE'] = os.environ.get('BORROW_MODE', 'locking')
+    app.config['BORROW_MAX_RETRIES'] = int(os.environ.get('BORROW_MAX_RETRIES', 3))
+    # 读者目录每页行数及 per_page 参数允许的最大值
+    app.config['READERS_PER_PAGE'] = int(os.environ.get('READERS_PER_PAGE', 50))
+    app.config['READERS_MAX_PER_PAGE'] = int(os.environ.get('READERS_MAX_PER_PAGE', 500))
+    # 借阅历史每页 (每次 "加载更早的记录") 行数及 per_page 参数允许的最大值
+    app.config['LOAN_HISTORY_PER_PAGE'] = int(os.environ.get('LOAN_HISTORY_PER_PAGE', 25))
+    app.config['LOAN_HISTORY_MAX_PER_PAGE'] = int(os.environ.get('LOAN_HISTORY_MAX_PER_PAGE', 500))
+    # 借书表单中图书/读者输入提示每次返回的最大条数
+    app.config['TYPEAHEAD_LIMIT'] = int(os.environ.get('TYPEAHEAD_LIMIT', 20))
+    if config:
+        app.config.update(config)
+    if app.config['BORROW_MODE'] not in BORROW_MODES:
+        raise ValueError(f"未知的借书方式 BORROW_MODE: {app.config['BORROW_MODE']} (可选: {', '.join(BORROW_MODES)})")
+
+    db.init_app(app)
+    metrics.init_app(app)
+    cache.init_app(app)
+    versions.init_app(app)
+    api.init_app(app)
+    startup.init_app(app)
+    routes.register(app)
+    startup.warm_up(app)
+    return app
+
+
+_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # 兼容 `from personal_library.app import app`: 第一次访问时用 create_app() 创建默认应用
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if 'app' not in globals():
+            globals()['app'] = create_app()
+    return globals()['app']
+
+@routes.cli.command('init-db')
 def init_db_command():
     """清除现有数据并创建新表。"""
     try:
-        with app.app_context():
-            db.init_db_tables()
+        db.init_db_tables()
         click.echo('数据库已初始化。')
     except Exception as e:
         click.echo(f'数据库初始化失败: {e}')
 
+@routes.cli.command('migrate-db')
+def migrate_db_command():
+    """在现有数据库上执行尚未执行的迁移脚本 (不清除数据)。"""
+    try:
+        executed = db.apply_migrations()
+        if executed:
+            click.echo('已执行迁移: ' + ', '.join(executed))
+        else:
+            click.echo('数据库已是最新版本。')
+    except Exception as e:
+        click.echo(f'数据库迁移失败: {e}')
+
+@routes.cli.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='文件格式，默认按扩展名判断。')
+@click.option('--batch-size', default=5000, show_default=True, type=click.IntRange(min=1),
+              help='每个批次 (一次提交) 的记录数。')
+def import_books_command(path, fmt, batch_size):
+    """从 CSV 或 JSONL 文件批量导入图书，按 ISBN 插入或更新。"""
+    from . import importer
+
+    def report(stats):
+        click.echo(f'已写入 {stats.inserted + stats.updated} 条 ({stats.rows_per_sec:.0f} 条/秒)')
+
+    try:
+        stats = importer.import_books(db.get_db(), importer.read_records(path, fmt),
+                                      batch_size=batch_size, progress=report)
+    except Exception as e:
+        click.echo(f'导入失败: {e}')
+        return
+    for error in stats.errors:
+        click.echo(f'跳过 {error}')
+    click.echo(f'导入完成: 读取 {stats.read} 条，新增 {stats.inserted} 条，更新 {stats.updated} 条，'
+               f'跳过 {stats.skipped} 条，用时 {stats.elapsed:.2f} 秒 ({stats.rows_per_sec:.0f} 条/秒)。')
+
+@routes.cli.command('check-indexes')
+@click.option('--no-force-index', is_flag=True,
+              help='不关闭顺序扫描，按真实统计信息检查 (适用于生产规模的数据)。')
+@click.option('--verbose', is_flag=True, help='打印完整的执行计划。')
+def check_indexes_command(no_force_index, verbose):
+    """用 EXPLAIN 检查借阅视图、删除检查和借阅历史是否使用了对应的索引。"""
+    from . import index_check
+
+    results = index_check.check_indexes(force_index=not no_force_index)
+    for result in results:
+        status = 'OK  ' if result['ok'] else 'FAIL'
+        detail = result['scan'] or '未使用'
+        click.echo(f"[{status}] {result['description']}: {result['index']} ({detail})")
+        if verbose or not result['ok']:
+            for line in index_check.format_plan(result['plan'], depth=1):
+                click.echo(line)
+    if not all(result['ok'] for result in results):
+        raise SystemExit(1)
+
+@routes.cli.command('refresh-stats')
+@click.option('--rebuild', is_flag=True,
+              help='先从 loans 全量重算每本书、每位读者的统计 (期间阻塞借还书)。')
+def refresh_stats_command(rebuild):
+    """刷新借阅统计的分类汇总，建议用 cron 定时执行。"""
+    start = time.monotonic()
+    try:
+        refreshed = stats.refresh_stats(rebuild=rebuild)
+    except Exception as e:
+        click.echo(f'刷新统计失败: {e}')
+        raise SystemExit(1)
+    if refreshed:
+        click.echo(f'统计已刷新，用时 {time.monotonic() - start:.2f} 秒。')
+    else:
+        click.echo('另一个进程正在刷新统计，已跳过。')
+
+@routes.cli.command('create-partitions')
+@click.option('--years-ahead', default=1, show_default=True, type=click.IntRange(min=0),
+              help='提前创建多少年之后的分区。')
+def create_partitions_command(years_ahead):
+    """为 loans 创建缺少的年份分区，建议用 cron 定期执行 (例如每月一次)。"""
+    from . import partitions
+
+    try:
+        created = partitions.create_partitions(years_ahead)
+        names = [name for _, name in partitions.list_partitions()]
+    except Exception as e:
+        click.echo(f'创建分区失败: {e}')
+        raise SystemExit(1)
+    click.echo(f'新建 {created} 个分区，现有分区: {", ".join(names)}')
+
+@routes.cli.command('archive-loans')
+@click.option('--before', 'before_year', required=True, type=int, help='归档该年份之前的分区。')
+@click.option('--drop', is_flag=True, help='直接删除分区，而不是移到 loans_archive schema。')
+def archive_loans_command(before_year, drop):
+    """分离早于指定年份、且借阅已全部归还的 loans 分区。"""
+    from . import partitions
+
+    try:
+        archived, skipped = partitions.archive_partitions(before_year, drop=drop)
+    except Exception as e:
+        click.echo(f'归档失败: {e}')
+        raise SystemExit(1)
+    for name in skipped:
+        click.echo(f'跳过 {name}: 仍有未归还的借阅')
+    action = '删除' if drop else f'移到 {partitions.ARCHIVE_SCHEMA}'
+    click.echo(f'已{action}: {", ".join(archived)}' if archived else '没有可归档的分区。')
+
+@routes.cli.command('notify-overdue')
+@click.option('--sink', 'sink_spec', default='file:overdue_notices.jsonl', show_default=True,
+              help='通知输出: file:路径 (追加写入 JSONL) 或 smtp://主机[:端口]。')
+@click.option('--sender', default='library@localhost', show_default=True, help='SMTP 发件人地址。')
+@click.option('--workers', default=8, show_default=True, type=click.IntRange(min=1),
+              help='并行渲染和发送通知的线程数。')
+@click.option('--min-days', default=1, show_default=True, type=click.IntRange(min=1),
+              help='只通知逾期至少这么多天的借阅。')
+@click.option('--checkpoint', default='overdue_notices.checkpoint.json', show_default=True,
+              type=click.Path(dir_okay=False), help='检查点文件。')
+@click.option('--resume', is_flag=True, help='从检查点 (当天的运行) 记录的读者之后继续。')
+def notify_overdue_command(sink_spec, sender, workers, min_days, checkpoint, resume):
+    """为每位有逾期借阅的读者生成一条逾期通知，流式读取，可中断后继续。"""
+    from . import notices
+
+    def report(stats):
+        click.echo(f'已处理 {stats.readers} 位读者、{stats.loans} 条逾期借阅 '
+                   f'({stats.notices_per_sec:.0f} 条通知/秒，{stats.loans_per_sec:.0f} 条借阅/秒)')
+
+    after_reader_id = notices.load_checkpoint(checkpoint, datetime.date.today()) if resume else 0
+    if after_reader_id:
+        click.echo(f'从读者 {after_reader_id} 之后继续。')
+    try:
+        sink = notices.create_sink(sink_spec, sender=sender)
+    except (ValueError, OSError) as e:
+        click.echo(f'无法打开通知输出: {e}')
+        raise SystemExit(1)
+    try:
+        stats = notices.send_overdue_notices(current_app.jinja_env, sink, workers=workers, min_days=min_days,
+                                             after_reader_id=after_reader_id, checkpoint=checkpoint,
+                                             progress=report)
+    except Exception as e:
+        click.echo(f'发送逾期通知失败: {e}')
+        click.echo(f'可以用 --resume 从检查点 {checkpoint} 继续。')
+        raise SystemExit(1)
+    finally:
+        sink.close()
+    click.echo(f'完成: {stats.readers} 位读者，{stats.loans} 条逾期借阅，发送 {stats.sent} 条通知，'
+               f'跳过 {stats.skipped} 位 (无可用联系方式)，用时 {stats.elapsed:.2f} 秒 '
+               f'({stats.notices_per_sec:.0f} 条通知/秒，{stats.loans_per_sec:.0f} 条借阅/秒)。')
+
+@routes.cli.command('precompile-templates')
+def precompile_templates_command():
+    """编译全部模板并写入 TEMPLATE_CACHE_DIR，之后启动的进程不必再编译模板。"""
+    start = time.monotonic()
+    try:
+        count = startup.precompile_templates(current_app)
+    except RuntimeError as e:
+        click.echo(str(e))
+        raise SystemExit(1)
+    click.echo(f"已编译 {count} 个模板到 {current_app.config['TEMPLATE_CACHE_DIR']}，"
+               f"用时 {time.monotonic() - start:.2f} 秒。")
+
 def get_int_or_none(value_str):
     """尝试将字符串转换为整数，如果字符串为空或无效则返回 None。"""
     if value_str and value_str.strip():
@@ -31,53 +276,186 @@ def get_int_or_none(value_str):
             return None
     return None
 
-@app.route('/')
+@routes.route('/')
 def index():
     """应用首页。"""
     return render_template('index.html')
 
-@app.route('/books')
-def list_books():
-    """显示所有图书列表，支持搜索。"""
-    search_term = request.args.get('search', '').strip()
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
+# 列表和详情页读取的图书列 (不读取 search_vector，它只用于检索)
+BOOK_COLUMNS = "book_id, title, author, isbn, publisher, publication_year, category, total_stock, available_stock"
 
-    query = "SELECT * FROM books"
-    count_query = "SELECT COUNT(*) FROM books"
-    args = []
-    conditions = []
+# 高频执行的固定语句，在每个连接上 PREPARE 一次后按名称执行 (见 db.register_statement)
+BOOK_BY_ID = db.register_statement('book_by_id', f"SELECT {BOOK_COLUMNS} FROM books WHERE book_id = %s")
+READER_BY_ID = db.register_statement(
+    'reader_by_id', "SELECT reader_id, name, reader_number, contact FROM readers WHERE reader_id = %s")
+LOCK_BOOK_STOCK = db.register_statement(
+    'lock_book_stock', "SELECT available_stock FROM books WHERE book_id = %s FOR UPDATE")
+INSERT_LOAN = db.register_statement(
+    'insert_loan', "INSERT INTO loans (book_id, reader_id, due_date, loan_date) VALUES (%s, %s, %s, CURRENT_DATE)")
+LOCK_ACTIVE_LOAN = db.register_statement(
+    'lock_active_loan', "SELECT book_id FROM loans WHERE loan_id = %s AND return_date IS NULL FOR UPDATE")
+RETURN_LOAN = db.register_statement(
+    'return_loan', "UPDATE loans SET return_date = CURRENT_DATE WHERE loan_id = %s")
 
+def parse_book_list_args(args, config=None):
+    """
+    解析图书列表的查询参数 (同步视图和 asgi 模块的异步视图共用)。
+    :param config: 应用配置，默认为当前 Flask 应用的配置。
+    :return: 包含 search_term, ranked, page, after, before, keyset, per_page 的字典。
+    """
+    config = current_app.config if config is None else config
+    search_term = args.get('search', '').strip()
+    search_mode = args.get('search_mode', config['BOOKS_SEARCH_MODE'])
+    ranked = bool(search_term) and search_mode == 'fulltext'
+    after = pagination.decode_cursor(args.get('after'), 2)
+    before = pagination.decode_cursor(args.get('before'), 2)
+    keyset = not ranked and (after is not None or before is not None or (
+        'page' not in args and config['BOOKS_PAGINATION_MODE'] == 'keyset'))
+    return {'search_term': search_term, 'ranked': ranked, 'page': args.get('page', 1, type=int),
+            'after': after, 'before': before, 'keyset': keyset, 'per_page': 10}
+
+def book_search_conditions(search_term, ranked):
+    """图书搜索的 WHERE 条件，返回 (conditions, args)。"""
+    if ranked:
+        return ["(search_vector @@ fn_search_query(%s) OR isbn = %s)"], [search_term, search_term]
     if search_term:
-        conditions.append("(title ILIKE %s OR author ILIKE %s OR isbn = %s)")
-        args.extend([f'%{search_term}%', f'%{search_term}%', search_term])
+        return (["(title ILIKE %s OR author ILIKE %s OR isbn = %s)"],
+                [f'%{search_term}%', f'%{search_term}%', search_term])
+    return [], []
 
+def book_keyset_sql(conditions, args, cursor, backward, limit):
+    """按 (title, book_id) 键集分页读取一页图书的 SQL，返回 (sql, args)。"""
+    conditions = list(conditions)
+    args = list(args)
+    if cursor is not None:
+        conditions.append("(title, book_id) < (%s, %s)" if backward else "(title, book_id) > (%s, %s)")
+        args.extend(cursor)
+    sql = f"SELECT {BOOK_COLUMNS} FROM books"
     if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-        count_query += " WHERE " + " AND ".join(conditions)
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY title DESC, book_id DESC" if backward else " ORDER BY title, book_id"
+    return sql + " LIMIT %s", args + [limit]
 
-    query += " ORDER BY title LIMIT %s OFFSET %s"
-    offset = (page - 1) * per_page
-    args_paginated = args + [per_page, offset]
+def book_offset_sql(params, conditions, args):
+    """按页码 (LIMIT/OFFSET) 读取一页图书的 SQL；全文检索时按相关度排序。返回 (sql, args)。"""
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    if params['ranked']:
+        order_by = " ORDER BY ts_rank(search_vector, fn_search_query(%s)) DESC, title, book_id"
+        order_args = [params['search_term']]
+    else:
+        order_by = " ORDER BY title, book_id"
+        order_args = []
+    offset = (params['page'] - 1) * params['per_page']
+    return (f"SELECT {BOOK_COLUMNS} FROM books" + where + order_by + " LIMIT %s OFFSET %s",
+            list(args) + order_args + [params['per_page'], offset])
 
+def book_list_cache_key(book_cache, query_string):
+    """图书列表页的缓存键，包含图书列表的版本号，任何图书变更 (包括库存) 都会使所有列表页失效。"""
+    return 'books:{}:{}'.format(book_cache.generation('books'), query_string)
+
+@routes.route('/books')
+@versions.conditional_page('books')
+def list_books():
+    """
+    显示所有图书列表，支持搜索。
+    默认使用按 (title, book_id) 的键集分页，通过 after/before 游标翻页；
+    带 page 参数的旧链接仍使用 LIMIT/OFFSET 分页。
+    搜索默认使用全文检索 (search_vector GIN 索引) 并按相关度排序，结果按页码分页；
+    search_mode=substring 时使用原来的 ILIKE 子串匹配。
+    """
+    params = parse_book_list_args(request.args)
+    page = params['page']
+    per_page = params['per_page']
+    conditions, args = book_search_conditions(params['search_term'], params['ranked'])
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    count_query = "SELECT COUNT(*) FROM books" + where
+
+    def fetch_keyset(cursor, backward, limit):
+        return db.query_db(*book_keyset_sql(conditions, args, cursor, backward, limit), row_factory='record')
+
+    def load_page():
+        if params['keyset']:
+            books, next_cursor, prev_cursor = pagination.keyset_page(
+                fetch_keyset, lambda book: (book['title'], book['book_id']), per_page,
+                after=params['after'], before=params['before'])
+            total_books = count_books("SELECT book_id FROM books" + where, count_query, args)
+            total_pages = 0
+        else:
+            books = db.query_db(*book_offset_sql(params, conditions, args), row_factory='record')
+            total_books_row = db.query_db(count_query, args, one=True)
+            total_books = total_books_row[0] if total_books_row else 0
+            total_pages = (total_books + per_page - 1) // per_page
+            next_cursor = prev_cursor = None
+        # Record 可以直接缓存 (共享缓存中按列名序列化)，不必逐行转换成字典
+        return {'books': books, 'next_cursor': next_cursor,
+                'prev_cursor': prev_cursor, 'total_books': total_books, 'total_pages': total_pages}
+
+    book_cache = cache.get_cache()
+    cache_key = book_list_cache_key(book_cache, request.query_string.decode('utf-8'))
     try:
-        books = db.query_db(query, args_paginated)
-        total_books_row = db.query_db(count_query, args, one=True)
-        total_books = total_books_row[0] if total_books_row else 0
-        total_pages = (total_books + per_page - 1) // per_page
+        data = book_cache.get_or_set(cache_key, load_page, ttl=current_app.config['BOOKS_LIST_CACHE_TTL'])
     except psycopg2.Error as e:
         flash(f'查询图书时发生错误: {e}', 'danger')
-        books = []
-        total_pages = 0
+        data = {'books': [], 'next_cursor': None, 'prev_cursor': None, 'total_books': None, 'total_pages': 0}
         page = 1
 
     return render_template('books/list.html',
-                           books=books,
-                           search_term=search_term,
+                           books=data['books'],
+                           search_term=params['search_term'],
+                           search_mode=request.args.get('search_mode'),
                            current_page=page,
-                           total_pages=total_pages)
+                           total_pages=data['total_pages'],
+                           keyset=params['keyset'],
+                           next_cursor=data['next_cursor'],
+                           prev_cursor=data['prev_cursor'],
+                           total_books=data['total_books'],
+                           count_mode=current_app.config['BOOKS_COUNT_MODE'])
+
+def invalidate_book_cache(book_id=None):
+    """
+    在本进程内立即使图书缓存失效 (写操作提交之后调用)。
+    其他进程通过数据库触发器的 NOTIFY 收到同样的失效通知。
+    """
+    book_cache = cache.get_cache()
+    if book_id is not None:
+        book_cache.delete(f'book:{book_id}')
+    book_cache.bump('books')
 
-@app.route('/books/new', methods=['GET', 'POST'])
+# 精确计数的进程内缓存: count_query 参数 -> (过期时间, 行数)
+_book_count_cache = {}
+
+def count_books(select_query, count_query, args):
+    """
+    按 BOOKS_COUNT_MODE 计算图书总数，供键集分页显示。
+    - exact: 每次执行 COUNT(*)
+    - cached: COUNT(*) 结果在进程内缓存 BOOKS_COUNT_CACHE_TTL 秒
+    - estimate: 使用 pg_class/查询计划的估计值，代价与表大小无关
+    - none: 不显示总数
+    """
+    mode = current_app.config['BOOKS_COUNT_MODE']
+    if mode == 'none':
+        return None
+    if mode == 'estimate':
+        if not args:
+            estimated = db.estimate_table_rows('books')
+            if estimated is not None:
+                return estimated
+        else:
+            return db.estimate_count(select_query, args)
+    if mode == 'cached':
+        key = tuple(args)
+        cached = _book_count_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+    row = db.query_db(count_query, args, one=True)
+    total = row[0] if row else 0
+    if mode == 'cached':
+        if len(_book_count_cache) > 1000:
+            _book_count_cache.clear()
+        _book_count_cache[tuple(args)] = (time.monotonic() + current_app.config['BOOKS_COUNT_CACHE_TTL'], total)
+    return total
+
+@routes.route('/books/new', methods=['GET', 'POST'])
 def add_book():
     """添加新图书。"""
     if request.method == 'POST':
@@ -104,6 +482,7 @@ def add_book():
             """
             try:
                 db.query_db(sql, (title, author, isbn, publisher, publication_year, category, total_stock, available_stock), commit=True)
+                invalidate_book_cache()
                 flash('图书添加成功!', 'success')
                 return redirect(url_for('list_books'))
             except psycopg2.IntegrityError as e:
@@ -126,10 +505,10 @@ def add_book():
 
     return render_template('books/form.html', action_text='添加', book=None, form_action=url_for('add_book'))
 
-@app.route('/books/edit/<int:book_id>', methods=['GET', 'POST'])
+@routes.route('/books/edit/<int:book_id>', methods=['GET', 'POST'])
 def edit_book(book_id):
     """编辑现有图书信息。"""
-    book = db.query_db('SELECT * FROM books WHERE book_id = %s', [book_id], one=True)
+    book = db.query_db(BOOK_BY_ID, [book_id], one=True)
     if not book:
         flash('未找到该图书。', 'warning')
         return redirect(url_for('list_books'))
@@ -164,6 +543,7 @@ def edit_book(book_id):
             """
             try:
                 db.query_db(sql, (title, author, isbn, publisher, publication_year, category, total_stock, available_stock, book_id), commit=True)
+                invalidate_book_cache(book_id)
                 flash('图书信息更新成功!', 'success')
                 return redirect(url_for('list_books'))
             except psycopg2.IntegrityError as e:
@@ -190,7 +570,7 @@ def edit_book(book_id):
     return render_template('books/form.html', action_text='更新', book=book, form_action=url_for('edit_book', book_id=book_id))
 
 
-@app.route('/books/delete/<int:book_id>', methods=['POST'])
+@routes.route('/books/delete/<int:book_id>', methods=['POST'])
 def delete_book(book_id):
     """删除图书。"""
     active_loans = db.query_db("SELECT 1 FROM loans WHERE book_id = %s AND return_date IS NULL LIMIT 1", [book_id], one=True)
@@ -199,6 +579,7 @@ def delete_book(book_id):
     else:
         try:
             deleted_rows = db.query_db('DELETE FROM books WHERE book_id = %s', [book_id], commit=True)
+            invalidate_book_cache(book_id)
             if deleted_rows > 0:
                 flash('图书删除成功!', 'success')
             else:
@@ -214,40 +595,124 @@ def delete_book(book_id):
             flash(f'删除图书时发生未知错误: {e}', 'danger')
     return redirect(url_for('list_books'))
 
-@app.route('/books/<int:book_id>', methods=['GET'])
+@routes.route('/books/<int:book_id>', methods=['GET'])
 def get_book(book_id):
-    """返回指定图书的详细信息（JSON 格式）。"""
+    """返回指定图书的详细信息（JSON 格式），结果通过读穿缓存提供。"""
+    book_cache = cache.get_cache()
+    cache_key = f'book:{book_id}'
+    book_json = book_cache.get(cache_key)
+    if book_json is not cache.MISSING:
+        return book_json, 200
     try:
-        book = db.query_db("SELECT * FROM books WHERE book_id = %s", [book_id], one=True)
+        book = db.query_db(BOOK_BY_ID, [book_id], one=True, row_factory='record')
         if not book:
             return {"error": "Book not found"}, 404
-        book_json = {
-            "book_id": book["book_id"],
-            "title": book["title"],
-            "author": book["author"],
-            "isbn": book["isbn"],
-            "publisher": book["publisher"],
-            "publication_year": book["publication_year"],
-            "category": book["category"],
-            "total_stock": book["total_stock"],
-            "available_stock": book["available_stock"]
-        }
+        book_json = api.serialize(book, api.RESOURCES['books']['fields'])
+        book_cache.set(cache_key, book_json)
         return book_json, 200
     except psycopg2.Error as e:
         current_app.logger.error(f"查询图书详情失败: {e}")
         return {"error": "Database error"}, 500
 
-@app.route('/readers')
+@routes.route('/cache/stats')
+def cache_stats():
+    """返回缓存命中/未命中等计数（JSON 格式）。"""
+    return cache.get_cache().stats(), 200
+
+@routes.route('/metrics')
+def prometheus_metrics():
+    """以 Prometheus 文本格式返回请求、SQL 语句、连接池和缓存指标。"""
+    replicas = db.get_replicas()
+    body = metrics.render_prometheus(pool_stats=db.get_pool().stats(), cache_stats=cache.get_cache().stats(),
+                                     replica_stats=replicas.stats() if replicas else None)
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@routes.route('/metrics/slow-queries')
+def slow_queries():
+    """返回最近的慢查询 (JSON 格式)，包括语句指纹、耗时和 EXPLAIN 执行计划。"""
+    return {"slow_queries": list(reversed(metrics.slow_queries))}, 200
+
+@routes.route('/stats')
+def stats_dashboard():
+    """借阅统计: 热门图书、活跃读者和按分类汇总，全部读取预先汇总的统计表。"""
+    top_n = current_app.config['STATS_TOP_N']
+    try:
+        books = stats.popular_books(top_n)
+        readers = stats.active_readers(top_n)
+        categories = stats.category_loans()
+    except psycopg2.Error as e:
+        flash(f'加载统计数据失败: {e}', 'danger')
+        books, readers, categories = [], [], []
+    totals = {
+        'loan_count': sum(category.loan_count for category in categories),
+        'active_count': sum(category.active_count for category in categories),
+        'book_count': sum(category.book_count for category in categories),
+    }
+    refreshed_at = categories[0].refreshed_at if categories else None
+    return render_template('stats/dashboard.html', books=books, readers=readers, categories=categories,
+                           totals=totals, refreshed_at=refreshed_at)
+
+
+READER_COLUMNS = "reader_id, name, reader_number, contact"
+
+def reader_page_sql(search_term, cursor, backward, limit):
+    """
+    按 (name, reader_id) 键集分页读取一页读者的 SQL，返回 (sql, args)。
+    有搜索词时匹配姓名前缀 (不区分大小写)、读者编号前缀或联系方式前缀 (不区分大小写)。
+    搜索时匹配的行先在 MATERIALIZED CTE 中通过三个前缀索引的 BitmapOr 取出再排序，耗时与匹配行数成正比；
+    否则规划器可能沿 (name, reader_id) 索引逐行过滤，匹配的读者排在后面时几乎要扫描整张表。
+    """
+    conditions = []
+    args = []
+    if search_term:
+        conditions.append("(lower(name) LIKE %s OR reader_number LIKE %s OR lower(contact) LIKE %s)")
+        args.extend([like_prefix(search_term.lower()), like_prefix(search_term), like_prefix(search_term.lower())])
+    if cursor is not None:
+        conditions.append("(name, reader_id) < (%s, %s)" if backward else "(name, reader_id) > (%s, %s)")
+        args.extend(cursor)
+    sql = f"SELECT {READER_COLUMNS} FROM readers"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if search_term:
+        sql = f"WITH matches AS MATERIALIZED ({sql}) SELECT * FROM matches"
+    sql += " ORDER BY name DESC, reader_id DESC" if backward else " ORDER BY name, reader_id"
+    return sql + " LIMIT %s", args + [limit]
+
+@routes.route('/readers')
+@versions.conditional_page('readers', readonly=True)
 def list_readers():
-    """显示所有读者列表。"""
+    """
+    读者目录: 按 (name, reader_id) 键集分页，通过 after/before 游标翻页。
+    search 参数按姓名、读者编号或联系方式的前缀查找；format=json 时返回同样分页的 JSON，
+    供借还书台快速查找读者。
+    """
+    search_term = request.args.get('search', '').strip()
+    per_page = request.args.get('per_page', current_app.config['READERS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['READERS_MAX_PER_PAGE']))
+    after = pagination.decode_cursor(request.args.get('after'), 2)
+    before = pagination.decode_cursor(request.args.get('before'), 2)
+    as_json = request.args.get('format') == 'json'
+
+    def fetch(cursor, backward, limit):
+        return db.query_db(*reader_page_sql(search_term, cursor, backward, limit),
+                           row_factory='record', readonly=True)
+
     try:
-        readers = db.query_db("SELECT * FROM readers ORDER BY name")
+        readers, next_cursor, prev_cursor = pagination.keyset_page(
+            fetch, lambda reader: (reader.name, reader.reader_id), per_page, after=after, before=before)
     except psycopg2.Error as e:
+        if as_json:
+            return {"error": "Database error"}, 500
         flash(f'查询读者列表失败: {e}', 'danger')
-        readers = []
-    return render_template('readers/list.html', readers=readers)
+        readers, next_cursor, prev_cursor = [], None, None
+    if as_json:
+        return {'data': [dict(reader) for reader in readers], 'next_cursor': next_cursor,
+                'prev_cursor': prev_cursor}
+    return render_template('readers/list.html', readers=readers, search_term=search_term,
+                           next_cursor=next_cursor, prev_cursor=prev_cursor,
+                           per_page=request.args.get('per_page', type=int))
 
-@app.route('/readers/new', methods=['GET', 'POST'])
+@routes.route('/readers/new', methods=['GET', 'POST'])
 def add_reader():
     """添加新读者。"""
     if request.method == 'POST':
@@ -276,10 +741,10 @@ def add_reader():
     return render_template('readers/form.html', action_text='添加', reader=None, form_action=url_for('add_reader'))
 
 
-@app.route('/readers/edit/<int:reader_id>', methods=['GET', 'POST'])
+@routes.route('/readers/edit/<int:reader_id>', methods=['GET', 'POST'])
 def edit_reader(reader_id):
     """编辑读者信息。"""
-    reader = db.query_db("SELECT * FROM readers WHERE reader_id = %s", [reader_id], one=True)
+    reader = db.query_db(READER_BY_ID, [reader_id], one=True)
     if not reader:
         flash('未找到该读者。', 'warning')
         return redirect(url_for('list_readers'))
@@ -312,7 +777,7 @@ def edit_reader(reader_id):
 
     return render_template('readers/form.html', action_text='更新', reader=reader, form_action=url_for('edit_reader', reader_id=reader_id))
 
-@app.route('/readers/delete/<int:reader_id>', methods=['POST'])
+@routes.route('/readers/delete/<int:reader_id>', methods=['POST'])
 def delete_reader(reader_id):
     """删除读者。"""
     active_loans = db.query_db("SELECT 1 FROM loans WHERE reader_id = %s AND return_date IS NULL LIMIT 1", [reader_id], one=True)
@@ -331,7 +796,75 @@ def delete_reader(reader_id):
     return redirect(url_for('list_readers'))
 
 
-@app.route('/loans/borrow', methods=['GET', 'POST'])
+# 借书的结果
+BORROW_OK = 'ok'
+BORROW_OUT_OF_STOCK = 'out_of_stock'
+BORROW_NOT_FOUND = 'not_found'
+
+# 有库存时才插入借阅记录的单条语句；库存由 loans 上的触发器扣减。
+# CTE 中的 FOR NO KEY UPDATE 让同一本书的并发借书在语句开头排队，拿到锁后在最新版本上重新检查库存，
+# 而不是先各自插入，再一起在触发器扣减库存和外键的 KEY SHARE 锁上争抢同一图书行
+BORROW_IF_AVAILABLE = db.register_statement('borrow_if_available', """
+    WITH book AS (
+        SELECT book_id FROM books WHERE book_id = %s AND available_stock > 0 FOR NO KEY UPDATE
+    )
+    INSERT INTO loans (book_id, reader_id, due_date, loan_date)
+    SELECT book_id, %s, %s, CURRENT_DATE FROM book
+    RETURNING loan_id
+""")
+BOOK_STOCK = db.register_statement('book_stock', "SELECT available_stock FROM books WHERE book_id = %s")
+
+
+def borrow_locking(conn, cur, book_id, reader_id, due_date):
+    """
+    悲观借书: SELECT ... FOR UPDATE 锁定图书行，确认有库存后插入借阅记录并提交。
+    同一本书的并发借书在行锁上排队，锁从第一条语句一直持有到提交。
+    """
+    db.execute_statement(cur, LOCK_BOOK_STOCK, (book_id,))
+    row = cur.fetchone()
+    if row is None or row[0] <= 0:
+        conn.rollback()
+        return BORROW_NOT_FOUND if row is None else BORROW_OUT_OF_STOCK
+    db.execute_statement(cur, INSERT_LOAN, (book_id, reader_id, due_date))
+    conn.commit()
+    return BORROW_OK
+
+
+def borrow_optimistic(conn, cur, book_id, reader_id, due_date):
+    """
+    单语句借书: 用一条 INSERT ... SELECT ... WHERE available_stock > 0 在一次往返中完成检查、锁定和插入，
+    图书行只从这条语句持有到紧随其后的提交，不再跨两次往返。
+    与批量借书等其他路径并发扣减库存时仍可能在 chk_available_stock 上失败 (或遇到序列化失败/死锁)，
+    这时回滚并在新的快照上重试，最多 BORROW_MAX_RETRIES 次；重试时看到的库存为 0 就直接返回库存不足。
+    """
+    retries = current_app.config['BORROW_MAX_RETRIES']
+    for attempt in range(retries + 1):
+        try:
+            db.execute_statement(cur, BORROW_IF_AVAILABLE, (book_id, reader_id, due_date))
+            row = cur.fetchone()
+            if row is not None:
+                conn.commit()
+                return BORROW_OK
+        except (psycopg2.errors.CheckViolation, psycopg2.errors.SerializationFailure,
+                psycopg2.errors.DeadlockDetected) as e:
+            conn.rollback()
+            lost_race = (not isinstance(e, psycopg2.errors.CheckViolation)
+                         or e.diag.constraint_name == 'chk_available_stock')
+            if not lost_race or attempt == retries:
+                raise
+            continue
+        # 没有插入: 图书不存在或没有库存，再读一次区分两者
+        db.execute_statement(cur, BOOK_STOCK, (book_id,))
+        stock = cur.fetchone()
+        conn.rollback()
+        return BORROW_NOT_FOUND if stock is None else BORROW_OUT_OF_STOCK
+
+
+# BORROW_MODE -> 借书函数，函数在成功时提交，其余情况回滚
+BORROW_MODES = {'locking': borrow_locking, 'optimistic': borrow_optimistic}
+
+
+@routes.route('/loans/borrow', methods=['GET', 'POST'])
 def borrow_book():
     """处理借书请求。"""
     if request.method == 'POST':
@@ -348,22 +881,14 @@ def borrow_book():
             conn = db.get_db()
             cur = conn.cursor()
             try:
-                cur.execute("SELECT available_stock FROM books WHERE book_id = %s FOR UPDATE;", (book_id,))
-                book_stock_info = cur.fetchone()
-
-                if book_stock_info and book_stock_info[0] > 0:
-                    cur.execute("""
-                        INSERT INTO loans (book_id, reader_id, due_date, loan_date)
-                        VALUES (%s, %s, %s, CURRENT_DATE);
-                    """, (book_id, reader_id, due_date_str))
-                    conn.commit()
+                result = BORROW_MODES[current_app.config['BORROW_MODE']](conn, cur, book_id, reader_id, due_date_str)
+                if result == BORROW_OK:
+                    invalidate_book_cache(book_id)
                     flash('借书成功!', 'success')
                     return redirect(url_for('list_active_loans'))
-                elif book_stock_info and book_stock_info[0] <= 0:
-                    conn.rollback()
+                elif result == BORROW_OUT_OF_STOCK:
                     flash('借书失败：该图书库存不足。', 'danger')
                 else:
-                    conn.rollback()
                     flash('借书失败：未找到该图书或图书信息有误。', 'danger')
 
             except psycopg2.Error as e:
@@ -381,24 +906,95 @@ def borrow_book():
                 if cur:
                     cur.close()
 
+    # 图书和读者由 select2 通过 /loans/borrow/books 和 /loans/borrow/readers 按输入远程查询，
+    # 表单本身只需要回显已选中的项 (提交失败后重新显示，或通过 ?book_id=&reader_id= 预选)
+    selected_book = selected_reader = None
     try:
-        books_for_loan = db.query_db("SELECT book_id, title, author, available_stock FROM books WHERE available_stock > 0 ORDER BY title")
-        readers_list = db.query_db("SELECT reader_id, name, reader_number FROM readers ORDER BY name")
+        book_id = get_int_or_none(request.values.get('book_id'))
+        reader_id = get_int_or_none(request.values.get('reader_id'))
+        if book_id:
+            selected_book = db.query_db(BOOK_BY_ID, (book_id,), one=True, row_factory='record')
+        if reader_id:
+            selected_reader = db.query_db(READER_BY_ID, (reader_id,), one=True, row_factory='record')
     except psycopg2.Error as e:
         flash(f'加载借书表单数据失败: {e}', 'danger')
-        books_for_loan = []
-        readers_list = []
 
-    return render_template('loans/borrow_form.html', books=books_for_loan, readers=readers_list)
+    return render_template('loans/borrow_form.html', selected_book=selected_book, selected_reader=selected_reader,
+                           due_date=request.form.get('due_date', ''))
+
+
+def like_prefix(term):
+    """把用户输入转换为 LIKE 前缀模式，转义其中的 %、_ 和反斜杠。"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
 
 
-@app.route('/loans/return/<int:loan_id>', methods=['POST'])
+# 输入提示查询: 前缀条件和排序都由 text_pattern_ops 表达式索引满足，只读取 LIMIT 行，与表的大小无关。
+# 不注册为预备语句: 通用计划无法根据参数值推出 LIKE 前缀的索引范围。
+BOOK_TYPEAHEAD_SQL = """
+    SELECT book_id, title, author, available_stock FROM books
+    WHERE lower(title) LIKE %s AND available_stock > 0
+    ORDER BY lower(title) USING ~<~, book_id
+    LIMIT %s
+"""
+BOOK_BY_ISBN_SQL = "SELECT book_id, title, author, available_stock FROM books WHERE isbn = %s AND available_stock > 0"
+READER_TYPEAHEAD_SQL = """
+    SELECT reader_id, name, reader_number FROM (
+        (SELECT reader_id, name, reader_number FROM readers
+         WHERE lower(name) LIKE %s ORDER BY lower(name) USING ~<~, reader_id LIMIT %s)
+        UNION
+        (SELECT reader_id, name, reader_number FROM readers
+         WHERE reader_number LIKE %s ORDER BY reader_number USING ~<~ LIMIT %s)
+    ) AS matches
+    ORDER BY lower(name) USING ~<~, reader_id
+    LIMIT %s
+"""
+
+
+def typeahead_response(results):
+    """select2 远程数据格式的响应；结果随借还书变化，只允许浏览器短暂缓存。"""
+    response = current_app.json.response({'results': results})
+    response.cache_control.private = True
+    response.cache_control.max_age = 10
+    return response
+
+
+@routes.route('/loans/borrow/books')
+def typeahead_books():
+    """借书表单的图书输入提示: 按书名前缀 (不区分大小写) 或完整 ISBN 匹配有库存的图书。"""
+    term = request.args.get('q', '').strip()
+    if not term:
+        return typeahead_response([])
+    limit = current_app.config['TYPEAHEAD_LIMIT']
+    books = db.query_db(BOOK_BY_ISBN_SQL, [term], row_factory='record', readonly=True)
+    books += db.query_db(BOOK_TYPEAHEAD_SQL, [like_prefix(term.lower()), limit], row_factory='record',
+                         readonly=True)
+    results = {}
+    for book in books:
+        results.setdefault(book.book_id, {'id': book.book_id,
+                                          'text': f"{book.title} (库存: {book.available_stock})"})
+    return typeahead_response(list(results.values())[:limit])
+
+
+@routes.route('/loans/borrow/readers')
+def typeahead_readers():
+    """借书表单的读者输入提示: 按姓名前缀 (不区分大小写) 或读者编号前缀匹配。"""
+    term = request.args.get('q', '').strip()
+    if not term:
+        return typeahead_response([])
+    limit = current_app.config['TYPEAHEAD_LIMIT']
+    readers = db.query_db(READER_TYPEAHEAD_SQL, [like_prefix(term.lower()), limit, like_prefix(term), limit, limit],
+                          row_factory='record', readonly=True)
+    return typeahead_response([{'id': reader.reader_id, 'text': f"{reader.name} (编号: {reader.reader_number})"}
+                               for reader in readers])
+
+
+@routes.route('/loans/return/<int:loan_id>', methods=['POST'])
 def return_book(loan_id):
     """处理还书请求。"""
     conn = db.get_db()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT book_id FROM loans WHERE loan_id = %s AND return_date IS NULL FOR UPDATE;", (loan_id,))
+        db.execute_statement(cur, LOCK_ACTIVE_LOAN, (loan_id,))
         loan_info = cur.fetchone()
 
         if not loan_info:
@@ -406,9 +1002,10 @@ def return_book(loan_id):
             flash('无效的借阅记录或图书已归还。', 'warning')
             return redirect(url_for('list_active_loans'))
 
-        cur.execute("UPDATE loans SET return_date = CURRENT_DATE WHERE loan_id = %s;", (loan_id,))
+        db.execute_statement(cur, RETURN_LOAN, (loan_id,))
         
         conn.commit()
+        invalidate_book_cache(loan_info[0])
         flash('还书成功!', 'success')
     except psycopg2.Error as e:
         conn.rollback()  
@@ -427,91 +1024,404 @@ def return_book(loan_id):
     return redirect(url_for('list_active_loans'))
 
 
-@app.route('/loans/active')
-def list_active_loans():
-    """显示当前所有未归还的借阅记录。"""
+def read_batch_items(key):
+    """
+    读取批量接口的 JSON 请求体: 可以是列表本身，也可以是 {key: [...]}。
+    :return: (items, error_response)，请求体无效时 items 为 None。
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get(key) if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        return None, ({"error": f"请求体必须是非空的 JSON 列表或 {{\"{key}\": [...]}}"}, 400)
+    if len(items) > current_app.config['LOANS_BATCH_MAX_ITEMS']:
+        return None, ({"error": f"每批最多 {current_app.config['LOANS_BATCH_MAX_ITEMS']} 项"}, 413)
+    return items, None
+
+def batch_response(results):
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    return {"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}, 200
+
+
+@routes.route('/loans/batch/borrow', methods=['POST'])
+def batch_borrow_books():
+    """
+    批量借书 (JSON)。请求体为 [{"book_id", "reader_id", "due_date"}, ...]。
+    所有借阅在一个事务中处理: 按 book_id 顺序锁定涉及的图书 (避免并发批次之间死锁)，
+    在内存中分配库存，再用一条多行 INSERT 写入，返回每一项的结果。
+    """
+    items, error = read_batch_items('loans')
+    if error:
+        return error
+
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            book_id = int(item['book_id'])
+            reader_id = int(item['reader_id'])
+            due_date = datetime.date.fromisoformat(str(item['due_date']))
+        except (KeyError, TypeError, ValueError):
+            results[index] = {"index": index, "status": "error",
+                              "error": "book_id、reader_id 和 due_date (YYYY-MM-DD) 均为必填项"}
+            continue
+        parsed.append((index, book_id, reader_id, due_date))
+
+    conn = db.get_db()
+    cur = conn.cursor()
     try:
-        active_loans = db.query_db("SELECT * FROM view_activeloans ORDER BY due_date;")
+        book_ids = sorted({book_id for _, book_id, _, _ in parsed})
+        reader_ids = sorted({reader_id for _, _, reader_id, _ in parsed})
+        cur.execute("SELECT book_id, available_stock FROM books WHERE book_id = ANY(%s) ORDER BY book_id FOR UPDATE;",
+                    (book_ids,))
+        stock = dict(cur.fetchall())
+        # FOR KEY SHARE 防止读者在事务提交前被删除
+        cur.execute("SELECT reader_id FROM readers WHERE reader_id = ANY(%s) ORDER BY reader_id FOR KEY SHARE;",
+                    (reader_ids,))
+        existing_readers = {row[0] for row in cur.fetchall()}
+
+        accepted = []
+        for index, book_id, reader_id, due_date in parsed:
+            if book_id not in stock:
+                results[index] = {"index": index, "status": "error", "error": "未找到该图书"}
+            elif reader_id not in existing_readers:
+                results[index] = {"index": index, "status": "error", "error": "未找到该读者"}
+            elif stock[book_id] <= 0:
+                results[index] = {"index": index, "status": "error", "error": "该图书库存不足"}
+            else:
+                stock[book_id] -= 1
+                accepted.append((index, book_id, reader_id, due_date))
+
+        if accepted:
+            # 预先分配 loan_id，使每一项的结果与请求中的位置一一对应
+            cur.execute("SELECT nextval(pg_get_serial_sequence('loans', 'loan_id')) FROM generate_series(1, %s);",
+                        (len(accepted),))
+            loan_ids = [row[0] for row in cur.fetchall()]
+            execute_values(cur, """
+                INSERT INTO loans (loan_id, book_id, reader_id, due_date, loan_date) VALUES %s;
+            """, [(loan_id, book_id, reader_id, due_date)
+                  for loan_id, (_, book_id, reader_id, due_date) in zip(loan_ids, accepted)],
+                template="(%s, %s, %s, %s, CURRENT_DATE)", page_size=len(accepted))
+            for loan_id, (index, book_id, _, _) in zip(loan_ids, accepted):
+                results[index] = {"index": index, "status": "ok", "loan_id": loan_id, "book_id": book_id}
+        conn.commit()
     except psycopg2.Error as e:
-        flash(f'查询当前借阅记录失败: {e}', 'danger')
-        active_loans = []
-    return render_template('loans/active_loans.html', loans=active_loans)
+        conn.rollback()
+        current_app.logger.error(f"批量借书失败: {e}")
+        return {"error": f"批量借书失败: {e}"}, 500
+    finally:
+        cur.close()
 
+    for book_id in {result['book_id'] for result in results if result['status'] == 'ok'}:
+        invalidate_book_cache(book_id)
+    return batch_response(results)
 
-@app.route('/loans/overdue')
-def list_overdue_loans():
-    """显示所有已逾期未归还的借阅记录。"""
+
+@routes.route('/loans/batch/return', methods=['POST'])
+def batch_return_books():
+    """
+    批量还书 (JSON)。请求体为 [loan_id, ...] 或 {"loan_ids": [...]}。
+    先按 loan_id 顺序锁定借阅记录，再按 book_id 顺序锁定图书 (与单本还书的加锁顺序一致，避免死锁)，
+    然后用一条 UPDATE 归还所有借阅，返回每一项的结果。
+    """
+    items, error = read_batch_items('loan_ids')
+    if error:
+        return error
+
+    loan_ids = []
+    for item in items:
+        try:
+            loan_ids.append(int(item))
+        except (TypeError, ValueError):
+            loan_ids.append(None)
+
+    conn = db.get_db()
+    cur = conn.cursor()
     try:
-        overdue_loans = db.query_db("SELECT * FROM view_overdueloans ORDER BY due_date;")
+        valid_ids = sorted({loan_id for loan_id in loan_ids if loan_id is not None})
+        cur.execute("""
+            SELECT loan_id, book_id FROM loans
+            WHERE loan_id = ANY(%s) AND return_date IS NULL
+            ORDER BY loan_id FOR UPDATE;
+        """, (valid_ids,))
+        book_ids = sorted({row[1] for row in cur.fetchall()})
+        cur.execute("SELECT book_id FROM books WHERE book_id = ANY(%s) ORDER BY book_id FOR UPDATE;",
+                    (book_ids,))
+        cur.execute("""
+            UPDATE loans SET return_date = CURRENT_DATE
+            WHERE loan_id = ANY(%s) AND return_date IS NULL
+            RETURNING loan_id, book_id;
+        """, (valid_ids,))
+        returned = dict(cur.fetchall())
+        conn.commit()
     except psycopg2.Error as e:
-        flash(f'查询逾期记录失败: {e}', 'danger')
-        overdue_loans = []
-    return render_template('loans/overdue_loans.html', loans=overdue_loans)
+        conn.rollback()
+        current_app.logger.error(f"批量还书失败: {e}")
+        return {"error": f"批量还书失败: {e}"}, 500
+    finally:
+        cur.close()
+
+    results = []
+    seen = set()
+    for index, loan_id in enumerate(loan_ids):
+        if loan_id in returned and loan_id not in seen:
+            seen.add(loan_id)
+            results.append({"index": index, "status": "ok", "loan_id": loan_id, "book_id": returned[loan_id]})
+        else:
+            results.append({"index": index, "status": "error", "loan_id": loan_id,
+                            "error": "无效的借阅记录或图书已归还"})
+    for book_id in set(returned.values()):
+        invalidate_book_cache(book_id)
+    return batch_response(results)
+
+
+@routes.route('/loans/active')
+@versions.conditional_page('loans', 'books', 'readers', readonly=True)
+def list_active_loans():
+    """显示当前所有未归还的借阅记录 (按应归还日期分页，流式渲染)。"""
+    return stream_loan_page('view_activeloans', 'loans/active_loans.html', '查询当前借阅记录失败')
+
+
+@routes.route('/loans/overdue')
+@versions.conditional_page('loans', 'books', 'readers', readonly=True, daily=True)
+def list_overdue_loans():
+    """显示所有已逾期未归还的借阅记录 (按应归还日期分页，流式渲染)。"""
+    return stream_loan_page('view_overdueloans', 'loans/overdue_loans.html', '查询逾期记录失败',
+                            overdue=True)
+
+def parse_loan_list_args(args, overdue=False, config=None):
+    """
+    解析借阅列表的查询参数 (同步视图和 asgi 模块的异步视图共用)。
+    :param config: 应用配置，默认为当前 Flask 应用的配置。
+    :return: (per_page, after, filters)
+    """
+    config = current_app.config if config is None else config
+    per_page = args.get('per_page', config['LOANS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, config['LOANS_MAX_PER_PAGE']))
+    after = pagination.decode_cursor(args.get('after'), 2)
+    filters = {
+        'reader_id': args.get('reader_id', type=int),
+        'book_id': args.get('book_id', type=int),
+        'min_days': args.get('min_days', type=int) if overdue else None,
+    }
+    return per_page, after, filters
+
+# 未归还借阅的 loan_date 下界 (loans_active_since，由触发器和分区维护命令维护)。
+# 视图中用子查询读取它，只能在执行时跳过早年的分区；借阅列表先读出下界作为常量条件，规划时就排除这些分区
+LOANS_ACTIVE_SINCE_SQL = "SELECT since FROM loans_active_since"
+LOANS_ACTIVE_SINCE = db.register_statement('loans_active_since', LOANS_ACTIVE_SINCE_SQL)
+
+def loan_page_sql(view, filters, after, per_page, since=None):
+    """
+    按 (due_date, loan_id) 键集分页查询借阅视图的 SQL，多取一行用于判断是否有下一页。
+    :param since: 未归还借阅的 loan_date 下界 (LOANS_ACTIVE_SINCE_SQL)，为 None 时不加这个条件。
+    :return: (sql, args)
+    """
+    conditions = []
+    args = []
+    if since:
+        conditions.append("loan_date >= %s")
+        args.append(since)
+    if filters['reader_id']:
+        conditions.append("reader_id = %s")
+        args.append(filters['reader_id'])
+    if filters['book_id']:
+        conditions.append("book_id = %s")
+        args.append(filters['book_id'])
+    if filters['min_days']:
+        conditions.append("due_date <= CURRENT_DATE - %s")
+        args.append(filters['min_days'])
+    if after:
+        conditions.append("(due_date, loan_id) > (%s::date, %s)")
+        args.extend(after)
+
+    query = f"SELECT * FROM {view}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY due_date, loan_id LIMIT %s"
+    return query, args + [per_page + 1]
+
+def loan_page_key(loan):
+    return loan['due_date'], loan['loan_id']
+
+def buffer_chunks(chunks, size=8192):
+    """
+    把模板流式渲染产生的小片段合并成约 size 字符的块再发送。
+    Jinja 每个模板语句产生一个片段，一页借阅记录有数百个，逐个写入 socket 的开销远大于渲染本身。
+    """
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def stream_loan_page(view, template, error_message, overdue=False):
+    """
+    按 (due_date, loan_id) 键集分页查询借阅视图，并用服务器端游标 + 流式模板渲染一页结果，
+    每个请求的内存占用只与每页行数有关。
+    支持按 reader_id、book_id 以及 (逾期列表) 最少逾期天数 min_days 筛选。
+    """
+    per_page, after, filters = parse_loan_list_args(request.args, overdue)
 
-@app.route('/search/reader_loans/<int:reader_id>')
-def reader_loan_history(reader_id):
-    """查询某个读者的所有借阅记录 (包括已归还和未归还)。"""
     try:
-        reader = db.query_db("SELECT * FROM readers WHERE reader_id = %s", [reader_id], one=True)
-        if not reader:
-            flash('未找到该读者。', 'warning')
-            return redirect(url_for('list_readers'))
-
-        sql = """
-            SELECT l.loan_id, b.title AS book_title, b.isbn,
-                   l.loan_date, l.due_date, l.return_date
-            FROM loans l
-            JOIN books b ON l.book_id = b.book_id
-            WHERE l.reader_id = %s
-            ORDER BY l.loan_date DESC;
-        """
-        loans = db.query_db(sql, [reader_id])
+        since = db.query_db(LOANS_ACTIVE_SINCE, one=True, readonly=True)
+        query, args = loan_page_sql(view, filters, after, per_page, since[0] if since else None)
+        rows = db.iter_query(query, args, row_factory='record', readonly=True)
     except psycopg2.Error as e:
-        flash(f'查询读者借阅历史失败: {e}', 'danger')
-        loans = []
-        if 'reader' not in locals():
-             reader = None
+        flash(f'{error_message}: {e}', 'danger')
+        rows = None
+    loans = pagination.StreamedPage(rows or [], per_page, loan_page_key)
+    # 翻页链接需要保留的查询参数 (值为 None 的参数不会出现在链接中)
+    link_args = dict(filters, per_page=request.args.get('per_page', type=int))
+    response = current_app.response_class(buffer_chunks(
+        stream_template(template, loans=loans, filters=filters, link_args=link_args,
+                        first_page=after is None)))
+    if rows is not None:
+        response.call_on_close(rows.close)  # 响应结束或客户端断开时归还游标占用的连接
+    return response
 
+# 读者/图书借阅历史 (同步视图和 asgi 模块的异步视图共用)
+# 摘要中的累计借阅数、当前借阅数和最近借阅日期由 loans 上的触发器维护在 stats_reader_loans/stats_book_loans 中；
+# 逾期数随日期变化，在未归还借阅的部分索引上按应还日期计数，只读取该读者/图书的未归还借阅
+READER_SUMMARY_SQL = f"""
+    SELECT {READER_COLUMNS},
+           COALESCE(S.loan_count, 0) AS loan_count, COALESCE(S.active_count, 0) AS active_count, S.last_loan_date,
+           (SELECT COUNT(*) FROM loans L
+            WHERE L.reader_id = R.reader_id AND L.return_date IS NULL AND L.due_date < CURRENT_DATE) AS overdue_count
+    FROM readers R
+    LEFT JOIN stats_reader_loans S USING (reader_id)
+    WHERE reader_id = %s
+"""
 
-    return render_template('loans/history.html',
-                           loans=loans,
-                           reader=reader,
-                           history_type='reader')
+BOOK_SUMMARY_SQL = f"""
+    SELECT {BOOK_COLUMNS},
+           COALESCE(S.loan_count, 0) AS loan_count, COALESCE(S.active_count, 0) AS active_count, S.last_loan_date,
+           (SELECT COUNT(*) FROM loans L
+            WHERE L.book_id = B.book_id AND L.return_date IS NULL AND L.due_date < CURRENT_DATE) AS overdue_count
+    FROM books B
+    LEFT JOIN stats_book_loans S USING (book_id)
+    WHERE book_id = %s
+"""
 
+# 借阅记录按 (loan_date, loan_id) 倒序键集分页；{after} 在后续页替换为游标条件
+READER_HISTORY_SQL = """
+    SELECT l.loan_id, b.title AS book_title, b.isbn,
+           l.loan_date, l.due_date, l.return_date
+    FROM loans l
+    JOIN books b ON l.book_id = b.book_id
+    WHERE l.reader_id = %s{after}
+    ORDER BY l.loan_date DESC, l.loan_id DESC
+    LIMIT %s
+"""
 
-@app.route('/search/book_loans/<int:book_id>')
-def book_loan_history(book_id):
-    """查询某本图书的所有被借阅记录。"""
+BOOK_HISTORY_SQL = """
+    SELECT l.loan_id, r.name AS reader_name, r.reader_number,
+           l.loan_date, l.due_date, l.return_date
+    FROM loans l
+    JOIN readers r ON l.reader_id = r.reader_id
+    WHERE l.book_id = %s{after}
+    ORDER BY l.loan_date DESC, l.loan_id DESC
+    LIMIT %s
+"""
+
+HISTORY_AFTER_CONDITION = " AND (l.loan_date, l.loan_id) < (%s, %s)"
+
+def history_page_sql(sql, owner_id, cursor, limit):
+    """返回借阅历史一页的 (sql, args)，cursor 为上一页最后一条记录的 (loan_date, loan_id)。"""
+    if cursor is None:
+        return sql.format(after=''), [owner_id, limit]
+    return sql.format(after=HISTORY_AFTER_CONDITION), [owner_id, *cursor, limit]
+
+def loan_history_key(loan):
+    return loan['loan_date'], loan['loan_id']
+
+def parse_history_args(args, config=None):
+    """解析借阅历史的分页参数，返回 (per_page, after)。config 默认为当前 Flask 应用的配置。"""
+    config = current_app.config if config is None else config
+    per_page = args.get('per_page', config['LOAN_HISTORY_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, config['LOAN_HISTORY_MAX_PER_PAGE']))
+    return per_page, pagination.decode_cursor(args.get('after'), 2)
+
+# history_type -> (摘要语句, (第一页语句, 后续页语句), JSON 输出字段)
+LOAN_HISTORY = {
+    'reader': (db.register_statement('reader_summary', READER_SUMMARY_SQL),
+               (db.register_statement('reader_history', READER_HISTORY_SQL.format(after='')),
+                db.register_statement('reader_history_after', READER_HISTORY_SQL.format(after=HISTORY_AFTER_CONDITION))),
+               ('loan_id', 'book_title', 'isbn', 'loan_date', 'due_date', 'return_date')),
+    'book': (db.register_statement('book_summary', BOOK_SUMMARY_SQL),
+             (db.register_statement('book_history', BOOK_HISTORY_SQL.format(after='')),
+              db.register_statement('book_history_after', BOOK_HISTORY_SQL.format(after=HISTORY_AFTER_CONDITION))),
+             ('loan_id', 'reader_name', 'reader_number', 'loan_date', 'due_date', 'return_date')),
+}
+
+# history_type -> (按 ID 查询读者/图书的语句, 不存在时的 JSON 错误信息)。
+# JSON 格式不查询摘要，只在这一页为空时确认读者/图书是否存在 (有借阅记录就一定存在)
+HISTORY_OWNER = {
+    'reader': (READER_BY_ID, "Reader not found"),
+    'book': (BOOK_BY_ID, "Book not found"),
+}
+
+def loan_history_page(history_type, owner_id):
+    """
+    借阅历史页: 先显示摘要和最近的一页借阅记录，更早的记录通过 after 游标按页加载。
+    format=json 时只返回一页记录 {data, next_cursor}，页面上的 "加载更早的记录" 用它追加表格行；
+    读者/图书不存在时返回 404。
+    返回响应；(非 JSON 格式) 读者/图书不存在时返回 None。
+    """
+    summary_statement, (first_page, later_page), fields = LOAN_HISTORY[history_type]
+    per_page, after = parse_history_args(request.args)
+    as_json = request.args.get('format') == 'json'
+
+    def fetch(cursor, backward, limit):
+        statement, args = (first_page, [owner_id, limit]) if cursor is None else (later_page, [owner_id, *cursor, limit])
+        return db.query_db(statement, args, row_factory='record', readonly=True)
+
+    owner = None
     try:
-        book = db.query_db("SELECT * FROM books WHERE book_id = %s", [book_id], one=True)
-        if not book:
-            flash('未找到该图书。', 'warning')
-            return redirect(url_for('list_books'))
-
-        sql = """
-            SELECT l.loan_id, r.name AS reader_name, r.reader_number,
-                   l.loan_date, l.due_date, l.return_date
-            FROM loans l
-            JOIN readers r ON l.reader_id = r.reader_id
-            WHERE l.book_id = %s
-            ORDER BY l.loan_date DESC;
-        """
-        loans = db.query_db(sql, [book_id])
+        if not as_json:
+            owner = db.query_db(summary_statement, [owner_id], one=True, readonly=True)
+            if not owner:
+                return None
+        loans, next_cursor, _ = pagination.keyset_page(fetch, loan_history_key, per_page, after=after)
+        if as_json and not loans:
+            owner_statement, not_found = HISTORY_OWNER[history_type]
+            if not db.query_db(owner_statement, [owner_id], one=True, readonly=True):
+                return {"error": not_found}, 404
     except psycopg2.Error as e:
-        flash(f'查询图书借阅历史失败: {e}', 'danger')
-        loans = []
-        if 'book' not in locals():
-            book = None
+        if as_json:
+            return {"error": "Database error"}, 500
+        flash(f'查询{"读者" if history_type == "reader" else "图书"}借阅历史失败: {e}', 'danger')
+        loans, next_cursor = [], None
+    if as_json:
+        return {'data': [api.serialize(loan, fields) for loan in loans], 'next_cursor': next_cursor}
+    return render_template('loans/history.html', loans=loans, next_cursor=next_cursor, first_page=after is None,
+                           per_page=request.args.get('per_page', type=int), history_type=history_type,
+                           **{history_type: owner})
+
+@routes.route('/search/reader_loans/<int:reader_id>')
+def reader_loan_history(reader_id):
+    """查询某个读者的借阅摘要和借阅记录 (包括已归还和未归还)，按借阅日期倒序分页。"""
+    response = loan_history_page('reader', reader_id)
+    if response is None:
+        flash('未找到该读者。', 'warning')
+        return redirect(url_for('list_readers'))
+    return response
+
 
-    return render_template('loans/history.html',
-                           loans=loans,
-                           book=book,
-                           history_type='book')
+@routes.route('/search/book_loans/<int:book_id>')
+def book_loan_history(book_id):
+    """查询某本图书的借阅摘要和被借阅记录，按借阅日期倒序分页。"""
+    response = loan_history_page('book', book_id)
+    if response is None:
+        flash('未找到该图书。', 'warning')
+        return redirect(url_for('list_books'))
+    return response
 
 
 if __name__ == '__main__':
-    app.run(debug=os.environ.get('FLASK_ENV') == 'development')
-try:
-    import click
-except ImportError:
-    pass
+    create_app().run(debug=os.environ.get('FLASK_ENV') == 'development')
@@ -0,0 +1,329 @@
+"""
+ASGI 服务模式。
+
+只读页面 (图书列表、图书详情、当前/逾期借阅、借阅历史) 由 Quart 异步视图处理，
+通过 aiopg 异步连接池查询数据库，一个事件循环即可同时处理大量请求；
+其余请求 (写操作、读者管理、JSON API 等) 仍交给原来的 Flask 应用，在线程池中执行。
+
+运行:
+    hypercorn personal_library.asgi:application --bind 127.0.0.1:8000
+
+异步视图与同步视图共用 app.py 中的参数解析和 SQL，渲染相同的模板，
+会话 (flash 消息) 使用同一个 SECRET_KEY，因此两种视图可以互相跳转。
+"""
+import asyncio
+import json
+import time
+
+import aiopg
+import psycopg2
+import psycopg2.extras
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from quart import Quart, flash, redirect, render_template, request, url_for
+from werkzeug.exceptions import HTTPException
+
+from . import api, cache, pagination, versions
+from .app import (BOOK_COLUMNS, BOOK_HISTORY_SQL, BOOK_SUMMARY_SQL, HISTORY_OWNER, LOAN_HISTORY,
+                  LOANS_ACTIVE_SINCE_SQL, READER_HISTORY_SQL, READER_SUMMARY_SQL, _book_count_cache,
+                  app as flask_app, book_keyset_sql, book_list_cache_key, book_offset_sql, book_search_conditions,
+                  history_page_sql, loan_history_key, loan_page_key, loan_page_sql, parse_book_list_args,
+                  parse_history_args, parse_loan_list_args)
+
+quart_app = Quart(__name__)
+quart_app.config.update(flask_app.config)
+# 模板中的 {% cache %} 块需要这个扩展；异步视图不设置 data_version，块照常渲染
+quart_app.jinja_env.add_extension(versions.FragmentCacheExtension)
+
+# history_type -> (摘要 SQL, 借阅记录 SQL)
+HISTORY_SQL = {
+    'reader': (READER_SUMMARY_SQL, READER_HISTORY_SQL),
+    'book': (BOOK_SUMMARY_SQL, BOOK_HISTORY_SQL),
+}
+
+
+async def query_db(query, args=(), one=False):
+    """
+    db.query_db 的异步只读版本，结果同样是 DictRow。
+    aiopg 的连接处于自动提交模式，每条查询单独执行，因此这里只用于读。
+    """
+    pool = quart_app.extensions['aiopg_pool']
+    async with pool.acquire() as conn:
+        async with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            await cur.execute(query, args)
+            rows = await cur.fetchall()
+    return (rows[0] if rows else None) if one else rows
+
+
+def get_cache():
+    """与 Flask 应用共用同一个缓存对象 (失效监听线程由 before_serving 启动)。"""
+    return flask_app.extensions['library_cache']['cache']
+
+
+@quart_app.before_serving
+async def open_pool():
+    config = quart_app.config
+    if not config.get('DATABASE_URL'):
+        raise RuntimeError("DATABASE_URL 未设置。应用无法连接到数据库。")
+    quart_app.extensions['aiopg_pool'] = await aiopg.create_pool(
+        config['DATABASE_URL'], minsize=int(config['DB_POOL_MIN_SIZE']), maxsize=int(config['DB_POOL_MAX_SIZE']))
+    with flask_app.app_context():
+        cache.get_cache()
+
+
+@quart_app.after_serving
+async def close_pool():
+    pool = quart_app.extensions.pop('aiopg_pool', None)
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+
+
+async def count_books(select_query, count_query, args):
+    """app.count_books 的异步版本，按 BOOKS_COUNT_MODE 计算图书总数。"""
+    mode = quart_app.config['BOOKS_COUNT_MODE']
+    if mode == 'none':
+        return None
+    if mode == 'estimate':
+        if not args:
+            row = await query_db("SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass('books')",
+                                 one=True)
+            if row is not None and row[0] is not None and row[0] >= 0:
+                return row[0]
+        else:
+            row = await query_db("EXPLAIN (FORMAT JSON) " + select_query, args, one=True)
+            plan = json.loads(row[0]) if isinstance(row[0], str) else row[0]
+            return int(plan[0]['Plan']['Plan Rows'])
+    if mode == 'cached':
+        cached = _book_count_cache.get(tuple(args))
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+    row = await query_db(count_query, args, one=True)
+    total = row[0] if row else 0
+    if mode == 'cached':
+        if len(_book_count_cache) > 1000:
+            _book_count_cache.clear()
+        _book_count_cache[tuple(args)] = (time.monotonic() + quart_app.config['BOOKS_COUNT_CACHE_TTL'], total)
+    return total
+
+
+async def list_books():
+    """异步版本的 app.list_books，与同步视图共用缓存项。"""
+    params = parse_book_list_args(request.args, quart_app.config)
+    page = params['page']
+    per_page = params['per_page']
+    conditions, args = book_search_conditions(params['search_term'], params['ranked'])
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    count_query = "SELECT COUNT(*) FROM books" + where
+
+    async def fetch_keyset(cursor, backward, limit):
+        return await query_db(*book_keyset_sql(conditions, args, cursor, backward, limit))
+
+    async def load_page():
+        if params['keyset']:
+            books, next_cursor, prev_cursor = await pagination.keyset_page_async(
+                fetch_keyset, lambda book: (book['title'], book['book_id']), per_page,
+                after=params['after'], before=params['before'])
+            total_books = await count_books("SELECT book_id FROM books" + where, count_query, args)
+            total_pages = 0
+        else:
+            books, total_books_row = await asyncio.gather(
+                query_db(*book_offset_sql(params, conditions, args)),
+                query_db(count_query, args, one=True))
+            total_books = total_books_row[0] if total_books_row else 0
+            total_pages = (total_books + per_page - 1) // per_page
+            next_cursor = prev_cursor = None
+        return {'books': [dict(book) for book in books], 'next_cursor': next_cursor,
+                'prev_cursor': prev_cursor, 'total_books': total_books, 'total_pages': total_pages}
+
+    book_cache = get_cache()
+    cache_key = book_list_cache_key(book_cache, request.query_string.decode('utf-8'))
+    data = book_cache.get(cache_key)
+    if data is cache.MISSING:
+        try:
+            data = await load_page()
+            book_cache.set(cache_key, data, ttl=quart_app.config['BOOKS_LIST_CACHE_TTL'])
+        except psycopg2.Error as e:
+            await flash(f'查询图书时发生错误: {e}', 'danger')
+            data = {'books': [], 'next_cursor': None, 'prev_cursor': None, 'total_books': None, 'total_pages': 0}
+            page = 1
+
+    return await render_template('books/list.html',
+                                 books=data['books'],
+                                 search_term=params['search_term'],
+                                 search_mode=request.args.get('search_mode'),
+                                 current_page=page,
+                                 total_pages=data['total_pages'],
+                                 keyset=params['keyset'],
+                                 next_cursor=data['next_cursor'],
+                                 prev_cursor=data['prev_cursor'],
+                                 total_books=data['total_books'],
+                                 count_mode=quart_app.config['BOOKS_COUNT_MODE'])
+
+
+async def get_book(book_id):
+    """异步版本的 app.get_book。"""
+    book_cache = get_cache()
+    cache_key = f'book:{book_id}'
+    book_json = book_cache.get(cache_key)
+    if book_json is not cache.MISSING:
+        return book_json, 200
+    try:
+        book = await query_db(f"SELECT {BOOK_COLUMNS} FROM books WHERE book_id = %s", [book_id], one=True)
+    except psycopg2.Error as e:
+        quart_app.logger.error(f"查询图书详情失败: {e}")
+        return {"error": "Database error"}, 500
+    if not book:
+        return {"error": "Book not found"}, 404
+    book_json = api.serialize(book, api.RESOURCES['books']['fields'])
+    book_cache.set(cache_key, book_json)
+    return book_json, 200
+
+
+async def render_loan_page(view, template, error_message, overdue=False):
+    """
+    异步版本的 app.stream_loan_page。
+    一页最多 LOANS_MAX_PER_PAGE 行，直接读入内存后渲染，不需要服务器端游标。
+    """
+    per_page, after, filters = parse_loan_list_args(request.args, overdue, quart_app.config)
+    try:
+        since = await query_db(LOANS_ACTIVE_SINCE_SQL, one=True)
+        rows = await query_db(*loan_page_sql(view, filters, after, per_page, since[0] if since else None))
+    except psycopg2.Error as e:
+        await flash(f'{error_message}: {e}', 'danger')
+        rows = []
+    link_args = dict(filters, per_page=request.args.get('per_page', type=int))
+    return await render_template(template, loans=pagination.StreamedPage(rows, per_page, loan_page_key),
+                                 filters=filters, link_args=link_args, first_page=after is None)
+
+
+async def list_active_loans():
+    return await render_loan_page('view_activeloans', 'loans/active_loans.html', '查询当前借阅记录失败')
+
+
+async def list_overdue_loans():
+    return await render_loan_page('view_overdueloans', 'loans/overdue_loans.html', '查询逾期记录失败',
+                                  overdue=True)
+
+
+async def render_loan_history(history_type, owner_id):
+    """
+    异步版本的 app.loan_history_page，摘要和第一页借阅记录并发查询。
+    返回响应；(非 JSON 格式) 读者/图书不存在时返回 None。
+    """
+    summary_sql, history_sql = HISTORY_SQL[history_type]
+    fields = LOAN_HISTORY[history_type][2]
+    per_page, after = parse_history_args(request.args, quart_app.config)
+    as_json = request.args.get('format') == 'json'
+
+    async def fetch(cursor, backward, limit):
+        return await query_db(*history_page_sql(history_sql, owner_id, cursor, limit))
+
+    async def load_summary():
+        return None if as_json else await query_db(summary_sql, [owner_id], one=True)
+
+    try:
+        owner, (loans, next_cursor, _) = await asyncio.gather(
+            load_summary(), pagination.keyset_page_async(fetch, loan_history_key, per_page, after=after))
+    except psycopg2.Error as e:
+        if as_json:
+            return {"error": "Database error"}, 500
+        await flash(f'查询{"读者" if history_type == "reader" else "图书"}借阅历史失败: {e}', 'danger')
+        owner, loans, next_cursor = None, [], None
+    else:
+        if not as_json and not owner:
+            return None
+        if as_json and not loans:
+            owner_statement, not_found = HISTORY_OWNER[history_type]
+            try:
+                exists = await query_db(owner_statement.sql, [owner_id], one=True)
+            except psycopg2.Error:
+                return {"error": "Database error"}, 500
+            if not exists:
+                return {"error": not_found}, 404
+    if as_json:
+        return {'data': [api.serialize(loan, fields) for loan in loans], 'next_cursor': next_cursor}
+    return await render_template('loans/history.html', loans=loans, next_cursor=next_cursor,
+                                 first_page=after is None, per_page=request.args.get('per_page', type=int),
+                                 history_type=history_type, **{history_type: owner})
+
+
+async def reader_loan_history(reader_id):
+    """异步版本的 app.reader_loan_history。"""
+    response = await render_loan_history('reader', reader_id)
+    if response is None:
+        await flash('未找到该读者。', 'warning')
+        return redirect(url_for('list_readers'))
+    return response
+
+
+async def book_loan_history(book_id):
+    """异步版本的 app.book_loan_history。"""
+    response = await render_loan_history('book', book_id)
+    if response is None:
+        await flash('未找到该图书。', 'warning')
+        return redirect(url_for('list_books'))
+    return response
+
+
+# 由异步视图处理的端点，名称与 Flask 应用中的端点一致
+ASYNC_VIEWS = {
+    'list_books': list_books,
+    'get_book': get_book,
+    'list_active_loans': list_active_loans,
+    'list_overdue_loans': list_overdue_loans,
+    'reader_loan_history': reader_loan_history,
+    'book_loan_history': book_loan_history,
+}
+
+
+async def _served_by_flask(**kwargs):
+    # 这些端点只为了让模板中的 url_for 能生成链接，请求本身由 HybridApp 转发给 Flask
+    raise RuntimeError("该端点由 Flask 应用处理")
+
+
+# 复制 Flask 应用的全部路由规则
+for rule in flask_app.url_map.iter_rules():
+    if rule.endpoint != 'static':
+        quart_app.add_url_rule(rule.rule, rule.endpoint, ASYNC_VIEWS.get(rule.endpoint, _served_by_flask),
+                               methods=rule.methods)
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    # asgiref 默认在同一个线程中依次执行所有 WSGI 请求，这里改为使用事件循环的线程池并发执行
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(
+            scope, receive, send)
+
+
+class HybridApp:
+    """
+    ASGI 入口: 按请求的路径和方法匹配端点，ASYNC_VIEWS 中的端点交给 Quart，其余交给 Flask。
+    lifespan 事件交给 Quart，用于创建和关闭异步连接池。
+    """
+
+    def __init__(self, async_app, wsgi_app, async_endpoints):
+        self.async_app = async_app
+        self.wsgi_app = ThreadedWsgiToAsgi(wsgi_app)
+        self.async_endpoints = set(async_endpoints)
+        self.url_adapter = async_app.url_map.bind('localhost')
+
+    def is_async(self, scope):
+        try:
+            endpoint, _ = self.url_adapter.match(scope['path'], method=scope['method'])
+        except HTTPException:  # 包括 404、405 以及需要重定向的路径
+            return False
+        return endpoint in self.async_endpoints
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan' or (scope['type'] == 'http' and self.is_async(scope)):
+            await self.async_app(scope, receive, send)
+        else:
+            await self.wsgi_app(scope, receive, send)
+
+
+application = HybridApp(quart_app, flask_app, ASYNC_VIEWS)
@@ -0,0 +1,331 @@
+import os
+import pickle
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+from flask import current_app
+
+# 表示缓存未命中 (缓存的值本身可以是 None)
+MISSING = object()
+
+# 数据库触发器发送缓存失效通知的频道
+NOTIFY_CHANNEL = 'library_cache'
+
+CACHE_DEFAULTS = {
+    'CACHE_BACKEND': 'memory',    # memory (进程内 LRU)、redis (多进程共享) 或 null (不缓存)
+    'CACHE_REDIS_URL': 'redis://localhost:6379/0',
+    'CACHE_TTL': 300.0,           # 缓存项的默认存活秒数
+    'CACHE_MAX_ENTRIES': 10000,   # memory 后端最多保存的缓存项数
+    'CACHE_LISTEN': True,         # 是否监听数据库的 LISTEN/NOTIFY 失效通知
+}
+
+# 用 generation() 版本号区分缓存键的命名空间: books 为图书列表页
+CACHE_NAMESPACES = ('books',)
+
+
+class BaseCache:
+    """缓存后端的公共接口和命中统计。"""
+
+    def __init__(self, default_ttl=300.0):
+        self.default_ttl = default_ttl
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'sets': 0, 'invalidations': 0, 'evictions': 0}
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        """返回命中/未命中等计数的快照。"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def generation(self, namespace):
+        """
+        返回命名空间的版本号。把它放进缓存键中，bump() 之后旧的键就不会再被读取。
+        读取版本号不计入命中统计。
+        """
+        raise NotImplementedError
+
+    def bump(self, namespace):
+        """使整个命名空间 (例如所有图书列表页) 失效。"""
+        raise NotImplementedError
+
+    def invalidate_all(self):
+        """
+        失效监听连接建立 (或断线重连) 时调用: 期间可能漏掉了通知。
+        默认只递增各命名空间的版本号，而不删除其他进程仍在使用的共享缓存项；
+        不在命名空间中的项 (图书详情) 最多在 CACHE_TTL 秒后过期。
+        """
+        for namespace in CACHE_NAMESPACES:
+            self.bump(namespace)
+
+    def get_or_set(self, key, loader, ttl=None):
+        """读穿 (read-through): 未命中时调用 loader() 加载并写入缓存。"""
+        value = self.get(key)
+        if value is MISSING:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+
+class NullCache(BaseCache):
+    """不缓存任何内容，用于关闭缓存。"""
+
+    def get(self, key):
+        self._count('misses')
+        return MISSING
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def generation(self, namespace):
+        return 0
+
+    def bump(self, namespace):
+        pass
+
+
+class MemoryCache(BaseCache):
+    """进程内的 LRU + TTL 缓存，线程安全。"""
+
+    def __init__(self, max_entries=10000, default_ttl=300.0):
+        super().__init__(default_ttl)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (过期时间, 值)，末尾是最近使用的项
+        self._generations = {}      # 命名空间 -> 版本号，不过期也不会被淘汰
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                value = entry[1]
+            else:
+                if entry is not None:
+                    del self._data[key]
+                value = MISSING
+        self._count('misses' if value is MISSING else 'hits')
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        evicted = 0
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        self._count('sets')
+        if evicted:
+            self._count('evictions', evicted)
+
+    def delete(self, key):
+        with self._lock:
+            removed = self._data.pop(key, None) is not None
+        if removed:
+            self._count('invalidations')
+
+    def clear(self):
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+        self._count('invalidations', count)
+
+    def generation(self, namespace):
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+        self._count('invalidations')
+
+    def invalidate_all(self):
+        # 进程内的缓存只属于本进程，直接清空
+        self.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SharedCache(BaseCache):
+    """
+    多进程共享的缓存，值用 pickle 序列化后存放在 Redis 兼容的客户端中。
+    client 只需要提供 get、set(key, value, ex=秒)、delete、incr 和 scan_iter 方法，
+    因此在本地开发和测试中可以用一个实现了这些方法的替身代替真正的 Redis。
+    """
+
+    def __init__(self, client, prefix='library:', default_ttl=300.0):
+        super().__init__(default_ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self._count('misses')
+            return MISSING
+        self._count('hits')
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+        self._count('sets')
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+        self._count('invalidations')
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+        self._count('invalidations')
+
+    def generation(self, namespace):
+        raw = self.client.get(f'{self.prefix}gen:{namespace}')
+        return int(raw) if raw is not None else 0
+
+    def bump(self, namespace):
+        self.client.incr(f'{self.prefix}gen:{namespace}')
+        self._count('invalidations')
+
+
+def create_cache(config):
+    """按配置创建缓存后端。redis 后端需要安装 redis 包。"""
+    backend = config['CACHE_BACKEND']
+    ttl = float(config['CACHE_TTL'])
+    if backend == 'memory':
+        return MemoryCache(max_entries=int(config['CACHE_MAX_ENTRIES']), default_ttl=ttl)
+    if backend == 'redis':
+        import redis  # 可选依赖，只有使用共享缓存时才需要
+        return SharedCache(redis.Redis.from_url(config['CACHE_REDIS_URL']), default_ttl=ttl)
+    if backend == 'null':
+        return NullCache(default_ttl=ttl)
+    raise ValueError(f"未知的缓存后端: {backend}")
+
+
+def apply_notification(cache, payload):
+    """
+    处理一条失效通知。
+    'book:<id>' 表示该图书 (包括库存) 发生了变化；'books:*' 表示图书表被清空。
+    """
+    if payload.startswith('book:'):
+        cache.delete(payload)
+        cache.bump('books')
+    elif payload == 'books:*':
+        cache.clear()
+
+
+class InvalidationListener(threading.Thread):
+    """
+    后台线程: 用一个独立的连接 LISTEN 数据库通知，收到后使对应缓存项失效。
+    这样其他进程 (或直接修改数据库的脚本、借还书触发器) 造成的变更也能及时反映出来。
+    """
+
+    def __init__(self, dsn, cache, logger=None, poll_timeout=5.0):
+        super().__init__(name='cache-invalidation-listener', daemon=True)
+        self.dsn = dsn
+        self.cache = cache
+        self.logger = logger
+        self.poll_timeout = poll_timeout
+        self.listening = threading.Event()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                # 断线期间可能漏掉通知，重新连接后使缓存失效
+                self.cache.invalidate_all()
+                self.listening.set()
+                backoff = 1.0
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        apply_notification(self.cache, conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError, ValueError) as e:
+                self.listening.clear()
+                if self.logger:
+                    self.logger.warning(f"缓存失效监听连接中断，{backoff:.0f} 秒后重试: {e}")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+
+def init_app(app):
+    """
+    按同名环境变量或 app.config 设置缓存配置，创建缓存后端并保存在 app.extensions 中。
+    监听线程在第一次使用缓存时启动。
+    """
+    for key, default in CACHE_DEFAULTS.items():
+        value = app.config.get(key, os.environ.get(key, default))
+        if isinstance(default, bool):
+            if isinstance(value, str):
+                value = value.lower() in ('1', 'true', 'yes', 'on')
+        elif not isinstance(default, str):
+            value = type(default)(value)
+        app.config[key] = value
+    app.extensions['library_cache'] = {
+        'cache': create_cache(app.config),
+        'listener': None,
+        'lock': threading.Lock(),
+    }
+
+
+def get_cache():
+    """
+    返回当前应用的缓存。
+    首次调用 (以及 fork 之后在子进程中首次调用) 时启动失效监听线程。
+    """
+    state = current_app.extensions['library_cache']
+    listener = state['listener']
+    if current_app.config['CACHE_LISTEN'] and (listener is None or not listener.is_alive()):
+        database_url = current_app.config.get('DATABASE_URL')
+        with state['lock']:
+            listener = state['listener']
+            if database_url and (listener is None or not listener.is_alive()):
+                listener = InvalidationListener(database_url, state['cache'], current_app.logger)
+                listener.start()
+                state['listener'] = listener
+    return state['cache']
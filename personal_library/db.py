@@ -1,71 +1,812 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 import psycopg2.extras  # 用于字典游标
+import functools
+import itertools
+import json
+import keyword
+import operator
 import os
-from flask import g, current_app  # g 是 Flask提供的请求绑定数据对象, current_app 用于获取应用配置
+import re
+import threading
+import time
+from collections import deque
+from flask import g, current_app, has_app_context, has_request_context, session  # g 是 Flask提供的请求绑定数据对象, current_app 用于获取应用配置
+
+
+def database_url():
+    """
+    主库的连接字符串: 应用上下文中为 app.config['DATABASE_URL'] (create_app 加载 .env 之后从环境变量读取)，
+    否则直接读环境变量。
+    """
+    if has_app_context():
+        return current_app.config.get('DATABASE_URL')
+    return os.environ.get('DATABASE_URL')
+
+
+def __getattr__(name):
+    # 兼容原来的模块常量 db.DATABASE_URL: 在使用时才读取，而不是在导入本模块时 (那时 .env 可能还没有加载)
+    if name == 'DATABASE_URL':
+        return database_url()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# 增量迁移脚本所在目录，文件名按字典序即为执行顺序
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+
+# 连接池默认配置，可通过同名环境变量或 app.config 覆盖
+POOL_DEFAULTS = {
+    'DB_POOL_MIN_SIZE': 1,           # 池中至少保留的连接数
+    'DB_POOL_MAX_SIZE': 10,          # 池中最多创建的连接数
+    'DB_POOL_TIMEOUT': 30.0,         # 等待空闲连接的最长秒数
+    'DB_POOL_IDLE_TIMEOUT': 300.0,   # 空闲超过该秒数的多余连接会被回收
+    'DB_POOL_CHECK_INTERVAL': 30.0,  # 空闲超过该秒数的连接在取出时先执行 SELECT 1 检查
+}
+
+
+# 只读副本配置，可通过同名环境变量或 app.config 覆盖
+REPLICA_DEFAULTS = {
+    'DB_REPLICA_URLS': '',               # 只读副本的 DSN，逗号分隔；为空时所有查询都发往主库
+    'DB_REPLICA_STICKY_SECONDS': 5.0,    # 会话提交写操作后的该秒数内，只读查询也发往主库 (读己之写)
+    'DB_REPLICA_RETRY_INTERVAL': 30.0,   # 连接失败的副本在该秒数内不再尝试
+}
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """带有连接池元数据的 psycopg2 连接。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.prepared_statements = set()  # 已在该连接 (服务器会话) 上 PREPARE 的语句名
+        self.committed = False  # 本次取出后是否提交过事务，用于副本路由的读己之写
+
+    def commit(self):
+        super().commit()
+        self.committed = True
+
+
+class PoolTimeoutError(RuntimeError):
+    """在超时时间内没有可用的数据库连接。"""
+
+
+class ConnectionPool:
+    """
+    进程级 PostgreSQL 连接池。
+    连接在取出时做健康检查，归还时回滚未提交的事务，空闲过久的多余连接会被回收。
+    同时记录等待时间等指标，可通过 stats() 查看。
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=30.0,
+                 idle_timeout=300.0, check_interval=30.0,
+                 connection_factory=PooledConnection):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"无效的连接池大小: min={min_size}, max={max_size}")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.connection_factory = connection_factory
+        self.pid = os.getpid()
+        self.closed = False
+        self._cond = threading.Condition()
+        self._idle = deque()  # 左侧是最久未使用的连接，右侧是最近归还的连接
+        self._size = 0  # 已创建且未关闭的连接数 (空闲 + 使用中)
+        self._stats = {
+            'checkouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+            'health_check_failures': 0,
+        }
+        for _ in range(min_size):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append(conn)
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=self.connection_factory)
+        with self._cond:
+            self._stats['connections_created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        """关闭一个连接并把它从池的计数中移除。调用者需持有锁。"""
+        try:
+            if not conn.closed:
+                conn.close()
+        except psycopg2.Error:
+            pass
+        self._size -= 1
+        self._stats['connections_closed'] += 1
+        self._cond.notify()
+
+    def _reap_idle(self, now):
+        """回收空闲超过 idle_timeout 的多余连接。调用者需持有锁。"""
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0].last_used > self.idle_timeout):
+            self._discard(self._idle.popleft())
+
+    def _is_healthy(self, conn, now):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if now - conn.last_used <= self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """取出一个连接，必要时等待其他请求归还，超时则抛出 PoolTimeoutError。"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            with self._cond:
+                conn = None
+                while True:
+                    if self.closed:
+                        raise RuntimeError("数据库连接池已关闭。")
+                    now = time.monotonic()
+                    self._reap_idle(now)
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1  # 先占位，在锁外建立连接
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"等待数据库连接超时 ({self.timeout} 秒)，连接池已满 (max={self.max_size})。")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, time.monotonic()):
+                with self._cond:
+                    self._stats['health_check_failures'] += 1
+                    self._discard(conn)
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._stats['checkouts'] += 1
+                self._stats['wait_time_total'] += waited
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+            return conn
+
+    def putconn(self, conn):
+        """归还连接。未结束的事务会被回滚，损坏的连接会被关闭。"""
+        if not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+        with self._cond:
+            if conn.closed or self.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                self._discard(conn)
+                return
+            now = time.monotonic()
+            conn.last_used = now
+            self._idle.append(conn)
+            self._reap_idle(now)
+            self._cond.notify()
+
+    def close(self):
+        """关闭池中所有空闲连接，使用中的连接在归还时关闭。"""
+        with self._cond:
+            self.closed = True
+            while self._idle:
+                self._discard(self._idle.popleft())
+            self._cond.notify_all()
+
+    def stats(self):
+        """返回连接池指标的快照。"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(size=self._size, idle=len(self._idle),
+                         in_use=self._size - len(self._idle),
+                         min_size=self.min_size, max_size=self.max_size)
+        checkouts = stats['checkouts']
+        stats['wait_time_avg'] = stats['wait_time_total'] / checkouts if checkouts else 0.0
+        return stats
+
+
+class ReplicaSet:
+    """
+    只读副本的连接池集合，每个副本一个 ConnectionPool (在第一次使用时创建)。
+    按轮询顺序选择副本；连接失败的副本在 retry_interval 秒内被跳过，
+    全部不可用时 getconn() 返回 (None, None)，由调用者回退到主库。
+    """
+
+    def __init__(self, dsns, retry_interval=30.0, **pool_options):
+        if not dsns:
+            raise ValueError("至少需要一个副本 DSN。")
+        self.dsns = list(dsns)
+        self.retry_interval = retry_interval
+        self.pool_options = pool_options
+        self.pid = os.getpid()
+        self.closed = False
+        self._lock = threading.Lock()
+        self._pools = {}       # dsn -> ConnectionPool
+        self._down_until = {}  # dsn -> 恢复尝试的时间 (time.monotonic())
+        self._counter = itertools.count()
+        self._stats = {'checkouts': 0, 'primary_fallbacks': 0, 'connect_failures': 0, 'query_failovers': 0}
+
+    def _get_pool(self, dsn):
+        with self._lock:
+            pool = self._pools.get(dsn)
+        if pool is None:
+            pool = ConnectionPool(dsn, **self.pool_options)  # min_size > 0 时在这里建立连接，可能失败
+            with self._lock:
+                existing = self._pools.setdefault(dsn, pool)
+            if existing is not pool:
+                pool.close()
+                pool = existing
+        return pool
+
+    def getconn(self):
+        """从下一个可用的副本取出连接，返回 (pool, conn)；没有可用的副本时返回 (None, None)。"""
+        if self.closed:
+            raise RuntimeError("副本连接池已关闭。")
+        start = next(self._counter)
+        for i in range(len(self.dsns)):
+            dsn = self.dsns[(start + i) % len(self.dsns)]
+            if self._down_until.get(dsn, 0) > time.monotonic():
+                continue
+            try:
+                pool = self._get_pool(dsn)
+                conn = pool.getconn()
+            except psycopg2.OperationalError:
+                self.mark_down(dsn)
+                continue
+            except PoolTimeoutError:
+                continue  # 副本繁忙而不是故障，不标记为不可用
+            with self._lock:
+                self._stats['checkouts'] += 1
+            return pool, conn
+        with self._lock:
+            self._stats['primary_fallbacks'] += 1
+        return None, None
+
+    def mark_down(self, dsn):
+        """在 retry_interval 秒内跳过该副本。"""
+        with self._lock:
+            self._down_until[dsn] = time.monotonic() + self.retry_interval
+            self._stats['connect_failures'] += 1
+
+    def record_failover(self):
+        with self._lock:
+            self._stats['query_failovers'] += 1
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def stats(self):
+        """返回副本路由指标的快照。"""
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['replicas'] = len(self.dsns)
+            stats['replicas_down'] = sum(1 for until in self._down_until.values() if until > now)
+            for key in ('size', 'in_use', 'timeouts'):
+                stats[key] = sum(pool.stats()[key] for pool in self._pools.values())
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_replicas = None
+
+
+def get_pool():
+    """
+    获取进程级连接池，首次调用时按 app.config 创建。
+    在 fork 出的子进程中会重新创建连接池，避免与父进程共享 socket。
+    """
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid() and not pool.closed:
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid() or _pool.closed:
+            config = current_app.config
+            if not config.get('DATABASE_URL'):
+                # 如果 DATABASE_URL 未设置，则记录错误并引发运行时错误
+                current_app.logger.error("DATABASE_URL 未设置。请在 .env 文件或环境变量中配置。")
+                raise RuntimeError("DATABASE_URL 未设置。应用无法连接到数据库。")
+            _pool = ConnectionPool(
+                config['DATABASE_URL'],
+                min_size=int(config['DB_POOL_MIN_SIZE']),
+                max_size=int(config['DB_POOL_MAX_SIZE']),
+                timeout=float(config['DB_POOL_TIMEOUT']),
+                idle_timeout=float(config['DB_POOL_IDLE_TIMEOUT']),
+                check_interval=float(config['DB_POOL_CHECK_INTERVAL']),
+                # 可替换为 PooledConnection 的子类，例如基准测试中统计每个请求的查询数
+                connection_factory=config.get('DB_CONNECTION_FACTORY') or PooledConnection,
+            )
+        return _pool
+
+
+def replica_urls(config):
+    """DB_REPLICA_URLS 可以是逗号分隔的字符串或 DSN 列表。"""
+    urls = config.get('DB_REPLICA_URLS') or []
+    if isinstance(urls, str):
+        urls = urls.split(',')
+    return [url.strip() for url in urls if url.strip()]
+
+
+def get_replicas():
+    """获取进程级的副本集合，没有配置副本时返回 None。与 get_pool() 一样在 fork 后重新创建。"""
+    global _replicas
+    replicas = _replicas
+    if replicas is not None and replicas.pid == os.getpid() and not replicas.closed:
+        return replicas
+    urls = replica_urls(current_app.config)
+    if not urls:
+        return None
+    with _pool_lock:
+        if _replicas is None or _replicas.pid != os.getpid() or _replicas.closed:
+            config = current_app.config
+            _replicas = ReplicaSet(
+                urls,
+                retry_interval=float(config['DB_REPLICA_RETRY_INTERVAL']),
+                min_size=int(config['DB_POOL_MIN_SIZE']),
+                max_size=int(config['DB_POOL_MAX_SIZE']),
+                timeout=float(config['DB_POOL_TIMEOUT']),
+                idle_timeout=float(config['DB_POOL_IDLE_TIMEOUT']),
+                check_interval=float(config['DB_POOL_CHECK_INTERVAL']),
+                connection_factory=config.get('DB_CONNECTION_FACTORY') or PooledConnection,
+            )
+        return _replicas
+
+
+def close_pool():
+    """关闭当前进程的连接池和副本连接池 (例如在测试或进程退出时)。"""
+    global _pool, _replicas
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        if _replicas is not None:
+            _replicas.close()
+            _replicas = None
 
-# 从环境变量获取DATABASE_URL
-DATABASE_URL = os.environ.get('DATABASE_URL')
 
 def get_db():
     """
     获取数据库连接。
-    如果当前请求上下文中不存在连接，则创建一个新的连接并存储它。
+    如果当前请求上下文中不存在连接，则从连接池取出一个并存储它。
     """
     if 'db' not in g:
-        if not DATABASE_URL:
-            # 如果 DATABASE_URL 未设置，则记录错误并引发运行时错误
-            current_app.logger.error("DATABASE_URL 未设置。请在 .env 文件或环境变量中配置。")
-            raise RuntimeError("DATABASE_URL 未设置。应用无法连接到数据库。")
         try:
-            g.db = psycopg2.connect(DATABASE_URL)
+            pool = get_pool()
+            g.db = pool.getconn()
+        except PoolTimeoutError as e:
+            current_app.logger.error(f"数据库连接池已耗尽: {e}")
+            raise
         except psycopg2.OperationalError as e:
             current_app.logger.error(f"无法连接到数据库: {e}")
             raise RuntimeError(f"无法连接到数据库: {e}")
+        g.db_pool = pool
+        g.db.committed = False
     return g.db
 
+def use_replica():
+    """
+    只读查询是否可以发往副本。以下情况使用主库:
+    - 没有配置副本，或不在请求中 (命令行、后台任务)
+    - 本请求在主库上有未结束的事务或已经提交过写操作 (读取需要看到它们)
+    - 会话在 DB_REPLICA_STICKY_SECONDS 秒内提交过写操作 (副本可能还没有重放，保证读己之写)
+    """
+    if not has_request_context() or not replica_urls(current_app.config):
+        return False
+    primary = g.get('db')
+    if primary is not None and (primary.committed or primary.get_transaction_status()
+                                != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+        return False
+    return session.get('db_primary_until', 0) <= time.time()
+
+def get_read_db():
+    """
+    获取只读查询使用的连接: use_replica() 为真时从副本取出一个连接，在本请求内复用；
+    否则 (或所有副本都不可用时) 返回主库连接 get_db()。
+    """
+    if not use_replica():
+        return get_db()
+    if 'db_replica' not in g:
+        pool, conn = get_replicas().getconn()
+        if conn is None:
+            return get_db()
+        g.db_replica = conn
+        g.db_replica_pool = pool
+    return g.db_replica
+
+# 副本上这些错误说明副本本身不可用 (正在关闭、尚不能接受连接)，没有 SQLSTATE 的错误则是连接断开
+REPLICA_DOWN_SQLSTATES = ('57P01', '57P02', '57P03')
+# 查询因与 WAL 重放冲突被取消，换到主库重试即可
+REPLICA_CONFLICT_SQLSTATE = '40001'
+
+def replica_down(conn, error):
+    """副本上的错误是否说明副本 (或到它的连接) 已经不可用。"""
+    return bool(conn.closed) or error.pgcode is None or error.pgcode in REPLICA_DOWN_SQLSTATES
+
+def is_replica_failure(conn, error):
+    """副本上的查询错误是否应该改到主库重试: 副本不可用，或查询与 WAL 重放冲突。"""
+    if conn is not g.get('db_replica'):
+        return False
+    return replica_down(conn, error) or error.pgcode == REPLICA_CONFLICT_SQLSTATE
+
+def release_replica(error=None):
+    """
+    归还本请求的副本连接。error 是副本上失败的查询抛出的异常:
+    副本不可用时关闭这个连接，并在 DB_REPLICA_RETRY_INTERVAL 秒内不再使用该副本。
+    (服务器意外断开时 psycopg2 不一定把连接标记为关闭，不能依赖连接池的健康检查。)
+    """
+    conn = g.pop('db_replica', None)
+    pool = g.pop('db_replica_pool', None)
+    if conn is None:
+        return
+    if error is not None:
+        replicas = get_replicas()
+        replicas.record_failover()
+        if replica_down(conn, error):
+            replicas.mark_down(pool.dsn)
+            conn.close()
+    pool.putconn(conn)
+
+def remember_primary_write(response):
+    """请求在主库上提交过写操作时，让同一会话接下来的只读查询在一段时间内也使用主库。"""
+    primary = g.get('db')
+    if primary is not None and primary.committed and replica_urls(current_app.config):
+        session['db_primary_until'] = time.time() + float(current_app.config['DB_REPLICA_STICKY_SECONDS'])
+    return response
+
 def close_db(e=None):
     """
-    关闭数据库连接。
-    从请求上下文中移除连接并关闭它。
+    归还数据库连接 (包括副本连接)。
+    从请求上下文中移除连接并放回连接池，未提交的事务会被回滚。
     """
     db = g.pop('db', None)
+    pool = g.pop('db_pool', None)
     if db is not None:
-        db.close()
+        pool.putconn(db)
+    release_replica()
 
 def init_app(app):
     """
-    在 Flask 应用实例上注册数据库关闭函数。
-    这样在应用上下文销毁时，会自动关闭数据库连接。
+    在 Flask 应用实例上注册数据库关闭函数，并设置连接池的默认配置。
+    这样在应用上下文销毁时，会自动把数据库连接还给连接池。
+    连接池本身在第一次查询时才创建 (见 get_pool)。
     """
+    app.config.setdefault('DATABASE_URL', os.environ.get('DATABASE_URL'))
+    for key, default in POOL_DEFAULTS.items():
+        app.config.setdefault(key, type(default)(os.environ.get(key, default)))
+    for key, default in REPLICA_DEFAULTS.items():
+        value = app.config.get(key, os.environ.get(key, default))
+        app.config[key] = value if isinstance(value, list) else type(default)(value)
+    prepared = app.config.get('DB_PREPARED_STATEMENTS', os.environ.get('DB_PREPARED_STATEMENTS', True))
+    if isinstance(prepared, str):
+        prepared = prepared.lower() in ('1', 'true', 'yes', 'on')
+    app.config['DB_PREPARED_STATEMENTS'] = prepared
+    app.after_request(remember_primary_write)
     app.teardown_appcontext(close_db)  # 注册应用上下文结束时调用的函数
 
-def query_db(query, args=(), one=False, commit=False):
+class Record(tuple):
+    """
+    轻量的行对象: 一个 tuple，不为每行创建字典。
+    列可以按属性 (row.title)、列名 (row['title']) 或下标 (row[0]) 访问，dict(row) 得到普通字典。
+    具体的行类由 record_class() 按列名生成，同一查询形状的所有行共用一个类。
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self):
+        return self._fields
+
+    def items(self):
+        return zip(self._fields, self)
+
+    def as_dict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return 'Record(' + ', '.join(f'{name}={value!r}' for name, value in self.items()) + ')'
+
+    def __reduce__(self):
+        # 动态生成的类无法按名称导入，序列化时记录列名 (例如写入共享缓存)
+        return _rebuild_record, (self._fields, tuple(self))
+
+
+@functools.lru_cache(maxsize=512)
+def record_class(columns):
+    """按列名元组生成 Record 子类，每一列对应一个只读属性。"""
+    namespace = {'__slots__': (), '_fields': columns, '_index': {name: i for i, name in enumerate(columns)}}
+    for i, name in enumerate(columns):
+        if name.isidentifier() and not keyword.iskeyword(name) and not hasattr(Record, name):
+            namespace[name] = property(operator.itemgetter(i))
+    return type('Record', (Record,), namespace)
+
+
+def _rebuild_record(columns, values):
+    return record_class(columns)(values)
+
+
+class TupleRows(list):
+    """row_factory='tuple' 的查询结果: 普通 tuple 列表，columns 为所有行共用的 {列名: 下标}。"""
+
+    def __init__(self, rows, columns):
+        super().__init__(rows)
+        self.columns = columns
+
+
+# query_db 支持的行类型: 名称 -> 游标类 (None 表示普通 tuple 游标)
+ROW_FACTORIES = {
+    'dict': psycopg2.extras.DictCursor,            # DictRow，兼容原来的用法
+    'namedtuple': psycopg2.extras.NamedTupleCursor,
+    'record': None,                                # Record，见上
+    'tuple': None,                                 # 普通 tuple + 共用的列下标
+}
+
+
+def _make_rows(cur, rows, row_factory):
+    """把普通游标取出的 tuple 转换成 row_factory 指定的行类型。"""
+    columns = tuple(column.name for column in cur.description)
+    if row_factory == 'record':
+        make = record_class(columns)
+        return [make(row) for row in rows]
+    if row_factory == 'tuple':
+        return TupleRows(rows, {name: i for i, name in enumerate(columns)})
+    return rows
+
+
+class Statement:
+    """
+    register_statement() 注册的固定 SQL。
+    sql 使用 %s 占位符，与普通查询相同；PREPARE 时按顺序转换为 $1, $2 ...
+    """
+    __slots__ = ('name', 'sql', 'prepare_sql', 'execute_sql')
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        numbers = iter(range(1, sql.count('%s') + 1))
+        body = re.sub(r'%s', lambda match: f'${next(numbers)}', sql.strip().rstrip(';'))
+        params = ', '.join(['%s'] * sql.count('%s'))
+        self.prepare_sql = f"PREPARE {name} AS {body}"
+        self.execute_sql = f"EXECUTE {name} ({params})" if params else f"EXECUTE {name}"
+
+    def __str__(self):
+        return self.sql
+
+
+# 语句名 -> Statement，metrics 用它把 EXECUTE 还原为原始语句
+STATEMENTS = {}
+
+
+def register_statement(name, sql):
+    """
+    注册一条高频执行的固定 SQL，返回 Statement，可以代替 SQL 字符串传给 query_db 或 execute_statement。
+    每个连接第一次执行时 PREPARE，之后按名称 EXECUTE，省去 PostgreSQL 每次解析和规划的开销。
+    """
+    if not re.fullmatch(r'[a-z_][a-z0-9_]*', name):
+        raise ValueError(f"预备语句名只能包含小写字母、数字和下划线: {name}")
+    existing = STATEMENTS.get(name)
+    if existing is not None and existing.sql != sql:
+        raise ValueError(f"预备语句 {name} 已注册为另一条 SQL")
+    statement = STATEMENTS[name] = Statement(name, sql)
+    return statement
+
+
+def prepared_statements_enabled():
+    return current_app.config.get('DB_PREPARED_STATEMENTS', True) if has_app_context() else True
+
+
+def execute_statement(cur, statement, args=()):
+    """
+    在游标上执行注册的语句: 连接上还没有 PREPARE 过就先 PREPARE，再 EXECUTE。
+    DB_PREPARED_STATEMENTS 关闭或连接不是 PooledConnection 时直接执行原始 SQL。
+
+    服务器端的预备语句属于会话，不受事务回滚影响；但如果会话被重置 (DISCARD ALL、
+    经过 pgbouncer 的事务级连接池等)，EXECUTE 会报 InvalidSqlStatementName。
+    此时忘掉该连接上记录的语句，若出错的是事务中的第一条语句就回滚后重新 PREPARE 并执行，
+    否则把错误交给调用者 (事务已中止)，下一次使用该连接时会重新 PREPARE。
+    """
+    conn = cur.connection
+    prepared = getattr(conn, 'prepared_statements', None)
+    if prepared is None or not prepared_statements_enabled():
+        return cur.execute(statement.sql, args)
+    first_in_transaction = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    if statement.name not in prepared:
+        cur.execute(statement.prepare_sql)
+        prepared.add(statement.name)
+    try:
+        return cur.execute(statement.execute_sql, args)
+    except psycopg2.errors.InvalidSqlStatementName:
+        prepared.clear()
+        if not first_in_transaction:
+            raise
+        conn.rollback()
+        cur.execute("DEALLOCATE ALL")
+        cur.execute(statement.prepare_sql)
+        prepared.add(statement.name)
+        return cur.execute(statement.execute_sql, args)
+
+
+def prepare_statements(conn):
+    """在连接上 PREPARE 所有注册的语句 (启动预热时使用)，已经 PREPARE 过的跳过。返回新 PREPARE 的语句数。"""
+    prepared = getattr(conn, 'prepared_statements', None)
+    if prepared is None or not prepared_statements_enabled():
+        return 0
+    statements = [statement for name, statement in STATEMENTS.items() if name not in prepared]
+    with conn.cursor() as cur:
+        for statement in statements:
+            cur.execute(statement.prepare_sql)
+            prepared.add(statement.name)
+    conn.rollback()  # 预备语句属于会话，不受回滚影响
+    return len(statements)
+
+
+def query_db(query, args=(), one=False, commit=False, row_factory='dict', readonly=False):
     """
     执行数据库查询。
-    :param query: SQL 查询语句。
+    :param query: SQL 查询语句，或 register_statement() 返回的 Statement (使用预备语句执行)。
     :param args: 查询参数 (元组)。
     :param one: 如果为 True，则只返回第一行结果。
     :param commit: 如果为 True，则在执行后提交事务 (用于 INSERT, UPDATE, DELETE)。
-    :return: 查询结果 (字典或字典列表) 或影响的行数 (如果 commit=True)。
+    :param row_factory: 行类型，见 ROW_FACTORIES。dict 为 DictRow；读多行的热点路径可用 record
+                        (tuple 子类，支持属性和列名访问)，避免为每行创建字典。
+    :param readonly: 如果为 True，查询可以发往只读副本 (见 use_replica())；副本连接断开时改在主库上重试。
+                     结果会写入缓存的查询不要使用，副本的延迟可能让过期数据在缓存中停留到 TTL 结束。
+    :return: 查询结果 (行或行列表) 或影响的行数 (如果 commit=True)。
     """
-    db = get_db()
-    # 使用 DictCursor 使查询结果返回字典形式，方便通过列名访问
-    cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    if row_factory not in ROW_FACTORIES:
+        raise ValueError(f"未知的 row_factory: {row_factory}")
+    if readonly and commit:
+        raise ValueError("只读查询不能提交。")
+    db = get_read_db() if readonly else get_db()
+    cursor_factory = ROW_FACTORIES[row_factory]
+    cur = db.cursor(cursor_factory=cursor_factory) if cursor_factory else db.cursor()
     try:
-        cur.execute(query, args)
+        if isinstance(query, Statement):
+            execute_statement(cur, query, args)
+        else:
+            cur.execute(query, args)
         if commit:  # 对于 INSERT, UPDATE, DELETE 操作
             db.commit()
             return cur.rowcount  # 返回影响的行数
         rv = cur.fetchall()
+        if cursor_factory is None:
+            rv = _make_rows(cur, rv, row_factory)
     except psycopg2.Error as e:
+        if readonly and is_replica_failure(db, e):
+            current_app.logger.warning(f"只读副本查询失败，改用主库: {e}")
+            release_replica(e)
+            return query_db(query, args, one=one, row_factory=row_factory)
         db.rollback()  # 如果发生错误，回滚事务
         # 使用 current_app.logger 记录错误
         current_app.logger.error(f"数据库错误: {e}\n查询: {query}\n参数: {args}")
         raise  # 重新抛出异常，由调用者处理
     finally:
-        cur.close()
+        if not cur.closed:
+            cur.close()
     return (rv[0] if rv else None) if one else rv
 
+class ServerSideRows:
+    """
+    服务器端 (命名) 游标上的结果迭代器，用于流式输出大结果集。
+    它从连接池单独取出一个连接并持有到 close() 为止，因为流式响应的内容在视图函数返回、
+    请求上下文 (以及 g.db) 结束之后才被遍历。
+    """
+
+    def __init__(self, pool, query, args=(), itersize=500, row_factory='dict', conn=None):
+        self._pool = pool
+        self._conn = None
+        self._row_factory = row_factory
+        self._conn = conn or pool.getconn()
+        self._cur = self._conn.cursor(name=f"stream_{id(self)}", cursor_factory=ROW_FACTORIES[row_factory])
+        self._cur.itersize = itersize
+        try:
+            self._cur.execute(query, args)
+        except psycopg2.Error:
+            self.close()
+            raise
+
+    def __iter__(self):
+        try:
+            if ROW_FACTORIES[self._row_factory] is not None:
+                yield from self._cur
+                return
+            make = None
+            for row in self._cur:
+                if make is None:
+                    # 命名游标的列信息在取回第一批行之后才可用
+                    make = (record_class(tuple(column.name for column in self._cur.description))
+                            if self._row_factory == 'record' else tuple)
+                yield make(row)
+        finally:
+            self.close()
+
+    def close(self):
+        """关闭游标并把连接还给连接池 (可以重复调用)。"""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            if not self._cur.closed and not conn.closed:
+                self._cur.close()
+        except psycopg2.Error:
+            pass
+        self._pool.putconn(conn)  # 回滚游标所在的事务
+
+    def __del__(self):
+        self.close()
+
+def iter_query(query, args=(), itersize=500, row_factory='dict', readonly=False):
+    """
+    使用服务器端 (命名) 游标执行查询，逐批取回结果，内存占用与结果集大小无关。
+    查询在调用时立即执行 (错误在这里抛出)，遍历时每次取回 itersize 行。
+    用于流式响应时应调用 response.call_on_close(rows.close)，确保客户端断开时也能归还连接。
+    readonly 为 True 时与 query_db 一样可以使用只读副本，副本不可用时使用主库。
+    :return: ServerSideRows，遍历产生 row_factory 指定的行 (默认 DictRow)。
+    """
+    if row_factory not in ROW_FACTORIES:
+        raise ValueError(f"未知的 row_factory: {row_factory}")
+    try:
+        if readonly and use_replica():
+            pool, conn = get_replicas().getconn()
+            if conn is not None:
+                try:
+                    return ServerSideRows(pool, query, args, itersize, row_factory, conn=conn)
+                except psycopg2.Error as e:
+                    down = replica_down(conn, e)
+                    if not down and e.pgcode != REPLICA_CONFLICT_SQLSTATE:
+                        raise
+                    current_app.logger.warning(f"只读副本查询失败，改用主库: {e}")
+                    get_replicas().record_failover()
+                    if down:
+                        get_replicas().mark_down(pool.dsn)
+                        conn.close()  # 已经归还到池中，关闭后下次取出时会被丢弃
+        return ServerSideRows(get_pool(), query, args, itersize, row_factory)
+    except psycopg2.Error as e:
+        current_app.logger.error(f"数据库错误: {e}\n查询: {query}\n参数: {args}")
+        raise
+
 def execute_sql_file(filename):
     """
     执行一个 SQL 文件中的所有语句。
@@ -100,7 +841,61 @@ def init_db_tables():
     try:
         current_app.logger.info(f"尝试从以下位置初始化数据库表: {schema_path}")
         execute_sql_file(schema_path)
+        # schema.sql 已包含所有迁移的结果，把它们标记为已执行
+        for version in list_migrations():
+            query_db("INSERT INTO schema_migrations (version) VALUES (%s) ON CONFLICT DO NOTHING",
+                     [version], commit=True)
         current_app.logger.info("数据库表从 schema.sql 成功初始化。")
     except Exception as e:
         current_app.logger.error(f"使用 schema.sql 初始化数据库表失败: {e}")
-        raise
\ No newline at end of file
+        raise
+
+def list_migrations():
+    """返回 migrations 目录下所有迁移脚本的版本名 (文件名去掉 .sql)，按执行顺序排列。"""
+    if not os.path.isdir(MIGRATIONS_DIR):
+        return []
+    return sorted(name[:-4] for name in os.listdir(MIGRATIONS_DIR) if name.endswith('.sql'))
+
+def apply_migrations():
+    """
+    在已有数据库上执行尚未执行过的迁移脚本，用于不能重建表的部署。
+    已执行的版本记录在 schema_migrations 表中。
+    :return: 本次执行的版本列表。
+    """
+    query_db("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(100) PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """, commit=True)
+    applied = {row['version'] for row in query_db("SELECT version FROM schema_migrations")}
+    executed = []
+    for version in list_migrations():
+        if version in applied:
+            continue
+        execute_sql_file(os.path.join(MIGRATIONS_DIR, version + '.sql'))
+        query_db("INSERT INTO schema_migrations (version) VALUES (%s)", [version], commit=True)
+        executed.append(version)
+    return executed
+
+def estimate_count(query, args=()):
+    """
+    用查询计划器的行数估计代替 COUNT(*)，代价与结果集大小无关。
+    :param query: 要估计行数的 SELECT 语句。
+    :return: 估计的行数 (整数)。
+    """
+    row = query_db("EXPLAIN (FORMAT JSON) " + query, args, one=True)
+    plan = row[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def estimate_table_rows(table):
+    """
+    从 pg_class 读取表的估计行数 (由 ANALYZE/autovacuum 维护)。
+    表从未被分析过时返回 None。
+    """
+    row = query_db("SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass(%s)", [table], one=True)
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
\ No newline at end of file
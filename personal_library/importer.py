@@ -0,0 +1,138 @@
+import csv
+import json
+import time
+from psycopg2.extras import execute_values
+
+# 导入文件中可以出现的图书字段
+BOOK_FIELDS = ('title', 'author', 'isbn', 'publisher', 'publication_year', 'category', 'total_stock')
+
+# 按 ISBN 插入或更新图书。
+# 更新时保持已借出的数量不变: 新的可借阅库存 = 新总库存 - (旧总库存 - 旧可借阅库存)
+UPSERT_BOOKS_SQL = """
+    INSERT INTO books (title, author, isbn, publisher, publication_year, category, total_stock, available_stock)
+    VALUES %s
+    ON CONFLICT (isbn) DO UPDATE SET
+        title = EXCLUDED.title,
+        author = EXCLUDED.author,
+        publisher = EXCLUDED.publisher,
+        publication_year = EXCLUDED.publication_year,
+        category = EXCLUDED.category,
+        total_stock = EXCLUDED.total_stock,
+        available_stock = GREATEST(EXCLUDED.total_stock - (books.total_stock - books.available_stock), 0)
+    RETURNING (xmax = 0) AS inserted;
+"""
+
+
+class ImportStats:
+    """一次导入的统计信息。"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.read = 0       # 从文件读取的记录数
+        self.inserted = 0   # 新增的图书数
+        self.updated = 0    # 按 ISBN 更新的图书数
+        self.skipped = 0    # 字段缺失或无效而跳过的记录数
+        self.errors = []    # 前若干条被跳过记录的原因
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_sec(self):
+        elapsed = self.elapsed
+        return (self.inserted + self.updated) / elapsed if elapsed > 0 else 0.0
+
+
+def read_records(path, fmt=None):
+    """
+    逐行读取 CSV (首行为表头) 或 JSONL 文件，产生字典，不会把整个文件读入内存。
+    :param fmt: 'csv' 或 'jsonl'，为 None 时按扩展名判断。
+    """
+    if fmt is None:
+        fmt = 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        elif fmt == 'jsonl':
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            raise ValueError(f"不支持的导入格式: {fmt}")
+
+
+def _to_int(value):
+    if value is None or isinstance(value, int):
+        return value
+    value = str(value).strip()
+    return int(value) if value else None
+
+
+def normalize_book(record):
+    """
+    把一条原始记录转换成插入用的元组。
+    必填字段缺失或数值无效时抛出 ValueError。
+    """
+    def text(name):
+        value = record.get(name)
+        value = str(value).strip() if value is not None else ''
+        return value or None
+
+    title, author, isbn = text('title'), text('author'), text('isbn')
+    if not title or not author or not isbn:
+        raise ValueError('书名、作者和 ISBN 为必填项')
+    publication_year = _to_int(record.get('publication_year'))
+    total_stock = _to_int(record.get('total_stock')) or 0
+    if total_stock < 0:
+        raise ValueError('总库存不能为负数')
+    return (title, author, isbn, text('publisher'), publication_year, text('category'),
+            total_stock, total_stock)
+
+
+def import_books(conn, records, batch_size=5000, progress=None):
+    """
+    把图书记录批量导入数据库，按 ISBN 插入或更新 (upsert)。
+    每 batch_size 条记录用一条多行 INSERT 写入并提交一次，失败时只回滚当前批次。
+    :param conn: psycopg2 连接。
+    :param records: 可迭代的记录字典 (例如 read_records 的结果)。
+    :param progress: 每提交一个批次后调用 progress(stats)。
+    :return: ImportStats。
+    """
+    stats = ImportStats()
+    batch = {}
+
+    def flush():
+        if not batch:
+            return
+        with conn.cursor() as cur:
+            try:
+                results = execute_values(cur, UPSERT_BOOKS_SQL, list(batch.values()),
+                                         page_size=len(batch), fetch=True)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        inserted = sum(1 for row in results if row[0])
+        stats.inserted += inserted
+        stats.updated += len(results) - inserted
+        batch.clear()
+        if progress:
+            progress(stats)
+
+    for record in records:
+        stats.read += 1
+        try:
+            row = normalize_book(record)
+        except (ValueError, TypeError, AttributeError) as e:
+            stats.skipped += 1
+            if len(stats.errors) < 20:
+                stats.errors.append(f"第 {stats.read} 条记录: {e}")
+            continue
+        # 同一批次中重复的 ISBN 只保留最后一条，否则 ON CONFLICT 会报错
+        batch[row[2]] = row
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return stats
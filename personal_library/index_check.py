@@ -0,0 +1,135 @@
+from . import db, stats
+
+# 需要验证的查询: (说明, SQL, 参数, 期望使用的索引)
+# SQL 与 app.py 中对应路由的查询保持一致
+INDEX_CHECKS = [
+    ("当前借阅 (view_activeloans)",
+     "SELECT * FROM view_activeloans ORDER BY due_date, loan_id",
+     (), 'idx_loans_active_due_date'),
+    ("逾期借阅 (view_overdueloans)",
+     "SELECT * FROM view_overdueloans ORDER BY due_date, loan_id",
+     (), 'idx_loans_active_due_date'),
+    ("删除图书前的未归还检查",
+     "SELECT 1 FROM loans WHERE book_id = %s AND return_date IS NULL LIMIT 1",
+     (1,), 'idx_loans_active_book_id'),
+    ("删除读者前的未归还检查",
+     "SELECT 1 FROM loans WHERE reader_id = %s AND return_date IS NULL LIMIT 1",
+     (1,), 'idx_loans_active_reader_id'),
+    ("读者借阅历史",
+     """SELECT l.loan_id, b.title AS book_title, b.isbn, l.loan_date, l.due_date, l.return_date
+        FROM loans l JOIN books b ON l.book_id = b.book_id
+        WHERE l.reader_id = %s ORDER BY l.loan_date DESC, l.loan_id DESC LIMIT %s""",
+     (1, 26), 'idx_loans_reader_history'),
+    ("读者借阅历史 (更早的记录)",
+     """SELECT l.loan_id, b.title AS book_title, b.isbn, l.loan_date, l.due_date, l.return_date
+        FROM loans l JOIN books b ON l.book_id = b.book_id
+        WHERE l.reader_id = %s AND (l.loan_date, l.loan_id) < (%s, %s)
+        ORDER BY l.loan_date DESC, l.loan_id DESC LIMIT %s""",
+     (1, '2025-01-01', 1000, 26), 'idx_loans_reader_history'),
+    ("图书借阅历史",
+     """SELECT l.loan_id, r.name AS reader_name, r.reader_number, l.loan_date, l.due_date, l.return_date
+        FROM loans l JOIN readers r ON l.reader_id = r.reader_id
+        WHERE l.book_id = %s ORDER BY l.loan_date DESC, l.loan_id DESC LIMIT %s""",
+     (1, 26), 'idx_loans_book_history'),
+    ("借阅历史摘要的逾期数",
+     """SELECT COUNT(*) FROM loans
+        WHERE reader_id = %s AND return_date IS NULL AND due_date < CURRENT_DATE""",
+     (1,), 'idx_loans_active_reader_id'),
+    ("借书表单的图书输入提示",
+     """SELECT book_id, title, author, available_stock FROM books
+        WHERE lower(title) LIKE %s AND available_stock > 0
+        ORDER BY lower(title) USING ~<~, book_id LIMIT %s""",
+     ('a%', 20), 'idx_books_title_prefix'),
+    ("借书表单的读者输入提示 (姓名)",
+     """SELECT reader_id, name, reader_number FROM readers
+        WHERE lower(name) LIKE %s ORDER BY lower(name) USING ~<~, reader_id LIMIT %s""",
+     ('a%', 20), 'idx_readers_name_prefix'),
+    ("借书表单的读者输入提示 (编号)",
+     """SELECT reader_id, name, reader_number FROM readers
+        WHERE reader_number LIKE %s ORDER BY reader_number USING ~<~ LIMIT %s""",
+     ('R0%', 20), 'idx_readers_number_prefix'),
+    ("读者目录分页",
+     """SELECT reader_id, name, reader_number, contact FROM readers
+        WHERE (name, reader_id) > (%s, %s) ORDER BY name, reader_id LIMIT %s""",
+     ('', 0, 51), 'idx_readers_name_keyset'),
+    ("读者目录搜索 (联系方式)",
+     """SELECT reader_id, name, reader_number, contact FROM readers
+        WHERE lower(contact) LIKE %s""",
+     ('a%',), 'idx_readers_contact_prefix'),
+    ("热门图书排行", stats.POPULAR_BOOKS_SQL, (20,), 'idx_stats_book_loans_popular'),
+    ("活跃读者排行", stats.ACTIVE_READERS_SQL, (20,), 'idx_stats_reader_loans_activity'),
+]
+
+
+def _plan_nodes(plan):
+    """深度优先遍历 EXPLAIN (FORMAT JSON) 的计划树。"""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+def explain(query, args=(), force_index=True):
+    """
+    返回查询的执行计划 (JSON 格式的根节点)。
+    force_index 为 True 时在事务内关闭顺序扫描和位图扫描: 数据量很小的开发库上规划器总是偏好顺序扫描，
+    关闭后才能证明索引 "可以" 被使用；在生产规模的数据上应以 force_index=False 验证。
+    """
+    conn = db.get_db()
+    try:
+        with conn.cursor() as cur:
+            if force_index:
+                cur.execute("SET LOCAL enable_seqscan = off")
+                cur.execute("SET LOCAL enable_bitmapscan = off")
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, args)
+            return cur.fetchone()[0][0]['Plan']
+    finally:
+        conn.rollback()  # 撤销 SET LOCAL
+
+
+def index_names(index):
+    """
+    返回索引及其所有分区索引的名称。
+    在分区表 (loans) 上，执行计划中出现的是各分区自己的索引，它们都挂在父表的索引下面。
+    """
+    rows = db.query_db("""
+        WITH RECURSIVE family AS (
+            SELECT to_regclass(%s)::oid AS oid
+            UNION ALL
+            SELECT i.inhrelid FROM pg_inherits i JOIN family f ON i.inhparent = f.oid
+        )
+        SELECT c.relname FROM pg_class c JOIN family f ON c.oid = f.oid
+    """, [index])
+    return {row[0] for row in rows} | {index}
+
+
+def check_indexes(force_index=True):
+    """
+    对 INDEX_CHECKS 中的每个查询执行 EXPLAIN，检查是否使用了期望的索引。
+    :return: 结果字典列表，包含 description、index、ok、scan (使用该索引的扫描类型) 和 plan。
+    """
+    results = []
+    for description, query, args, index in INDEX_CHECKS:
+        plan = explain(query, args, force_index=force_index)
+        names = index_names(index)
+        scans = [node['Node Type'] for node in _plan_nodes(plan) if node.get('Index Name') in names]
+        results.append({
+            'description': description,
+            'index': index,
+            'ok': bool(scans),
+            'scan': scans[0] if scans else None,
+            'plan': plan,
+        })
+    return results
+
+
+def format_plan(plan, depth=0):
+    """把 JSON 计划树格式化成缩进的文本行。"""
+    line = '  ' * depth + '-> ' + plan['Node Type']
+    if plan.get('Index Name'):
+        line += f" using {plan['Index Name']}"
+    if plan.get('Relation Name'):
+        line += f" on {plan['Relation Name']}"
+    lines = [line]
+    for child in plan.get('Plans', []):
+        lines.extend(format_plan(child, depth + 1))
+    return lines
@@ -0,0 +1,318 @@
+"""
+SQL 插桩与指标。
+
+连接池使用 InstrumentedConnection 创建连接，该连接上的所有游标 (query_db、execute_sql_file、
+借书/还书等视图中直接使用的游标、服务器端游标) 执行每条语句时都会:
+- 记录到当前请求的 g.query_log (语句指纹、耗时、行数)
+- 累计到进程级指标 (按语句指纹统计次数和耗时)
+- 超过 SLOW_QUERY_THRESHOLD_MS 时写入慢查询日志，并对 SELECT 捕获 EXPLAIN 执行计划
+
+每个响应带 Server-Timing 头 (数据库耗时、语句数、总耗时)，/metrics 以 Prometheus 文本格式输出指标，
+/metrics/slow-queries 以 JSON 返回最近的慢查询。
+"""
+import functools
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+
+import psycopg2
+import psycopg2.extensions
+from flask import current_app, g, has_app_context, has_request_context, request
+
+from . import db
+
+METRICS_DEFAULTS = {
+    'DB_INSTRUMENTATION': True,          # 是否为数据库连接插桩
+    'SLOW_QUERY_THRESHOLD_MS': 200.0,    # 超过该毫秒数的语句记为慢查询
+    'SLOW_QUERY_EXPLAIN': True,          # 是否为慢 SELECT 捕获 EXPLAIN
+    'SLOW_QUERY_EXPLAIN_INTERVAL': 60.0, # 同一语句指纹两次 EXPLAIN 之间至少间隔的秒数
+    'SLOW_QUERY_LOG_SIZE': 100,          # 保留的最近慢查询条数
+    'SERVER_TIMING': True,               # 是否添加 Server-Timing 响应头
+}
+
+# 直方图的桶上限 (秒)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每个请求语句数的桶上限
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_FINGERPRINT_RULES = [
+    (re.compile(r'--[^\n]*'), ''),
+    (re.compile(r'/\*.*?\*/', re.S), ''),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%\(\w+\)s|%s'), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),
+    (re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+'), '(?), ...'),
+    (re.compile(r'\s+'), ' '),
+]
+
+_EXECUTE_RE = re.compile(r'\s*EXECUTE\s+(\w+)')
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(query):
+    """
+    把 SQL 归一化为指纹: 去掉注释，字面量和占位符替换为 ?，多行 VALUES 折叠，空白合并。
+    参数不同的同一条语句得到相同的指纹；EXECUTE 预备语句使用注册时的 SQL 计算指纹。
+    """
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    match = _EXECUTE_RE.match(query)
+    if match and match.group(1) in db.STATEMENTS:
+        query = db.STATEMENTS[match.group(1)].sql  # 预备语句按原始 SQL 统计
+    for pattern, replacement in _FINGERPRINT_RULES:
+        query = pattern.sub(replacement, query)
+    return query.strip().rstrip(';').strip()
+
+
+class Registry:
+    """进程级的计数器和直方图，线程安全。标签以 ((名称, 值), ...) 元组表示。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, labels=(), amount=1.0):
+        with self._lock:
+            self.counters[(name, labels)] += amount
+
+    def observe(self, name, value, buckets, labels=()):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = {
+                    'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(value, counts=list(value['counts'])) for key, value in self.histograms.items()}
+        return counters, histograms
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+slow_queries = deque(maxlen=METRICS_DEFAULTS['SLOW_QUERY_LOG_SIZE'])
+_last_explain = {}
+
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'none'
+    return 'none'
+
+
+def explain(cursor, query, vars):
+    """
+    在同一连接 (同一事务) 中获取语句的执行计划。
+    使用保存点，EXPLAIN 失败时不会使调用者的事务进入中止状态。
+    """
+    conn = cursor.connection
+    plain = psycopg2.extensions.cursor(conn)
+    savepoint = not conn.autocommit
+    try:
+        if savepoint:
+            plain.execute("SAVEPOINT slow_query_explain")
+        plain.execute(b"EXPLAIN " + (query if isinstance(query, bytes) else query.encode('utf-8')), vars)
+        plan = '\n'.join(row[0] for row in plain.fetchall())
+        if savepoint:
+            plain.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    except psycopg2.Error as e:
+        if savepoint:
+            plain.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+        return f"EXPLAIN 失败: {e}"
+    finally:
+        plain.close()
+
+
+def record_query(cursor, query, vars, duration, error=None):
+    """记录一条语句的执行情况 (由 InstrumentedCursor 调用)。"""
+    statement = fingerprint(query)
+    rows = cursor.rowcount if error is None else -1
+    endpoint = current_endpoint()
+    if has_app_context() and 'query_log' in g:
+        g.query_log.append({'fingerprint': statement, 'duration': duration, 'rows': rows})
+    labels = (('statement', statement[:200]),)
+    registry.inc('library_db_statements_total', labels)
+    registry.inc('library_db_statement_seconds_total', labels, duration)
+    registry.observe('library_db_query_duration_seconds', duration, DURATION_BUCKETS)
+    if error is not None:
+        registry.inc('library_db_statement_errors_total', labels)
+
+    config = current_app.config if has_app_context() else METRICS_DEFAULTS
+    if duration * 1000 < config['SLOW_QUERY_THRESHOLD_MS'] or error is not None:
+        return
+    registry.inc('library_db_slow_queries_total', (('endpoint', endpoint),))
+    plan = None
+    is_select = statement.split(' ', 1)[0].lower() in ('select', 'with')
+    if config['SLOW_QUERY_EXPLAIN'] and is_select and cursor.name is None:
+        now = time.monotonic()
+        if now - _last_explain.get(statement, float('-inf')) >= config['SLOW_QUERY_EXPLAIN_INTERVAL']:
+            _last_explain[statement] = now
+            plan = explain(cursor, query, vars)
+    entry = {
+        'time': time.time(),
+        'endpoint': endpoint,
+        'duration_ms': round(duration * 1000, 3),
+        'rows': rows,
+        'fingerprint': statement,
+        'plan': plan,
+    }
+    slow_queries.append(entry)
+    if has_app_context():
+        current_app.logger.warning(
+            f"慢查询 {entry['duration_ms']:.1f} ms ({endpoint}): {statement}" + (f"\n{plan}" if plan else ""))
+
+
+def instrument_cursor(cursor_class):
+    """返回 cursor_class 的子类，在 execute/executemany 前后计时并调用 record_query。"""
+    class InstrumentedCursor(cursor_class):
+        def execute(self, query, vars=None):
+            start = time.perf_counter()
+            try:
+                result = super().execute(query, vars)
+            except psycopg2.Error as e:
+                record_query(self, query, vars, time.perf_counter() - start, error=e)
+                raise
+            record_query(self, query, vars, time.perf_counter() - start)
+            return result
+
+        def executemany(self, query, vars_list):
+            start = time.perf_counter()
+            try:
+                result = super().executemany(query, vars_list)
+            except psycopg2.Error as e:
+                record_query(self, query, None, time.perf_counter() - start, error=e)
+                raise
+            record_query(self, query, None, time.perf_counter() - start)
+            return result
+
+    InstrumentedCursor.__name__ = f'Instrumented{cursor_class.__name__}'
+    return InstrumentedCursor
+
+
+_instrumented_cursors = {}
+
+
+class InstrumentedConnection(db.PooledConnection):
+    """连接池使用的连接类: 无论调用者指定哪种 cursor_factory，创建的游标都带插桩。"""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        instrumented = _instrumented_cursors.get(factory)
+        if instrumented is None:
+            instrumented = _instrumented_cursors.setdefault(factory, instrument_cursor(factory))
+        kwargs['cursor_factory'] = instrumented
+        return super().cursor(*args, **kwargs)
+
+
+def start_request():
+    g.query_log = []
+    g.request_started = time.perf_counter()
+
+
+def finish_request(response):
+    """汇总本请求的语句数和耗时，记录请求指标并添加 Server-Timing 头。"""
+    if 'request_started' not in g:
+        return response
+    total = time.perf_counter() - g.request_started
+    queries = g.get('query_log', [])
+    db_time = sum(entry['duration'] for entry in queries)
+    endpoint = current_endpoint()
+    registry.inc('library_http_requests_total',
+                 (('endpoint', endpoint), ('method', request.method), ('status', str(response.status_code))))
+    registry.observe('library_http_request_duration_seconds', total, DURATION_BUCKETS, (('endpoint', endpoint),))
+    registry.observe('library_db_queries_per_request', len(queries), QUERY_COUNT_BUCKETS,
+                     (('endpoint', endpoint),))
+    registry.inc('library_db_request_seconds_total', (('endpoint', endpoint),), db_time)
+    if current_app.config['SERVER_TIMING']:
+        response.headers.add('Server-Timing',
+                             f'db;dur={db_time * 1000:.2f};desc="{len(queries)} queries", app;dur={total * 1000:.2f}')
+    return response
+
+
+METRIC_HELP = {
+    'library_http_requests_total': ('counter', '按端点、方法和状态码统计的请求数'),
+    'library_http_request_duration_seconds': ('histogram', '请求处理耗时 (不含流式响应的发送)'),
+    'library_db_queries_per_request': ('histogram', '每个请求执行的 SQL 语句数'),
+    'library_db_request_seconds_total': ('counter', '按端点累计的数据库耗时'),
+    'library_db_query_duration_seconds': ('histogram', '单条 SQL 语句的耗时'),
+    'library_db_statements_total': ('counter', '按语句指纹统计的执行次数'),
+    'library_db_statement_seconds_total': ('counter', '按语句指纹累计的执行耗时'),
+    'library_db_statement_errors_total': ('counter', '按语句指纹统计的执行错误'),
+    'library_db_slow_queries_total': ('counter', '按端点统计的慢查询数'),
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render_prometheus(pool_stats=None, cache_stats=None, replica_stats=None):
+    """按 Prometheus 文本格式输出所有指标，以及连接池、只读副本和缓存的当前状态。"""
+    counters, histograms = registry.snapshot()
+    series = defaultdict(list)
+    for (name, labels), value in counters.items():
+        series[name].append(f'{name}{_labels(labels)} {value:g}')
+    for (name, labels), histogram in histograms.items():
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            series[name].append(f'{name}_bucket{_labels(labels, [("le", f"{bound:g}")])} {count}')
+        series[name].append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {histogram["count"]}')
+        series[name].append(f'{name}_sum{_labels(labels)} {histogram["sum"]:g}')
+        series[name].append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+
+    lines = []
+    for name in sorted(series):
+        kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(sorted(series[name]))
+    for prefix, stats in (('library_db_pool', pool_stats), ('library_db_replica', replica_stats),
+                          ('library_cache', cache_stats)):
+        for key, value in sorted((stats or {}).items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'# TYPE {prefix}_{key} gauge')
+                lines.append(f'{prefix}_{key} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """
+    按同名环境变量或 app.config 设置插桩配置；启用时让连接池使用 InstrumentedConnection，
+    并注册请求钩子。
+    """
+    for key, default in METRICS_DEFAULTS.items():
+        value = app.config.get(key, os.environ.get(key, default))
+        if isinstance(default, bool):
+            if isinstance(value, str):
+                value = value.lower() in ('1', 'true', 'yes', 'on')
+        else:
+            value = type(default)(value)
+        app.config[key] = value
+    global slow_queries
+    if slow_queries.maxlen != app.config['SLOW_QUERY_LOG_SIZE']:
+        slow_queries = deque(slow_queries, maxlen=app.config['SLOW_QUERY_LOG_SIZE'])
+    if app.config['DB_INSTRUMENTATION']:
+        app.config.setdefault('DB_CONNECTION_FACTORY', InstrumentedConnection)
+        app.before_request(start_request)
+        app.after_request(finish_request)
@@ -0,0 +1,3 @@
+-- 图书列表按 (title, book_id) 做键集分页，用复合索引替换单列书名索引
+CREATE INDEX IF NOT EXISTS idx_books_title_book_id ON books(title, book_id);
+DROP INDEX IF EXISTS idx_books_title;
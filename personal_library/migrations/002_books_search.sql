@@ -0,0 +1,78 @@
+-- 图书全文检索: search_vector 列、触发器、GIN 索引，以及可选的 pg_trgm 索引
+ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+-- 全文检索: 把文本转换成检索词序列。
+-- 中日韩文字没有空格分词，按单字和相邻双字 (bigram) 切分，其余文字交给 simple 分词器。
+CREATE OR REPLACE FUNCTION fn_search_tokens(input TEXT)
+RETURNS TEXT AS $$
+DECLARE
+    cjk CONSTANT TEXT := '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿';
+    result TEXT := '';
+    part TEXT;
+    i INTEGER;
+BEGIN
+    IF input IS NULL THEN
+        RETURN '';
+    END IF;
+    FOR part IN
+        SELECT m[1] FROM regexp_matches(lower(input), '([' || cjk || ']+|[^' || cjk || ']+)', 'g') AS m
+    LOOP
+        IF part ~ ('^[' || cjk || ']') THEN
+            FOR i IN 1..length(part) LOOP
+                result := result || ' ' || substr(part, i, 1);
+                IF i < length(part) THEN
+                    result := result || ' ' || substr(part, i, 2);
+                END IF;
+            END LOOP;
+        ELSE
+            result := result || ' ' || part;
+        END IF;
+    END LOOP;
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- 把用户输入转换成前缀匹配的 tsquery，所有检索词都必须出现 (AND)；没有检索词时返回 NULL
+CREATE OR REPLACE FUNCTION fn_search_query(input TEXT)
+RETURNS tsquery AS $$
+    SELECT to_tsquery('simple', string_agg(quote_literal(lexeme) || ':*', ' & '))
+    FROM unnest(tsvector_to_array(to_tsvector('simple', fn_search_tokens(input)))) AS lexeme;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION fn_books_search_vector()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', fn_search_tokens(NEW.title)), 'A') ||
+        setweight(to_tsvector('simple', fn_search_tokens(NEW.author)), 'B');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_books_search_vector ON books;
+CREATE TRIGGER trg_books_search_vector
+BEFORE INSERT OR UPDATE OF title, author ON books
+FOR EACH ROW
+EXECUTE FUNCTION fn_books_search_vector();
+
+CREATE INDEX IF NOT EXISTS idx_books_search_vector ON books USING GIN (search_vector);
+
+-- pg_trgm 可用时为书名和作者建立三元组索引，让子串搜索 (ILIKE '%词%') 也能走索引
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS idx_books_title_trgm ON books USING GIN (title gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_books_author_trgm ON books USING GIN (author gin_trgm_ops);
+    ELSE
+        RAISE NOTICE 'pg_trgm 扩展不可用，子串搜索将使用顺序扫描。';
+    END IF;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE '没有权限创建 pg_trgm 扩展，子串搜索将使用顺序扫描。';
+END;
+$$;
+
+-- 为已有图书填充检索向量
+UPDATE books SET search_vector =
+    setweight(to_tsvector('simple', fn_search_tokens(title)), 'A') ||
+    setweight(to_tsvector('simple', fn_search_tokens(author)), 'B');
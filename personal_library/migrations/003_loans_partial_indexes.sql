@@ -0,0 +1,18 @@
+-- 为未归还借阅建立部分索引，为借阅历史建立覆盖索引，替换原来的单列索引
+-- 未归还借阅的部分索引: 只包含 return_date IS NULL 的行，历史借阅再多也不会变大。
+-- INCLUDE 的列覆盖 view_activeloans/view_overdueloans 需要的 loans 列，可以做仅索引扫描。
+CREATE INDEX IF NOT EXISTS idx_loans_active_due_date ON loans(due_date)
+    INCLUDE (loan_id, book_id, reader_id, loan_date) WHERE return_date IS NULL;
+-- 删除图书/读者前检查是否有未归还借阅
+CREATE INDEX IF NOT EXISTS idx_loans_active_book_id ON loans(book_id) WHERE return_date IS NULL;
+CREATE INDEX IF NOT EXISTS idx_loans_active_reader_id ON loans(reader_id) WHERE return_date IS NULL;
+-- 借阅历史查询的覆盖索引，按 loan_date 倒序直接读取；也服务于外键检查
+CREATE INDEX IF NOT EXISTS idx_loans_reader_history ON loans(reader_id, loan_date DESC)
+    INCLUDE (loan_id, book_id, due_date, return_date);
+CREATE INDEX IF NOT EXISTS idx_loans_book_history ON loans(book_id, loan_date DESC)
+    INCLUDE (loan_id, reader_id, due_date, return_date);
+
+DROP INDEX IF EXISTS idx_loans_book_id;
+DROP INDEX IF EXISTS idx_loans_reader_id;
+DROP INDEX IF EXISTS idx_loans_due_date;
+DROP INDEX IF EXISTS idx_loans_return_date;
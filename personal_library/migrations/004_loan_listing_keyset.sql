@@ -0,0 +1,39 @@
+-- 借阅列表按 (due_date, loan_id) 键集分页: 重建未归还借阅索引，视图增加 book_id/reader_id 以便筛选
+DROP INDEX IF EXISTS idx_loans_active_due_date;
+-- 键 (due_date, loan_id) 同时服务于按应还日期的键集分页。
+CREATE INDEX idx_loans_active_due_date ON loans(due_date, loan_id)
+    INCLUDE (book_id, reader_id, loan_date) WHERE return_date IS NULL;
+
+CREATE OR REPLACE VIEW view_activeloans AS
+SELECT
+    L.loan_id,
+    R.name AS reader_name,
+    R.reader_number,
+    B.title AS book_title,
+    B.isbn,
+    L.loan_date,
+    L.due_date,
+    L.book_id,
+    L.reader_id
+FROM loans L
+JOIN books B ON L.book_id = B.book_id
+JOIN readers R ON L.reader_id = R.reader_id
+WHERE L.return_date IS NULL;
+
+CREATE OR REPLACE VIEW view_overdueloans AS
+SELECT
+    L.loan_id,
+    R.name AS reader_name,
+    R.reader_number,
+    R.contact AS reader_contact,
+    B.title AS book_title,
+    B.isbn,
+    L.loan_date,
+    L.due_date,
+    L.book_id,
+    L.reader_id,
+    CURRENT_DATE - L.due_date AS days_overdue
+FROM loans L
+JOIN books B ON L.book_id = B.book_id
+JOIN readers R ON L.reader_id = R.reader_id
+WHERE L.return_date IS NULL AND L.due_date < CURRENT_DATE;
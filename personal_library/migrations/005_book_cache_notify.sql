@@ -0,0 +1,27 @@
+-- 图书缓存失效通知 (LISTEN/NOTIFY)
+-- 图书变更 (包括借还书触发器对库存的更新) 时通知应用使缓存失效，通知在事务提交时才送达
+CREATE OR REPLACE FUNCTION fn_notify_book_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('library_cache', 'books:*');
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('library_cache', 'book:' || OLD.book_id);
+    ELSE
+        PERFORM pg_notify('library_cache', 'book:' || NEW.book_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notify_book_change ON books;
+CREATE TRIGGER trg_notify_book_change
+AFTER INSERT OR UPDATE OR DELETE ON books
+FOR EACH ROW
+EXECUTE FUNCTION fn_notify_book_change();
+
+DROP TRIGGER IF EXISTS trg_notify_books_truncate ON books;
+CREATE TRIGGER trg_notify_books_truncate
+AFTER TRUNCATE ON books
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_notify_book_change();
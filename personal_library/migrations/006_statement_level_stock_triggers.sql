@@ -0,0 +1,72 @@
+-- 把逐行的库存触发器替换为使用转换表的语句级触发器
+DROP TRIGGER IF EXISTS trg_decrement_stock_on_borrow ON loans;
+DROP TRIGGER IF EXISTS trg_update_stock_on_loan_change ON loans;
+DROP TRIGGER IF EXISTS trg_increment_stock_on_loan_delete ON loans;
+DROP FUNCTION IF EXISTS fn_decrement_stock_on_borrow();
+DROP FUNCTION IF EXISTS fn_update_stock_on_loan_change();
+DROP FUNCTION IF EXISTS fn_increment_stock_on_loan_delete();
+
+-- 库存维护: 语句级触发器通过转换表 (transition table) 汇总每本书的变化量，
+-- 每条语句对每本受影响的图书只执行一次 UPDATE，而不是每一行借阅记录一次。
+CREATE OR REPLACE FUNCTION fn_update_stock_on_loans()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE books B
+        SET available_stock = B.available_stock - D.loan_count
+        FROM (
+            SELECT book_id, COUNT(*) AS loan_count
+            FROM new_loans
+            WHERE return_date IS NULL
+            GROUP BY book_id
+        ) D
+        WHERE B.book_id = D.book_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE books B
+        SET available_stock = B.available_stock + D.loan_count
+        FROM (
+            SELECT book_id, COUNT(*) AS loan_count
+            FROM old_loans
+            WHERE return_date IS NULL
+            GROUP BY book_id
+        ) D
+        WHERE B.book_id = D.book_id;
+    ELSE
+        -- 修改前未归还的借阅归还库存，修改后未归还的借阅占用库存 (同时正确处理 book_id 的修改)
+        UPDATE books B
+        SET available_stock = B.available_stock + D.delta
+        FROM (
+            SELECT book_id, SUM(delta) AS delta
+            FROM (
+                SELECT book_id, 1 AS delta FROM old_loans WHERE return_date IS NULL
+                UNION ALL
+                SELECT book_id, -1 AS delta FROM new_loans WHERE return_date IS NULL
+            ) changes
+            GROUP BY book_id
+        ) D
+        WHERE B.book_id = D.book_id AND D.delta <> 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_stock_on_loans_insert ON loans;
+CREATE TRIGGER trg_stock_on_loans_insert
+AFTER INSERT ON loans
+REFERENCING NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_stock_on_loans();
+
+DROP TRIGGER IF EXISTS trg_stock_on_loans_update ON loans;
+CREATE TRIGGER trg_stock_on_loans_update
+AFTER UPDATE ON loans
+REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_stock_on_loans();
+
+DROP TRIGGER IF EXISTS trg_stock_on_loans_delete ON loans;
+CREATE TRIGGER trg_stock_on_loans_delete
+AFTER DELETE ON loans
+REFERENCING OLD TABLE AS old_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_stock_on_loans();
@@ -0,0 +1,114 @@
+-- 借阅统计: 每本书、每位读者的累计借阅数、当前借阅数和最近借阅日期，
+-- 由 loans 上的语句级触发器增量维护，报表页面不再对整个 loans 表做 GROUP BY。
+-- 借书/还书本来就会锁定图书行 (库存)，同一图书的统计行不会带来额外的锁竞争。
+CREATE TABLE IF NOT EXISTS stats_book_loans (
+    book_id INTEGER PRIMARY KEY REFERENCES books(book_id) ON DELETE CASCADE,
+    loan_count BIGINT NOT NULL DEFAULT 0,
+    active_count INTEGER NOT NULL DEFAULT 0,
+    last_loan_date DATE
+);
+CREATE INDEX IF NOT EXISTS idx_stats_book_loans_popular ON stats_book_loans(loan_count DESC, book_id);
+
+CREATE TABLE IF NOT EXISTS stats_reader_loans (
+    reader_id INTEGER PRIMARY KEY REFERENCES readers(reader_id) ON DELETE CASCADE,
+    loan_count BIGINT NOT NULL DEFAULT 0,
+    active_count INTEGER NOT NULL DEFAULT 0,
+    last_loan_date DATE
+);
+CREATE INDEX IF NOT EXISTS idx_stats_reader_loans_activity ON stats_reader_loans(loan_count DESC, reader_id);
+
+-- 把一条语句涉及的借阅变化累加到统计表: 旧行计为 -1，新行计为 +1
+-- (使用 PL/pgSQL 而不是 SQL 函数，语句的执行计划在会话内缓存，不必每次借还书都重新规划)
+CREATE OR REPLACE FUNCTION fn_apply_loan_stats(old_rows loans[], new_rows loans[])
+RETURNS VOID AS $$
+BEGIN
+    WITH changes AS (
+        SELECT book_id, reader_id, -1 AS loans, -(return_date IS NULL)::int AS active, NULL::date AS loan_date
+        FROM unnest(old_rows)
+        UNION ALL
+        SELECT book_id, reader_id, 1, (return_date IS NULL)::int, loan_date
+        FROM unnest(new_rows)
+    ), book_changes AS (
+        INSERT INTO stats_book_loans AS S (book_id, loan_count, active_count, last_loan_date)
+        SELECT book_id, SUM(loans), SUM(active), MAX(loan_date)
+        FROM changes
+        GROUP BY book_id
+        HAVING SUM(loans) <> 0 OR SUM(active) <> 0
+        ON CONFLICT (book_id) DO UPDATE
+        SET loan_count = S.loan_count + EXCLUDED.loan_count,
+            active_count = S.active_count + EXCLUDED.active_count,
+            last_loan_date = GREATEST(S.last_loan_date, EXCLUDED.last_loan_date)
+    )
+    INSERT INTO stats_reader_loans AS S (reader_id, loan_count, active_count, last_loan_date)
+    SELECT reader_id, SUM(loans), SUM(active), MAX(loan_date)
+    FROM changes
+    GROUP BY reader_id
+    HAVING SUM(loans) <> 0 OR SUM(active) <> 0
+    ON CONFLICT (reader_id) DO UPDATE
+    SET loan_count = S.loan_count + EXCLUDED.loan_count,
+        active_count = S.active_count + EXCLUDED.active_count,
+        last_loan_date = GREATEST(S.last_loan_date, EXCLUDED.last_loan_date);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fn_update_loan_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM fn_apply_loan_stats('{}'::loans[], ARRAY(SELECT N::loans FROM new_loans N));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM fn_apply_loan_stats(ARRAY(SELECT O::loans FROM old_loans O), '{}'::loans[]);
+    ELSE
+        PERFORM fn_apply_loan_stats(ARRAY(SELECT O::loans FROM old_loans O), ARRAY(SELECT N::loans FROM new_loans N));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_stats_on_loans_insert ON loans;
+CREATE TRIGGER trg_stats_on_loans_insert
+AFTER INSERT ON loans
+REFERENCING NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_loan_stats();
+
+DROP TRIGGER IF EXISTS trg_stats_on_loans_update ON loans;
+CREATE TRIGGER trg_stats_on_loans_update
+AFTER UPDATE ON loans
+REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_loan_stats();
+
+DROP TRIGGER IF EXISTS trg_stats_on_loans_delete ON loans;
+CREATE TRIGGER trg_stats_on_loans_delete
+AFTER DELETE ON loans
+REFERENCING OLD TABLE AS old_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_loan_stats();
+
+-- 用现有借阅记录回填 (触发器创建时已锁住 loans 的写入，回填与触发器之间不会漏记)
+INSERT INTO stats_book_loans (book_id, loan_count, active_count, last_loan_date)
+SELECT book_id, COUNT(*), COUNT(*) FILTER (WHERE return_date IS NULL), MAX(loan_date)
+FROM loans
+GROUP BY book_id
+ON CONFLICT (book_id) DO NOTHING;
+
+INSERT INTO stats_reader_loans (reader_id, loan_count, active_count, last_loan_date)
+SELECT reader_id, COUNT(*), COUNT(*) FILTER (WHERE return_date IS NULL), MAX(loan_date)
+FROM loans
+GROUP BY reader_id
+ON CONFLICT (reader_id) DO NOTHING;
+
+-- 按分类汇总: 图书的分类可能被修改，所以不做增量维护，而是由 flask refresh-stats 定时并发刷新。
+-- 刷新只读取 books 和 stats_book_loans，耗时与借阅历史的长度无关。
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_category_loans AS
+SELECT COALESCE(B.category, '未分类') AS category,
+       COUNT(*) AS book_count,
+       COALESCE(SUM(S.loan_count), 0) AS loan_count,
+       COALESCE(SUM(S.active_count), 0) AS active_count,
+       now() AS refreshed_at
+FROM books B
+LEFT JOIN stats_book_loans S ON S.book_id = B.book_id
+GROUP BY 1;
+-- REFRESH ... CONCURRENTLY 需要唯一索引
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_category_loans_category ON mv_category_loans(category);
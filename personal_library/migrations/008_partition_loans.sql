@@ -0,0 +1,198 @@
+-- 把 loans 转换为按 loan_date 以年为单位的分区表。
+-- 在一个事务中完成: 锁住 loans，按现有数据的年份范围建分区，复制数据，删除旧表后重建主键、外键、索引、
+-- 触发器和视图。复制期间借还书会被阻塞，数据量大时请在维护窗口执行。
+-- 为 first_year..last_year 中还没有分区的年份创建分区，返回新建的分区数 (由 flask create-partitions 定时调用)。
+-- 默认分区中已有的该年份的行先移到新分区；直接操作分区不会触发 loans 上的库存/统计触发器。
+CREATE OR REPLACE FUNCTION fn_create_loan_partitions(first_year INTEGER, last_year INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    y INTEGER;
+    partition_name TEXT;
+    lower_bound DATE;
+    upper_bound DATE;
+    created INTEGER := 0;
+BEGIN
+    FOR y IN first_year..last_year LOOP
+        partition_name := 'loans_y' || y;
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        lower_bound := make_date(y, 1, 1);
+        upper_bound := make_date(y + 1, 1, 1);
+        EXECUTE format('CREATE TABLE %I (LIKE loans INCLUDING DEFAULTS)', partition_name);
+        -- 与分区范围相同的 CHECK 约束让 ATTACH 不必再扫描新表
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (loan_date >= %L AND loan_date < %L)',
+                       partition_name, partition_name || '_range', lower_bound, upper_bound);
+        EXECUTE format('WITH moved AS (DELETE FROM loans_default WHERE loan_date >= %L AND loan_date < %L RETURNING *) '
+                       'INSERT INTO %I SELECT * FROM moved', lower_bound, upper_bound, partition_name);
+        EXECUTE format('ALTER TABLE loans ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', partition_name, partition_name || '_range');
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    y INTEGER;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'loans'::regclass) = 'p' THEN
+        RETURN;  -- 已经是分区表
+    END IF;
+
+    LOCK TABLE loans IN ACCESS EXCLUSIVE MODE;
+    ALTER TABLE loans RENAME TO loans_unpartitioned;
+    ALTER SEQUENCE loans_loan_id_seq OWNED BY NONE;
+
+    CREATE TABLE loans (
+        loan_id INTEGER NOT NULL DEFAULT nextval('loans_loan_id_seq'),
+        book_id INTEGER NOT NULL,
+        reader_id INTEGER NOT NULL,
+        loan_date DATE NOT NULL DEFAULT CURRENT_DATE,
+        due_date DATE NOT NULL,
+        return_date DATE DEFAULT NULL
+    ) PARTITION BY RANGE (loan_date);
+    CREATE TABLE loans_default PARTITION OF loans DEFAULT;
+
+    -- 只为有数据的年份以及今年、明年建分区 (与 schema.sql 相同)，中间没有数据的年份不建空分区
+    FOR y IN
+        SELECT DISTINCT EXTRACT(YEAR FROM loan_date)::int FROM loans_unpartitioned
+        UNION
+        SELECT generate_series(EXTRACT(YEAR FROM CURRENT_DATE)::int, EXTRACT(YEAR FROM CURRENT_DATE)::int + 1)
+    LOOP
+        PERFORM fn_create_loan_partitions(y, y);
+    END LOOP;
+
+    -- 先复制数据再建触发器，复制不会重复计算库存和统计
+    INSERT INTO loans (loan_id, book_id, reader_id, loan_date, due_date, return_date)
+    SELECT loan_id, book_id, reader_id, loan_date, due_date, return_date FROM loans_unpartitioned;
+    -- 同时删除依赖旧表的视图、触发器和 fn_apply_loan_stats (参数类型是旧表的行类型)，下面重建
+    DROP TABLE loans_unpartitioned CASCADE;
+
+    ALTER SEQUENCE loans_loan_id_seq OWNED BY loans.loan_id;
+    ALTER TABLE loans ADD PRIMARY KEY (loan_id, loan_date);
+    ALTER TABLE loans ADD FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE RESTRICT;
+    ALTER TABLE loans ADD FOREIGN KEY (reader_id) REFERENCES readers(reader_id) ON DELETE RESTRICT;
+
+    -- 未归还借阅的部分索引: 只包含 return_date IS NULL 的行，历史借阅再多也不会变大。
+    -- INCLUDE 的列覆盖 view_activeloans/view_overdueloans 需要的 loans 列，可以做仅索引扫描。
+    -- 键 (due_date, loan_id) 同时服务于按应还日期的键集分页。
+    CREATE INDEX idx_loans_active_due_date ON loans(due_date, loan_id)
+        INCLUDE (book_id, reader_id, loan_date) WHERE return_date IS NULL;
+    -- 删除图书/读者前检查是否有未归还借阅
+    CREATE INDEX idx_loans_active_book_id ON loans(book_id) WHERE return_date IS NULL;
+    CREATE INDEX idx_loans_active_reader_id ON loans(reader_id) WHERE return_date IS NULL;
+    -- 借阅历史查询的覆盖索引，按 loan_date 倒序直接读取；也服务于外键检查
+    CREATE INDEX idx_loans_reader_history ON loans(reader_id, loan_date DESC)
+        INCLUDE (loan_id, book_id, due_date, return_date);
+    CREATE INDEX idx_loans_book_history ON loans(book_id, loan_date DESC)
+        INCLUDE (loan_id, reader_id, due_date, return_date);
+
+    CREATE TRIGGER trg_stock_on_loans_insert
+    AFTER INSERT ON loans
+    REFERENCING NEW TABLE AS new_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION fn_update_stock_on_loans();
+
+    CREATE TRIGGER trg_stock_on_loans_update
+    AFTER UPDATE ON loans
+    REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION fn_update_stock_on_loans();
+
+    CREATE TRIGGER trg_stock_on_loans_delete
+    AFTER DELETE ON loans
+    REFERENCING OLD TABLE AS old_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION fn_update_stock_on_loans();
+
+    CREATE TRIGGER trg_stats_on_loans_insert
+    AFTER INSERT ON loans
+    REFERENCING NEW TABLE AS new_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION fn_update_loan_stats();
+
+    CREATE TRIGGER trg_stats_on_loans_update
+    AFTER UPDATE ON loans
+    REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION fn_update_loan_stats();
+
+    CREATE TRIGGER trg_stats_on_loans_delete
+    AFTER DELETE ON loans
+    REFERENCING OLD TABLE AS old_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION fn_update_loan_stats();
+
+    -- 新表没有统计信息，不分析的话规划器会选出很差的计划
+    ANALYZE loans;
+END;
+$$;
+
+-- 把一条语句涉及的借阅变化累加到统计表: 旧行计为 -1，新行计为 +1
+-- (使用 PL/pgSQL 而不是 SQL 函数，语句的执行计划在会话内缓存，不必每次借还书都重新规划)
+CREATE OR REPLACE FUNCTION fn_apply_loan_stats(old_rows loans[], new_rows loans[])
+RETURNS VOID AS $$
+BEGIN
+    WITH changes AS (
+        SELECT book_id, reader_id, -1 AS loans, -(return_date IS NULL)::int AS active, NULL::date AS loan_date
+        FROM unnest(old_rows)
+        UNION ALL
+        SELECT book_id, reader_id, 1, (return_date IS NULL)::int, loan_date
+        FROM unnest(new_rows)
+    ), book_changes AS (
+        INSERT INTO stats_book_loans AS S (book_id, loan_count, active_count, last_loan_date)
+        SELECT book_id, SUM(loans), SUM(active), MAX(loan_date)
+        FROM changes
+        GROUP BY book_id
+        HAVING SUM(loans) <> 0 OR SUM(active) <> 0
+        ON CONFLICT (book_id) DO UPDATE
+        SET loan_count = S.loan_count + EXCLUDED.loan_count,
+            active_count = S.active_count + EXCLUDED.active_count,
+            last_loan_date = GREATEST(S.last_loan_date, EXCLUDED.last_loan_date)
+    )
+    INSERT INTO stats_reader_loans AS S (reader_id, loan_count, active_count, last_loan_date)
+    SELECT reader_id, SUM(loans), SUM(active), MAX(loan_date)
+    FROM changes
+    GROUP BY reader_id
+    HAVING SUM(loans) <> 0 OR SUM(active) <> 0
+    ON CONFLICT (reader_id) DO UPDATE
+    SET loan_count = S.loan_count + EXCLUDED.loan_count,
+        active_count = S.active_count + EXCLUDED.active_count,
+        last_loan_date = GREATEST(S.last_loan_date, EXCLUDED.last_loan_date);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE VIEW view_activeloans AS
+SELECT
+    L.loan_id,
+    R.name AS reader_name,
+    R.reader_number,
+    B.title AS book_title,
+    B.isbn,
+    L.loan_date,
+    L.due_date,
+    L.book_id,
+    L.reader_id
+FROM loans L
+JOIN books B ON L.book_id = B.book_id
+JOIN readers R ON L.reader_id = R.reader_id
+WHERE L.return_date IS NULL;
+
+CREATE OR REPLACE VIEW view_overdueloans AS
+SELECT
+    L.loan_id,
+    R.name AS reader_name,
+    R.reader_number,
+    R.contact AS reader_contact,
+    B.title AS book_title,
+    B.isbn,
+    L.loan_date,
+    L.due_date,
+    L.book_id,
+    L.reader_id,
+    CURRENT_DATE - L.due_date AS days_overdue
+FROM loans L
+JOIN books B ON L.book_id = B.book_id
+JOIN readers R ON L.reader_id = R.reader_id
+WHERE L.return_date IS NULL AND L.due_date < CURRENT_DATE;
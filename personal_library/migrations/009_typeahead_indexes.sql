@@ -0,0 +1,4 @@
+-- 借书表单输入提示 (/loans/borrow/books, /loans/borrow/readers) 使用的前缀匹配索引
+CREATE INDEX IF NOT EXISTS idx_books_title_prefix ON books(lower(title) text_pattern_ops, book_id);
+CREATE INDEX IF NOT EXISTS idx_readers_name_prefix ON readers(lower(name) text_pattern_ops, reader_id);
+CREATE INDEX IF NOT EXISTS idx_readers_number_prefix ON readers(reader_number text_pattern_ops);
@@ -0,0 +1,46 @@
+-- 表级数据版本: books、readers、loans 每次变更时递增计数器，
+-- 列表页据此生成 ETag/Last-Modified (304 响应) 并作为渲染片段缓存键的一部分。
+-- 计数器分成 16 个分片，写事务按后端进程号只更新其中一行，
+-- 不同连接上的借还书不会在同一个计数器行上排队；读取时把各分片相加。
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT NOT NULL,
+    shard SMALLINT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (table_name, shard)
+);
+INSERT INTO table_versions (table_name, shard)
+SELECT table_name, shard
+FROM unnest(ARRAY['books', 'readers', 'loans']) AS table_name, generate_series(0, 15) AS shard
+ON CONFLICT DO NOTHING;
+
+-- 语句级触发器: 每条语句递增一次 (没有影响任何行的语句也会递增，只会多一次缓存失效)。
+-- changed_at 使用 clock_timestamp()，长事务中较晚的修改不会得到事务开始时的时间
+CREATE OR REPLACE FUNCTION fn_bump_table_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, changed_at = clock_timestamp()
+    WHERE table_name = TG_TABLE_NAME AND shard = pg_backend_pid() % 16;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 触发器名排在 trg_stock_on_loans_* 之后: 借还书先 (经库存触发器) 递增 books，再递增 loans
+DROP TRIGGER IF EXISTS trg_version_books ON books;
+CREATE TRIGGER trg_version_books
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON books
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_bump_table_version();
+
+DROP TRIGGER IF EXISTS trg_version_readers ON readers;
+CREATE TRIGGER trg_version_readers
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON readers
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_bump_table_version();
+
+DROP TRIGGER IF EXISTS trg_version_loans ON loans;
+CREATE TRIGGER trg_version_loans
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_bump_table_version();
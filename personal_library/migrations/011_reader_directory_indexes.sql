@@ -0,0 +1,5 @@
+-- 读者目录 (/readers) 按 (name, reader_id) 键集分页；原来只有 name 的索引被它取代
+CREATE INDEX IF NOT EXISTS idx_readers_name_keyset ON readers(name, reader_id);
+DROP INDEX IF EXISTS idx_readers_name;
+-- 读者目录按联系方式前缀搜索 (姓名和读者编号前缀使用借书表单输入提示的索引)
+CREATE INDEX IF NOT EXISTS idx_readers_contact_prefix ON readers(lower(contact) text_pattern_ops);
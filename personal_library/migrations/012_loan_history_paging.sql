@@ -0,0 +1,14 @@
+-- 借阅历史按 (loan_date, loan_id) 倒序键集分页: 索引键加上 loan_id，同一天的多条借阅也有确定的顺序
+DROP INDEX IF EXISTS idx_loans_reader_history;
+CREATE INDEX idx_loans_reader_history ON loans(reader_id, loan_date DESC, loan_id DESC)
+    INCLUDE (book_id, due_date, return_date);
+DROP INDEX IF EXISTS idx_loans_book_history;
+CREATE INDEX idx_loans_book_history ON loans(book_id, loan_date DESC, loan_id DESC)
+    INCLUDE (reader_id, due_date, return_date);
+
+-- 借阅历史摘要中的逾期数随日期变化，不能由触发器维护；
+-- 在未归还借阅的部分索引上按应还日期范围计数，只读取该读者/图书的未归还借阅
+DROP INDEX IF EXISTS idx_loans_active_book_id;
+CREATE INDEX idx_loans_active_book_id ON loans(book_id, due_date) WHERE return_date IS NULL;
+DROP INDEX IF EXISTS idx_loans_active_reader_id;
+CREATE INDEX idx_loans_active_reader_id ON loans(reader_id, due_date) WHERE return_date IS NULL;
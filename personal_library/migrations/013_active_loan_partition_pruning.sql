@@ -0,0 +1,160 @@
+-- 只为默认分区中实际有行的年份和今年起的 years_ahead 年创建分区。
+-- 原来的函数创建 first_year..last_year 之间的每一年，一条补录的早年借阅就会带来几十个空分区。
+DROP FUNCTION IF EXISTS fn_create_loan_partitions(INTEGER, INTEGER);
+CREATE OR REPLACE FUNCTION fn_create_loan_partitions(years_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    y INTEGER;
+    partition_name TEXT;
+    lower_bound DATE;
+    upper_bound DATE;
+    created INTEGER := 0;
+BEGIN
+    FOR y IN
+        SELECT DISTINCT EXTRACT(YEAR FROM loan_date)::int FROM loans_default
+        UNION
+        SELECT generate_series(EXTRACT(YEAR FROM CURRENT_DATE)::int, EXTRACT(YEAR FROM CURRENT_DATE)::int + years_ahead)
+        ORDER BY 1
+    LOOP
+        partition_name := 'loans_y' || y;
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        lower_bound := make_date(y, 1, 1);
+        upper_bound := make_date(y + 1, 1, 1);
+        EXECUTE format('CREATE TABLE %I (LIKE loans INCLUDING DEFAULTS)', partition_name);
+        -- 与分区范围相同的 CHECK 约束让 ATTACH 不必再扫描新表
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (loan_date >= %L AND loan_date < %L)',
+                       partition_name, partition_name || '_range', lower_bound, upper_bound);
+        EXECUTE format('WITH moved AS (DELETE FROM loans_default WHERE loan_date >= %L AND loan_date < %L RETURNING *) '
+                       'INSERT INTO %I SELECT * FROM moved', lower_bound, upper_bound, partition_name);
+        EXECUTE format('ALTER TABLE loans ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', partition_name, partition_name || '_range');
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 旧版 008 迁移为 first_year..last_year 的每一年都建了分区；分离并删除今年以前的空分区，
+-- 升级后的数据库与按 schema.sql 新建的数据库有相同的分区
+DO $$
+DECLARE
+    partition_name TEXT;
+    has_rows BOOLEAN;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'loans'::regclass AND c.relname ~ '^loans_y[0-9]{4}$'
+          AND substr(c.relname, 8)::int < EXTRACT(YEAR FROM CURRENT_DATE)::int
+    LOOP
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I)', partition_name) INTO has_rows;
+        CONTINUE WHEN has_rows;
+        EXECUTE format('ALTER TABLE loans DETACH PARTITION %I', partition_name);
+        EXECUTE format('DROP TABLE %I', partition_name);
+    END LOOP;
+END;
+$$;
+
+-- 未归还借阅的 loan_date 下界 (不大于最早的未归还借阅的借阅日期)。
+-- 当前/逾期借阅视图加上 loan_date >= 下界的条件，执行时跳过更早的分区 (只剩历史借阅的年份)。
+CREATE TABLE IF NOT EXISTS loans_active_since (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    since DATE NOT NULL
+);
+
+-- 重新计算下界: 最早的有未归还借阅的分区的起始日期 (默认分区按最早的借阅日期)，没有未归还借阅时为今天。
+-- 计算期间阻止借还书，否则并发插入的更早的未归还借阅可能不被计入。由 flask create-partitions/archive-loans 调用。
+CREATE OR REPLACE FUNCTION fn_refresh_loans_active_since()
+RETURNS DATE AS $$
+DECLARE
+    y INTEGER;
+    result DATE;
+BEGIN
+    LOCK TABLE loans IN SHARE MODE;
+    SELECT MIN(loan_date) INTO result FROM loans_default WHERE return_date IS NULL;
+    FOR y IN
+        SELECT substr(c.relname, 8)::int
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'loans'::regclass AND c.relname ~ '^loans_y[0-9]{4}$'
+        ORDER BY 1
+    LOOP
+        EXIT WHEN result IS NOT NULL AND make_date(y, 1, 1) >= result;
+        -- 在分区的未归还借阅部分索引上探查一行
+        IF EXISTS (SELECT 1 FROM loans
+                   WHERE return_date IS NULL AND loan_date >= make_date(y, 1, 1) AND loan_date < make_date(y + 1, 1, 1)) THEN
+            result := make_date(y, 1, 1);
+            EXIT;
+        END IF;
+    END LOOP;
+    result := COALESCE(result, CURRENT_DATE);
+    INSERT INTO loans_active_since (since) VALUES (result)
+    ON CONFLICT (id) DO UPDATE SET since = EXCLUDED.since;
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 插入或修改出早于下界的未归还借阅 (补录、撤销归还) 时降低下界；正常借书的借阅日期不早于下界，不更新这一行
+CREATE OR REPLACE FUNCTION fn_lower_loans_active_since()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE loans_active_since S
+    SET since = N.since
+    FROM (SELECT MIN(loan_date) AS since FROM new_loans WHERE return_date IS NULL) N
+    WHERE N.since < S.since;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_active_since_on_loans_insert ON loans;
+CREATE TRIGGER trg_active_since_on_loans_insert
+AFTER INSERT ON loans
+REFERENCING NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_lower_loans_active_since();
+
+DROP TRIGGER IF EXISTS trg_active_since_on_loans_update ON loans;
+CREATE TRIGGER trg_active_since_on_loans_update
+AFTER UPDATE ON loans
+REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_lower_loans_active_since();
+
+SELECT fn_refresh_loans_active_since();
+
+CREATE OR REPLACE VIEW view_activeloans AS
+SELECT
+    L.loan_id,
+    R.name AS reader_name,
+    R.reader_number,
+    B.title AS book_title,
+    B.isbn,
+    L.loan_date,
+    L.due_date,
+    L.book_id,
+    L.reader_id
+FROM loans L
+JOIN books B ON L.book_id = B.book_id
+JOIN readers R ON L.reader_id = R.reader_id
+WHERE L.return_date IS NULL AND L.loan_date >= (SELECT since FROM loans_active_since);
+
+CREATE OR REPLACE VIEW view_overdueloans AS
+SELECT
+    L.loan_id,
+    R.name AS reader_name,
+    R.reader_number,
+    R.contact AS reader_contact,
+    B.title AS book_title,
+    B.isbn,
+    L.loan_date,
+    L.due_date,
+    L.book_id,
+    L.reader_id,
+    CURRENT_DATE - L.due_date AS days_overdue
+FROM loans L
+JOIN books B ON L.book_id = B.book_id
+JOIN readers R ON L.reader_id = R.reader_id
+WHERE L.return_date IS NULL AND L.due_date < CURRENT_DATE
+  AND L.loan_date >= (SELECT since FROM loans_active_since);
@@ -0,0 +1,242 @@
+"""
+逾期通知批处理 (flask notify-overdue)。
+
+- 用服务器端游标按 reader_id 顺序流式读取 view_overdueloans，内存占用与逾期记录总数无关
+- 同一读者的逾期借阅合并成一条通知，由线程池并行渲染并写入 sink (文件或 SMTP)，
+  发送的网络等待可以互相重叠
+- 按读者顺序推进检查点: 某位读者之前的所有读者都已写入 sink 并 flush 之后才记录它，
+  中断后用 --resume 从检查点之后的读者继续。检查点之后、中断之前已发送的通知会再发送一次 (至少一次)
+"""
+import collections
+import concurrent.futures
+import datetime
+import itertools
+import json
+import os
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+from . import db
+
+# 按读者分组所需的排序: 同一读者的逾期借阅连续出现，读者内按应还日期排列
+OVERDUE_NOTICE_SQL = """
+    SELECT reader_id, reader_name, reader_number, reader_contact,
+           loan_id, book_title, isbn, loan_date, due_date, days_overdue
+    FROM view_overdueloans
+    WHERE reader_id > %s AND due_date <= CURRENT_DATE - %s
+    ORDER BY reader_id, due_date, loan_id
+"""
+
+NOTICE_TEMPLATE = 'notices/overdue.txt'
+
+
+class NoticeStats:
+    """一次通知批处理的统计信息。"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.readers = 0        # 已处理的读者数 (包括没有联系方式而跳过的)
+        self.loans = 0          # 已处理的逾期借阅数
+        self.sent = 0           # 写入 sink 的通知数
+        self.skipped = 0        # 没有联系方式或 sink 无法投递而跳过的读者数
+        self.last_reader_id = 0  # 检查点: 该读者及之前的读者都已处理
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def loans_per_sec(self):
+        elapsed = self.elapsed
+        return self.loans / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def notices_per_sec(self):
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+
+class FileSink:
+    """把通知逐行追加写入 JSONL 文件，用于本地测试或交给其他程序发送。可被多个线程同时调用。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def send(self, notice):
+        line = json.dumps(notice, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+        return True
+
+    def flush(self):
+        """写检查点之前调用，确保之前的通知已落盘。"""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class SmtpSink:
+    """
+    通过 SMTP 发送通知邮件，每个工作线程使用自己的连接。
+    联系方式不是邮箱地址的读者无法投递，send() 返回 False。
+    """
+
+    def __init__(self, host, port=25, sender='library@localhost'):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = smtplib.SMTP(self.host, self.port)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def send(self, notice):
+        if '@' not in (notice['to'] or ''):
+            return False
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = notice['to']
+        message['Subject'] = notice['subject']
+        message.set_content(notice['body'])
+        self._connection().send_message(message)
+        return True
+
+    def flush(self):
+        pass  # 服务器接受邮件后 send_message 才返回
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.quit()
+            except smtplib.SMTPException:
+                pass
+
+
+def create_sink(spec, sender='library@localhost'):
+    """
+    按描述创建 sink: 'file:路径' 追加写入 JSONL 文件，'smtp://主机[:端口]' 通过 SMTP 发送。
+    """
+    if spec.startswith('file:'):
+        return FileSink(spec[len('file:'):])
+    if spec.startswith('smtp://'):
+        host, _, port = spec[len('smtp://'):].rstrip('/').partition(':')
+        return SmtpSink(host, int(port or 25), sender=sender)
+    raise ValueError(f"未知的通知输出: {spec} (应为 file:路径 或 smtp://主机[:端口])")
+
+
+def load_checkpoint(path, today):
+    """读取检查点，返回已处理到的 reader_id。检查点不存在或不是今天的运行时返回 0 (从头开始)。"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return 0
+    if checkpoint.get('date') != today.isoformat():
+        return 0
+    return int(checkpoint['last_reader_id'])
+
+
+def save_checkpoint(path, today, stats):
+    """原子地写入检查点 (先写临时文件再替换)，中断时不会留下写了一半的检查点。"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'date': today.isoformat(), 'last_reader_id': stats.last_reader_id,
+                   'readers': stats.readers, 'loans': stats.loans, 'sent': stats.sent}, f)
+    os.replace(tmp_path, path)
+
+
+def render_notice(template, reader, loans):
+    """把一位读者的逾期借阅渲染成通知字典 (to, subject, body 等)。"""
+    return {
+        'reader_id': reader.reader_id,
+        'reader_number': reader.reader_number,
+        'to': reader.reader_contact,
+        'subject': f"图书逾期提醒: {len(loans)} 本图书已超过应还日期",
+        'body': template.render(reader=reader, loans=loans),
+        'loan_ids': [loan.loan_id for loan in loans],
+    }
+
+
+def send_overdue_notices(jinja_env, sink, workers=8, min_days=1, after_reader_id=0, checkpoint=None,
+                         checkpoint_every=1000, progress=None, progress_interval=5.0, itersize=2000):
+    """
+    为每位有逾期借阅的读者生成一条通知并写入 sink。需要在应用上下文中调用。
+    :param jinja_env: 渲染通知模板的 Jinja 环境 (app.jinja_env)。
+    :param min_days: 只通知逾期至少这么多天的借阅。
+    :param after_reader_id: 从该读者之后开始 (恢复中断的运行)。
+    :param checkpoint: 检查点文件路径，每处理 checkpoint_every 位读者以及结束时写入一次。
+    :param progress: 每隔 progress_interval 秒调用 progress(stats)。
+    :return: NoticeStats。
+    """
+    template = jinja_env.get_template(NOTICE_TEMPLATE)
+    today = datetime.date.today()
+    stats = NoticeStats()
+    stats.last_reader_id = after_reader_id
+    last_progress = time.monotonic()
+    since_checkpoint = 0
+    # 提交但尚未完成的读者，按提交 (reader_id) 顺序排列；限制数量避免读得比发得快时堆积在内存中
+    pending = collections.deque()
+    max_pending = workers * 4
+
+    def deliver(reader, loans):
+        if not reader.reader_contact:
+            return False
+        return sink.send(render_notice(template, reader, loans))
+
+    def finish_oldest():
+        nonlocal since_checkpoint
+        reader_id, loan_count, future = pending.popleft()
+        delivered = future.result()  # 发送失败时异常在这里抛出，检查点停在之前的读者
+        stats.readers += 1
+        stats.loans += loan_count
+        if delivered:
+            stats.sent += 1
+        else:
+            stats.skipped += 1
+        stats.last_reader_id = reader_id
+        since_checkpoint += 1
+        if checkpoint and since_checkpoint >= checkpoint_every:
+            sink.flush()
+            save_checkpoint(checkpoint, today, stats)
+            since_checkpoint = 0
+
+    rows = db.iter_query(OVERDUE_NOTICE_SQL, [after_reader_id, min_days], itersize=itersize,
+                         row_factory='record', readonly=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='notice') as executor:
+        try:
+            for reader_id, group in itertools.groupby(rows, key=lambda row: row.reader_id):
+                loans = list(group)
+                pending.append((reader_id, len(loans), executor.submit(deliver, loans[0], loans)))
+                while len(pending) > max_pending or (pending and pending[0][2].done()):
+                    finish_oldest()
+                if progress and time.monotonic() - last_progress >= progress_interval:
+                    progress(stats)
+                    last_progress = time.monotonic()
+            while pending:
+                finish_oldest()
+        finally:
+            rows.close()
+            for _, _, future in pending:
+                future.cancel()
+            # 正常结束或中断时都记录已按顺序完成的位置
+            sink.flush()
+            if checkpoint:
+                save_checkpoint(checkpoint, today, stats)
+    return stats
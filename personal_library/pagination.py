@@ -0,0 +1,100 @@
+import base64
+import binascii
+import json
+
+
+def encode_cursor(*values):
+    """
+    把排序键 (例如 (title, book_id)) 编码成不透明的游标字符串。
+    游标只用于定位下一页/上一页的起点，不应被客户端解析。
+    """
+    raw = json.dumps(values, ensure_ascii=False, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size):
+    """
+    解码游标字符串，返回排序键元组。
+    游标无效 (被篡改、长度不符) 时返回 None，调用者应从第一页开始。
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return tuple(values)
+
+
+def keyset_page(fetch, key, per_page, after=None, before=None):
+    """
+    执行一次键集 (keyset) 分页查询。
+    :param fetch: fetch(cursor_values, backward, limit) -> 行列表。backward 为 True 时应按相反顺序排序。
+    :param key: key(row) -> 排序键元组，用于生成游标。
+    :param per_page: 每页行数。
+    :param after: "下一页" 游标 (已解码)，返回排在它之后的行。
+    :param before: "上一页" 游标 (已解码)，返回排在它之前的行。
+    :return: (rows, next_cursor, prev_cursor)，没有更多数据的方向游标为 None。
+    """
+    backward = before is not None
+    rows = list(fetch(before if backward else after, backward, per_page + 1))
+    if backward and len(rows) < per_page:
+        # 游标之前已经不足一页 (接近开头，或数据被删除)，改为返回完整的第一页
+        return keyset_page(fetch, key, per_page)
+    return _finish_page(rows, key, per_page, after, backward)
+
+
+async def keyset_page_async(fetch, key, per_page, after=None, before=None):
+    """keyset_page 的异步版本，fetch 为返回行列表的协程函数。"""
+    backward = before is not None
+    rows = list(await fetch(before if backward else after, backward, per_page + 1))
+    if backward and len(rows) < per_page:
+        return await keyset_page_async(fetch, key, per_page)
+    return _finish_page(rows, key, per_page, after, backward)
+
+
+def _finish_page(rows, key, per_page, after, backward):
+    """从多取一行的查询结果中截出一页，并生成前后翻页游标。"""
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after is not None
+    next_cursor = encode_cursor(*key(rows[-1])) if rows and has_next else None
+    prev_cursor = encode_cursor(*key(rows[0])) if rows and has_prev else None
+    return rows, next_cursor, prev_cursor
+
+
+class StreamedPage:
+    """
+    按需遍历的一页结果，用于流式渲染模板。
+    rows 应按排序键升序产生最多 per_page + 1 行；多出的一行只用于判断是否还有下一页。
+    遍历结束后 next_cursor 才可用，因此模板应在循环之后再使用它。
+    """
+
+    def __init__(self, rows, per_page, key):
+        self._rows = rows
+        self.per_page = per_page
+        self.key = key
+        self.count = 0
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        try:
+            for row in self._rows:
+                if self.count >= self.per_page:
+                    self.next_cursor = encode_cursor(*self.key(last))
+                    break
+                self.count += 1
+                last = row
+                yield row
+        finally:
+            close = getattr(self._rows, 'close', None)
+            if close:
+                close()  # 提前结束时关闭服务器端游标，归还连接
@@ -0,0 +1,109 @@
+"""
+loans 分区维护。
+
+loans 按 loan_date 以年为单位分区 (loans_y2024, loans_y2025, ...)，另有默认分区 loans_default
+接收没有对应分区的行。
+- create_partitions(): 提前创建未来年份的分区，并把默认分区中的行移到新分区 (flask create-partitions)
+- archive_partitions(): 把早于指定年份且已全部归还的分区从 loans 上分离，移到 loans_archive schema
+  或直接删除 (flask archive-loans)。分离后当前借阅、逾期和借阅历史的查询不再扫描这些分区。
+- 两者最后都重新计算 loans_active_since (未归还借阅的 loan_date 下界)。当前/逾期借阅视图按它
+  在执行时跳过没有未归还借阅的早年分区，所以还书之后下界要等下一次维护才会前移。
+"""
+import datetime
+import re
+
+from . import db
+
+ARCHIVE_SCHEMA = 'loans_archive'
+
+_PARTITION_NAME = re.compile(r'^loans_y(\d{4})$')
+
+
+def list_partitions():
+    """返回 loans 的年份分区 [(年份, 分区名), ...]，按年份排序 (不含默认分区)。"""
+    rows = db.query_db("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'loans'::regclass
+    """)
+    partitions = []
+    for row in rows:
+        match = _PARTITION_NAME.match(row[0])
+        if match:
+            partitions.append((int(match.group(1)), row[0]))
+    return sorted(partitions)
+
+
+def create_partitions(years_ahead=1):
+    """
+    为默认分区中有行的年份以及今年到今年 + years_ahead 之间缺少的年份创建分区。
+    默认分区中没有行的早年不会创建 (空分区只会拖慢查询规划)。
+    :return: 新建的分区数。
+    """
+    conn = db.get_db()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT fn_create_loan_partitions(%s)", [years_ahead])
+            created = cur.fetchone()[0]
+            cur.execute("SELECT fn_refresh_loans_active_since()")
+        conn.commit()
+        return created
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def archive_partitions(before_year, drop=False):
+    """
+    分离 before_year 之前的年份分区。仍有未归还借阅的分区会被跳过。
+    分离的表去掉外键 (以便以后删除图书/读者)，移到 loans_archive schema，drop 为 True 时直接删除。
+    每个分区在单独的事务中处理；分离需要短暂地对 loans 加排他锁。
+    统计表 (stats_book_loans 等) 中的累计数不受影响。
+    :return: (已归档的分区名列表, 因有未归还借阅而跳过的分区名列表)
+    """
+    if before_year > datetime.date.today().year:
+        raise ValueError("不能归档今年及以后的分区。")
+    archived, skipped = [], []
+    conn = db.get_db()
+    for year, name in list_partitions():
+        if year >= before_year:
+            continue
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'SELECT 1 FROM "{name}" WHERE return_date IS NULL LIMIT 1')
+                if cur.fetchone():
+                    conn.rollback()
+                    skipped.append(name)
+                    continue
+                cur.execute(f'ALTER TABLE loans DETACH PARTITION "{name}"')
+                if drop:
+                    cur.execute(f'DROP TABLE "{name}"')
+                else:
+                    cur.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+                                [name])
+                    for (constraint,) in cur.fetchall():
+                        cur.execute(f'ALTER TABLE "{name}" DROP CONSTRAINT "{constraint}"')
+                    cur.execute(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}')
+                    cur.execute(f'ALTER TABLE "{name}" SET SCHEMA {ARCHIVE_SCHEMA}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        archived.append(name)
+    refresh_active_since()
+    return archived, skipped
+
+
+def refresh_active_since():
+    """重新计算未归还借阅的 loan_date 下界 (计算期间短暂阻止借还书)，返回新的下界。"""
+    conn = db.get_db()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT fn_refresh_loans_active_since()")
+            since = cur.fetchone()[0]
+        conn.commit()
+        return since
+    except Exception:
+        conn.rollback()
+        raise
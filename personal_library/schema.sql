@@ -1,6 +1,18 @@
+DROP MATERIALIZED VIEW IF EXISTS mv_category_loans;
+DROP TABLE IF EXISTS stats_book_loans CASCADE;
+DROP TABLE IF EXISTS stats_reader_loans CASCADE;
 DROP TABLE IF EXISTS loans CASCADE;
+DROP TABLE IF EXISTS loans_active_since CASCADE;
+DROP SCHEMA IF EXISTS loans_archive CASCADE;
 DROP TABLE IF EXISTS books CASCADE;
 DROP TABLE IF EXISTS readers CASCADE;
+DROP TABLE IF EXISTS schema_migrations CASCADE;
+DROP TABLE IF EXISTS table_versions CASCADE;
+
+CREATE TABLE schema_migrations (
+    version VARCHAR(100) PRIMARY KEY,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
 
 CREATE TABLE readers (
     reader_id SERIAL PRIMARY KEY,
@@ -19,30 +31,227 @@ CREATE TABLE books (
     category VARCHAR(50),
     total_stock INTEGER NOT NULL DEFAULT 0,
     available_stock INTEGER NOT NULL DEFAULT 0,
+    search_vector TSVECTOR,
     CONSTRAINT chk_total_stock CHECK (total_stock >= 0), 
     CONSTRAINT chk_available_stock CHECK (available_stock >= 0 AND available_stock <= total_stock)
 );
 
+-- 借阅记录按 loan_date 以年为单位分区 (loans_y2024, loans_y2025, ...)。
+-- 分区表的主键必须包含分区键；只按 loan_id 查询时逐个分区探查主键索引。
 CREATE TABLE loans (
-    loan_id SERIAL PRIMARY KEY,
+    loan_id SERIAL,
     book_id INTEGER NOT NULL REFERENCES books(book_id) ON DELETE RESTRICT,
     reader_id INTEGER NOT NULL REFERENCES readers(reader_id) ON DELETE RESTRICT,
     loan_date DATE NOT NULL DEFAULT CURRENT_DATE,
     due_date DATE NOT NULL,
-    return_date DATE DEFAULT NULL
-);
+    return_date DATE DEFAULT NULL,
+    PRIMARY KEY (loan_id, loan_date)
+) PARTITION BY RANGE (loan_date);
+-- 没有对应年份分区的行落入默认分区，创建该年份的分区时再移过去
+CREATE TABLE loans_default PARTITION OF loans DEFAULT;
+
+-- 为默认分区中有行的年份和今年起的 years_ahead 年中还没有分区的年份创建分区，返回新建的分区数
+-- (由 flask create-partitions 定时调用)。默认分区中已有的该年份的行先移到新分区；
+-- 直接操作分区不会触发 loans 上的库存/统计触发器。
+CREATE OR REPLACE FUNCTION fn_create_loan_partitions(years_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    y INTEGER;
+    partition_name TEXT;
+    lower_bound DATE;
+    upper_bound DATE;
+    created INTEGER := 0;
+BEGIN
+    FOR y IN
+        SELECT DISTINCT EXTRACT(YEAR FROM loan_date)::int FROM loans_default
+        UNION
+        SELECT generate_series(EXTRACT(YEAR FROM CURRENT_DATE)::int, EXTRACT(YEAR FROM CURRENT_DATE)::int + years_ahead)
+        ORDER BY 1
+    LOOP
+        partition_name := 'loans_y' || y;
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        lower_bound := make_date(y, 1, 1);
+        upper_bound := make_date(y + 1, 1, 1);
+        EXECUTE format('CREATE TABLE %I (LIKE loans INCLUDING DEFAULTS)', partition_name);
+        -- 与分区范围相同的 CHECK 约束让 ATTACH 不必再扫描新表
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (loan_date >= %L AND loan_date < %L)',
+                       partition_name, partition_name || '_range', lower_bound, upper_bound);
+        EXECUTE format('WITH moved AS (DELETE FROM loans_default WHERE loan_date >= %L AND loan_date < %L RETURNING *) '
+                       'INSERT INTO %I SELECT * FROM moved', lower_bound, upper_bound, partition_name);
+        EXECUTE format('ALTER TABLE loans ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', partition_name, partition_name || '_range');
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT fn_create_loan_partitions(1);
 
 
-CREATE INDEX idx_books_title ON books(title);
+-- (title, book_id) 同时服务于按书名排序和键集分页
+CREATE INDEX idx_books_title_book_id ON books(title, book_id);
 CREATE INDEX idx_books_author ON books(author);
 CREATE INDEX idx_books_category ON books(category);
+-- 借书表单的输入提示: lower() 表达式上的 text_pattern_ops 索引支持 LIKE '前缀%' 和 ORDER BY ... USING ~<~，
+-- 与数据库的排序规则无关
+CREATE INDEX idx_books_title_prefix ON books(lower(title) text_pattern_ops, book_id);
 
-CREATE INDEX idx_readers_name ON readers(name);
+-- 全文检索: 把文本转换成检索词序列。
+-- 中日韩文字没有空格分词，按单字和相邻双字 (bigram) 切分，其余文字交给 simple 分词器。
+CREATE OR REPLACE FUNCTION fn_search_tokens(input TEXT)
+RETURNS TEXT AS $$
+DECLARE
+    cjk CONSTANT TEXT := '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿';
+    result TEXT := '';
+    part TEXT;
+    i INTEGER;
+BEGIN
+    IF input IS NULL THEN
+        RETURN '';
+    END IF;
+    FOR part IN
+        SELECT m[1] FROM regexp_matches(lower(input), '([' || cjk || ']+|[^' || cjk || ']+)', 'g') AS m
+    LOOP
+        IF part ~ ('^[' || cjk || ']') THEN
+            FOR i IN 1..length(part) LOOP
+                result := result || ' ' || substr(part, i, 1);
+                IF i < length(part) THEN
+                    result := result || ' ' || substr(part, i, 2);
+                END IF;
+            END LOOP;
+        ELSE
+            result := result || ' ' || part;
+        END IF;
+    END LOOP;
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- 把用户输入转换成前缀匹配的 tsquery，所有检索词都必须出现 (AND)；没有检索词时返回 NULL
+CREATE OR REPLACE FUNCTION fn_search_query(input TEXT)
+RETURNS tsquery AS $$
+    SELECT to_tsquery('simple', string_agg(quote_literal(lexeme) || ':*', ' & '))
+    FROM unnest(tsvector_to_array(to_tsvector('simple', fn_search_tokens(input)))) AS lexeme;
+$$ LANGUAGE sql IMMUTABLE;
 
-CREATE INDEX idx_loans_book_id ON loans(book_id);
-CREATE INDEX idx_loans_reader_id ON loans(reader_id);
-CREATE INDEX idx_loans_due_date ON loans(due_date);
-CREATE INDEX idx_loans_return_date ON loans(return_date);
+CREATE OR REPLACE FUNCTION fn_books_search_vector()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', fn_search_tokens(NEW.title)), 'A') ||
+        setweight(to_tsvector('simple', fn_search_tokens(NEW.author)), 'B');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_books_search_vector
+BEFORE INSERT OR UPDATE OF title, author ON books
+FOR EACH ROW
+EXECUTE FUNCTION fn_books_search_vector();
+
+CREATE INDEX idx_books_search_vector ON books USING GIN (search_vector);
+
+-- pg_trgm 可用时为书名和作者建立三元组索引，让子串搜索 (ILIKE '%词%') 也能走索引
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS idx_books_title_trgm ON books USING GIN (title gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_books_author_trgm ON books USING GIN (author gin_trgm_ops);
+    ELSE
+        RAISE NOTICE 'pg_trgm 扩展不可用，子串搜索将使用顺序扫描。';
+    END IF;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE '没有权限创建 pg_trgm 扩展，子串搜索将使用顺序扫描。';
+END;
+$$;
+
+-- 读者目录 (/readers) 的键集分页，以及姓名/读者编号/联系方式的前缀搜索
+CREATE INDEX idx_readers_name_keyset ON readers(name, reader_id);
+CREATE INDEX idx_readers_name_prefix ON readers(lower(name) text_pattern_ops, reader_id);
+CREATE INDEX idx_readers_number_prefix ON readers(reader_number text_pattern_ops);
+CREATE INDEX idx_readers_contact_prefix ON readers(lower(contact) text_pattern_ops);
+
+-- 未归还借阅的部分索引: 只包含 return_date IS NULL 的行，历史借阅再多也不会变大。
+-- INCLUDE 的列覆盖 view_activeloans/view_overdueloans 需要的 loans 列，可以做仅索引扫描。
+-- 键 (due_date, loan_id) 同时服务于按应还日期的键集分页。
+CREATE INDEX idx_loans_active_due_date ON loans(due_date, loan_id)
+    INCLUDE (book_id, reader_id, loan_date) WHERE return_date IS NULL;
+-- 删除图书/读者前检查是否有未归还借阅；借阅历史摘要按应还日期范围统计逾期数
+CREATE INDEX idx_loans_active_book_id ON loans(book_id, due_date) WHERE return_date IS NULL;
+CREATE INDEX idx_loans_active_reader_id ON loans(reader_id, due_date) WHERE return_date IS NULL;
+-- 借阅历史查询的覆盖索引，按 (loan_date, loan_id) 倒序直接读取并键集分页；也服务于外键检查
+CREATE INDEX idx_loans_reader_history ON loans(reader_id, loan_date DESC, loan_id DESC)
+    INCLUDE (book_id, due_date, return_date);
+CREATE INDEX idx_loans_book_history ON loans(book_id, loan_date DESC, loan_id DESC)
+    INCLUDE (reader_id, due_date, return_date);
+
+-- 未归还借阅的 loan_date 下界 (不大于最早的未归还借阅的借阅日期)。
+-- 当前/逾期借阅视图加上 loan_date >= 下界的条件，执行时跳过更早的分区 (只剩历史借阅的年份)。
+CREATE TABLE loans_active_since (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    since DATE NOT NULL
+);
+
+-- 重新计算下界: 最早的有未归还借阅的分区的起始日期 (默认分区按最早的借阅日期)，没有未归还借阅时为今天。
+-- 计算期间阻止借还书，否则并发插入的更早的未归还借阅可能不被计入。由 flask create-partitions/archive-loans 调用。
+CREATE OR REPLACE FUNCTION fn_refresh_loans_active_since()
+RETURNS DATE AS $$
+DECLARE
+    y INTEGER;
+    result DATE;
+BEGIN
+    LOCK TABLE loans IN SHARE MODE;
+    SELECT MIN(loan_date) INTO result FROM loans_default WHERE return_date IS NULL;
+    FOR y IN
+        SELECT substr(c.relname, 8)::int
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'loans'::regclass AND c.relname ~ '^loans_y[0-9]{4}$'
+        ORDER BY 1
+    LOOP
+        EXIT WHEN result IS NOT NULL AND make_date(y, 1, 1) >= result;
+        -- 在分区的未归还借阅部分索引上探查一行
+        IF EXISTS (SELECT 1 FROM loans
+                   WHERE return_date IS NULL AND loan_date >= make_date(y, 1, 1) AND loan_date < make_date(y + 1, 1, 1)) THEN
+            result := make_date(y, 1, 1);
+            EXIT;
+        END IF;
+    END LOOP;
+    result := COALESCE(result, CURRENT_DATE);
+    INSERT INTO loans_active_since (since) VALUES (result)
+    ON CONFLICT (id) DO UPDATE SET since = EXCLUDED.since;
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 插入或修改出早于下界的未归还借阅 (补录、撤销归还) 时降低下界；正常借书的借阅日期不早于下界，不更新这一行
+CREATE OR REPLACE FUNCTION fn_lower_loans_active_since()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE loans_active_since S
+    SET since = N.since
+    FROM (SELECT MIN(loan_date) AS since FROM new_loans WHERE return_date IS NULL) N
+    WHERE N.since < S.since;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_active_since_on_loans_insert
+AFTER INSERT ON loans
+REFERENCING NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_lower_loans_active_since();
+
+CREATE TRIGGER trg_active_since_on_loans_update
+AFTER UPDATE ON loans
+REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_lower_loans_active_since();
+
+INSERT INTO loans_active_since (since) VALUES (CURRENT_DATE);
 
 CREATE OR REPLACE VIEW view_activeloans AS
 SELECT
@@ -52,11 +261,13 @@ SELECT
     B.title AS book_title,
     B.isbn,
     L.loan_date,
-    L.due_date
+    L.due_date,
+    L.book_id,
+    L.reader_id
 FROM loans L
 JOIN books B ON L.book_id = B.book_id
 JOIN readers R ON L.reader_id = R.reader_id
-WHERE L.return_date IS NULL;
+WHERE L.return_date IS NULL AND L.loan_date >= (SELECT since FROM loans_active_since);
 
 CREATE OR REPLACE VIEW view_overdueloans AS
 SELECT
@@ -67,65 +278,241 @@ SELECT
     B.title AS book_title,
     B.isbn,
     L.loan_date,
-    L.due_date
+    L.due_date,
+    L.book_id,
+    L.reader_id,
+    CURRENT_DATE - L.due_date AS days_overdue
 FROM loans L
 JOIN books B ON L.book_id = B.book_id
 JOIN readers R ON L.reader_id = R.reader_id
-WHERE L.return_date IS NULL AND L.due_date < CURRENT_DATE;
+WHERE L.return_date IS NULL AND L.due_date < CURRENT_DATE
+  AND L.loan_date >= (SELECT since FROM loans_active_since);
 
-CREATE OR REPLACE FUNCTION fn_decrement_stock_on_borrow()
+-- 库存维护: 语句级触发器通过转换表 (transition table) 汇总每本书的变化量，
+-- 每条语句对每本受影响的图书只执行一次 UPDATE，而不是每一行借阅记录一次。
+CREATE OR REPLACE FUNCTION fn_update_stock_on_loans()
 RETURNS TRIGGER AS $$
 BEGIN
-
-    IF NEW.return_date IS NULL THEN
-        UPDATE books
-        SET available_stock = available_stock - 1
-        WHERE book_id = NEW.book_id;
-
+    IF TG_OP = 'INSERT' THEN
+        UPDATE books B
+        SET available_stock = B.available_stock - D.loan_count
+        FROM (
+            SELECT book_id, COUNT(*) AS loan_count
+            FROM new_loans
+            WHERE return_date IS NULL
+            GROUP BY book_id
+        ) D
+        WHERE B.book_id = D.book_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE books B
+        SET available_stock = B.available_stock + D.loan_count
+        FROM (
+            SELECT book_id, COUNT(*) AS loan_count
+            FROM old_loans
+            WHERE return_date IS NULL
+            GROUP BY book_id
+        ) D
+        WHERE B.book_id = D.book_id;
+    ELSE
+        -- 修改前未归还的借阅归还库存，修改后未归还的借阅占用库存 (同时正确处理 book_id 的修改)
+        UPDATE books B
+        SET available_stock = B.available_stock + D.delta
+        FROM (
+            SELECT book_id, SUM(delta) AS delta
+            FROM (
+                SELECT book_id, 1 AS delta FROM old_loans WHERE return_date IS NULL
+                UNION ALL
+                SELECT book_id, -1 AS delta FROM new_loans WHERE return_date IS NULL
+            ) changes
+            GROUP BY book_id
+        ) D
+        WHERE B.book_id = D.book_id AND D.delta <> 0;
     END IF;
-    RETURN NEW;
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER trg_decrement_stock_on_borrow
+CREATE TRIGGER trg_stock_on_loans_insert
 AFTER INSERT ON loans
-FOR EACH ROW
-EXECUTE FUNCTION fn_decrement_stock_on_borrow();
+REFERENCING NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_stock_on_loans();
+
+CREATE TRIGGER trg_stock_on_loans_update
+AFTER UPDATE ON loans
+REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_stock_on_loans();
 
-CREATE OR REPLACE FUNCTION fn_update_stock_on_loan_change()
+CREATE TRIGGER trg_stock_on_loans_delete
+AFTER DELETE ON loans
+REFERENCING OLD TABLE AS old_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_stock_on_loans();
+
+-- 图书变更 (包括借还书触发器对库存的更新) 时通知应用使缓存失效，通知在事务提交时才送达
+CREATE OR REPLACE FUNCTION fn_notify_book_change()
 RETURNS TRIGGER AS $$
 BEGIN
-    IF OLD.return_date IS NULL AND NEW.return_date IS NOT NULL THEN
-        UPDATE books
-        SET available_stock = available_stock + 1
-        WHERE book_id = NEW.book_id; 
-    ELSIF OLD.return_date IS NOT NULL AND NEW.return_date IS NULL THEN
-        UPDATE books
-        SET available_stock = available_stock - 1
-        WHERE book_id = NEW.book_id;
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('library_cache', 'books:*');
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('library_cache', 'book:' || OLD.book_id);
+    ELSE
+        PERFORM pg_notify('library_cache', 'book:' || NEW.book_id);
     END IF;
-    RETURN NEW;
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER trg_update_stock_on_loan_change
-AFTER UPDATE OF return_date ON loans 
+CREATE TRIGGER trg_notify_book_change
+AFTER INSERT OR UPDATE OR DELETE ON books
 FOR EACH ROW
-EXECUTE FUNCTION fn_update_stock_on_loan_change();
+EXECUTE FUNCTION fn_notify_book_change();
+
+CREATE TRIGGER trg_notify_books_truncate
+AFTER TRUNCATE ON books
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_notify_book_change();
+
+-- 借阅统计: 每本书、每位读者的累计借阅数、当前借阅数和最近借阅日期，
+-- 由 loans 上的语句级触发器增量维护，报表页面不再对整个 loans 表做 GROUP BY。
+-- 借书/还书本来就会锁定图书行 (库存)，同一图书的统计行不会带来额外的锁竞争。
+CREATE TABLE stats_book_loans (
+    book_id INTEGER PRIMARY KEY REFERENCES books(book_id) ON DELETE CASCADE,
+    loan_count BIGINT NOT NULL DEFAULT 0,
+    active_count INTEGER NOT NULL DEFAULT 0,
+    last_loan_date DATE
+);
+CREATE INDEX idx_stats_book_loans_popular ON stats_book_loans(loan_count DESC, book_id);
+
+CREATE TABLE stats_reader_loans (
+    reader_id INTEGER PRIMARY KEY REFERENCES readers(reader_id) ON DELETE CASCADE,
+    loan_count BIGINT NOT NULL DEFAULT 0,
+    active_count INTEGER NOT NULL DEFAULT 0,
+    last_loan_date DATE
+);
+CREATE INDEX idx_stats_reader_loans_activity ON stats_reader_loans(loan_count DESC, reader_id);
+
+-- 把一条语句涉及的借阅变化累加到统计表: 旧行计为 -1，新行计为 +1
+-- (使用 PL/pgSQL 而不是 SQL 函数，语句的执行计划在会话内缓存，不必每次借还书都重新规划)
+CREATE OR REPLACE FUNCTION fn_apply_loan_stats(old_rows loans[], new_rows loans[])
+RETURNS VOID AS $$
+BEGIN
+    WITH changes AS (
+        SELECT book_id, reader_id, -1 AS loans, -(return_date IS NULL)::int AS active, NULL::date AS loan_date
+        FROM unnest(old_rows)
+        UNION ALL
+        SELECT book_id, reader_id, 1, (return_date IS NULL)::int, loan_date
+        FROM unnest(new_rows)
+    ), book_changes AS (
+        INSERT INTO stats_book_loans AS S (book_id, loan_count, active_count, last_loan_date)
+        SELECT book_id, SUM(loans), SUM(active), MAX(loan_date)
+        FROM changes
+        GROUP BY book_id
+        HAVING SUM(loans) <> 0 OR SUM(active) <> 0
+        ON CONFLICT (book_id) DO UPDATE
+        SET loan_count = S.loan_count + EXCLUDED.loan_count,
+            active_count = S.active_count + EXCLUDED.active_count,
+            last_loan_date = GREATEST(S.last_loan_date, EXCLUDED.last_loan_date)
+    )
+    INSERT INTO stats_reader_loans AS S (reader_id, loan_count, active_count, last_loan_date)
+    SELECT reader_id, SUM(loans), SUM(active), MAX(loan_date)
+    FROM changes
+    GROUP BY reader_id
+    HAVING SUM(loans) <> 0 OR SUM(active) <> 0
+    ON CONFLICT (reader_id) DO UPDATE
+    SET loan_count = S.loan_count + EXCLUDED.loan_count,
+        active_count = S.active_count + EXCLUDED.active_count,
+        last_loan_date = GREATEST(S.last_loan_date, EXCLUDED.last_loan_date);
+END;
+$$ LANGUAGE plpgsql;
 
-CREATE OR REPLACE FUNCTION fn_increment_stock_on_loan_delete()
+CREATE OR REPLACE FUNCTION fn_update_loan_stats()
 RETURNS TRIGGER AS $$
 BEGIN
-    IF OLD.return_date IS NULL THEN
-        UPDATE books
-        SET available_stock = available_stock + 1
-        WHERE book_id = OLD.book_id;
+    IF TG_OP = 'INSERT' THEN
+        PERFORM fn_apply_loan_stats('{}'::loans[], ARRAY(SELECT N::loans FROM new_loans N));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM fn_apply_loan_stats(ARRAY(SELECT O::loans FROM old_loans O), '{}'::loans[]);
+    ELSE
+        PERFORM fn_apply_loan_stats(ARRAY(SELECT O::loans FROM old_loans O), ARRAY(SELECT N::loans FROM new_loans N));
     END IF;
-    RETURN OLD;
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER trg_increment_stock_on_loan_delete
+CREATE TRIGGER trg_stats_on_loans_insert
+AFTER INSERT ON loans
+REFERENCING NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_loan_stats();
+
+CREATE TRIGGER trg_stats_on_loans_update
+AFTER UPDATE ON loans
+REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_loan_stats();
+
+CREATE TRIGGER trg_stats_on_loans_delete
 AFTER DELETE ON loans
-FOR EACH ROW
-EXECUTE FUNCTION fn_increment_stock_on_loan_delete();
+REFERENCING OLD TABLE AS old_loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_update_loan_stats();
+
+-- 按分类汇总: 图书的分类可能被修改，所以不做增量维护，而是由 flask refresh-stats 定时并发刷新。
+-- 刷新只读取 books 和 stats_book_loans，耗时与借阅历史的长度无关。
+CREATE MATERIALIZED VIEW mv_category_loans AS
+SELECT COALESCE(B.category, '未分类') AS category,
+       COUNT(*) AS book_count,
+       COALESCE(SUM(S.loan_count), 0) AS loan_count,
+       COALESCE(SUM(S.active_count), 0) AS active_count,
+       now() AS refreshed_at
+FROM books B
+LEFT JOIN stats_book_loans S ON S.book_id = B.book_id
+GROUP BY 1;
+-- REFRESH ... CONCURRENTLY 需要唯一索引
+CREATE UNIQUE INDEX idx_mv_category_loans_category ON mv_category_loans(category);
+
+-- 表级数据版本: books、readers、loans 每次变更时递增计数器，
+-- 列表页据此生成 ETag/Last-Modified (304 响应) 并作为渲染片段缓存键的一部分。
+-- 计数器分成 16 个分片，写事务按后端进程号只更新其中一行，
+-- 不同连接上的借还书不会在同一个计数器行上排队；读取时把各分片相加。
+CREATE TABLE table_versions (
+    table_name TEXT NOT NULL,
+    shard SMALLINT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (table_name, shard)
+);
+INSERT INTO table_versions (table_name, shard)
+SELECT table_name, shard
+FROM unnest(ARRAY['books', 'readers', 'loans']) AS table_name, generate_series(0, 15) AS shard;
+
+-- 语句级触发器: 每条语句递增一次 (没有影响任何行的语句也会递增，只会多一次缓存失效)。
+-- changed_at 使用 clock_timestamp()，长事务中较晚的修改不会得到事务开始时的时间
+CREATE OR REPLACE FUNCTION fn_bump_table_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, changed_at = clock_timestamp()
+    WHERE table_name = TG_TABLE_NAME AND shard = pg_backend_pid() % 16;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 触发器名排在 trg_stock_on_loans_* 之后: 借还书先 (经库存触发器) 递增 books，再递增 loans
+CREATE TRIGGER trg_version_books
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON books
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_bump_table_version();
+
+CREATE TRIGGER trg_version_readers
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON readers
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_bump_table_version();
+
+CREATE TRIGGER trg_version_loans
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON loans
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_bump_table_version();
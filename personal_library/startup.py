@@ -0,0 +1,93 @@
+"""
+启动: 模板字节码缓存和可配置的预热。
+
+- Jinja 第一次渲染一个模板时要解析并编译成 Python 代码 (图书列表页连同 base.html 约 40 ms)，
+  新启动的进程的第一个请求都要付出这个代价。设置 TEMPLATE_CACHE_DIR 后编译结果保存在该目录中，
+  之后的进程直接加载；部署时可以用 flask precompile-templates 预先生成 (例如在构建镜像时)。
+  缓存按模板源码的校验和区分，模板修改后自动重新编译
+- 连接池、缓存失效监听线程和模板默认都在第一次使用时才创建。WARMUP 列出在 create_app() 中预先完成的项目，
+  适合长期运行的进程；只处理少量请求的短期进程保持默认 (不预热)
+"""
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+from . import cache, db
+
+STARTUP_DEFAULTS = {
+    'TEMPLATE_CACHE_DIR': '',  # 模板字节码缓存目录，为空时不使用
+    'WARMUP': '',              # 逗号分隔的预热项目，见 WARMUP_STEPS
+}
+
+
+def warm_templates(app):
+    """加载并编译全部模板。"""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def warm_db(app):
+    """创建连接池 (DB_POOL_MIN_SIZE 个连接)，并在其中一个连接上 PREPARE 所有注册的语句。"""
+    db.prepare_statements(db.get_db())
+
+
+def warm_cache(app):
+    """创建缓存并启动失效监听线程。"""
+    cache.get_cache()
+
+
+# 预热项目 -> 函数，在应用上下文中按这里的顺序执行
+WARMUP_STEPS = {
+    'templates': warm_templates,
+    'db': warm_db,
+    'cache': warm_cache,
+}
+
+
+def init_app(app):
+    """按同名环境变量或 app.config 设置配置，启用模板字节码缓存。"""
+    for key, default in STARTUP_DEFAULTS.items():
+        app.config[key] = app.config.get(key, os.environ.get(key, default))
+    if app.config['TEMPLATE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+
+def warmup_steps(config):
+    """解析 WARMUP 配置 (逗号分隔的字符串或列表)，返回要执行的项目；未知的项目抛出 ValueError。"""
+    steps = config.get('WARMUP') or []
+    if isinstance(steps, str):
+        steps = steps.split(',')
+    steps = [step.strip() for step in steps if step.strip()]
+    unknown = [step for step in steps if step not in WARMUP_STEPS]
+    if unknown:
+        raise ValueError(f"未知的预热项目: {', '.join(unknown)} (可选: {', '.join(WARMUP_STEPS)})")
+    return [step for step in WARMUP_STEPS if step in steps]
+
+
+def warm_up(app, steps=None):
+    """
+    执行预热项目 (默认为 WARMUP 配置的项目)。
+    :return: {项目: 耗时秒数}。
+    """
+    timings = {}
+    with app.app_context():
+        for step in warmup_steps(app.config) if steps is None else steps:
+            start = time.monotonic()
+            WARMUP_STEPS[step](app)
+            timings[step] = time.monotonic() - start
+    if timings:
+        app.logger.info("启动预热: " + ', '.join(f'{step} {seconds * 1000:.1f} ms' for step, seconds in timings.items()))
+    return timings
+
+
+def precompile_templates(app):
+    """
+    编译全部模板并写入字节码缓存。
+    :return: 编译的模板数。
+    """
+    if app.jinja_env.bytecode_cache is None:
+        raise RuntimeError("没有设置 TEMPLATE_CACHE_DIR，模板编译结果无处保存。")
+    warm_templates(app)
+    return len(app.jinja_env.list_templates())
@@ -0,0 +1,84 @@
+"""
+借阅统计报表。
+
+每本书、每位读者的借阅数由 loans 上的语句级触发器增量维护在 stats_book_loans / stats_reader_loans 中
+(见迁移 007)，按分类的汇总是物化视图 mv_category_loans，由 flask refresh-stats 定时并发刷新。
+报表页面只读取这些汇总表: 排行榜按索引取前 N 行，分类汇总只有几十行，耗时与借阅历史的长度无关。
+"""
+from . import db
+
+POPULAR_BOOKS_SQL = """
+    SELECT S.book_id, B.title, B.author, B.category, S.loan_count, S.active_count, S.last_loan_date
+    FROM stats_book_loans S
+    JOIN books B ON B.book_id = S.book_id
+    WHERE S.loan_count > 0
+    ORDER BY S.loan_count DESC, S.book_id
+    LIMIT %s
+"""
+
+ACTIVE_READERS_SQL = """
+    SELECT S.reader_id, R.name, R.reader_number, S.loan_count, S.active_count, S.last_loan_date
+    FROM stats_reader_loans S
+    JOIN readers R ON R.reader_id = S.reader_id
+    WHERE S.loan_count > 0
+    ORDER BY S.loan_count DESC, S.reader_id
+    LIMIT %s
+"""
+
+CATEGORY_LOANS_SQL = """
+    SELECT category, book_count, loan_count, active_count, refreshed_at
+    FROM mv_category_loans
+    ORDER BY loan_count DESC, category
+"""
+
+# 从 loans 全量重算统计表，用于修复偏差 (例如在触发器之外直接修改过数据)
+REBUILD_SQL = """
+    LOCK TABLE loans IN SHARE MODE;
+    TRUNCATE stats_book_loans, stats_reader_loans;
+    INSERT INTO stats_book_loans (book_id, loan_count, active_count, last_loan_date)
+    SELECT book_id, COUNT(*), COUNT(*) FILTER (WHERE return_date IS NULL), MAX(loan_date)
+    FROM loans
+    GROUP BY book_id;
+    INSERT INTO stats_reader_loans (reader_id, loan_count, active_count, last_loan_date)
+    SELECT reader_id, COUNT(*), COUNT(*) FILTER (WHERE return_date IS NULL), MAX(loan_date)
+    FROM loans
+    GROUP BY reader_id;
+"""
+
+# 同一时间只允许一个进程刷新 (多个 cron 任务或实例重叠时跳过)
+REFRESH_LOCK_ID = 0x5354415453  # 'STATS'
+
+
+def popular_books(limit):
+    return db.query_db(POPULAR_BOOKS_SQL, [limit], row_factory='record', readonly=True)
+
+
+def active_readers(limit):
+    return db.query_db(ACTIVE_READERS_SQL, [limit], row_factory='record', readonly=True)
+
+
+def category_loans():
+    return db.query_db(CATEGORY_LOANS_SQL, row_factory='record', readonly=True)
+
+
+def refresh_stats(rebuild=False):
+    """
+    刷新分类汇总的物化视图 (CONCURRENTLY，刷新期间报表页面仍可读取)。
+    rebuild 为 True 时先在锁住 loans 写入的事务中从头重算每本书、每位读者的统计。
+    :return: 是否执行了刷新 (其他进程正在刷新时返回 False)。
+    """
+    conn = db.get_db()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s)", [REFRESH_LOCK_ID])
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return False
+            if rebuild:
+                cur.execute(REBUILD_SQL)
+            cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY mv_category_loans")
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
@@ -0,0 +1,146 @@
+"""
+表级数据版本 (table_versions)，以及基于它的 HTTP 条件请求和模板片段缓存。
+
+- books、readers、loans 上的语句级触发器在每次变更时递增 table_versions 中的计数器
+- @conditional_page('books', ...) 装饰的列表页按这些表的版本生成弱 ETag 和 Last-Modified，
+  请求带匹配的 If-None-Match / If-Modified-Since 时直接返回 304，不查询数据、不渲染模板
+- 模板中的 {% cache 'name', data_version, ... %}...{% endcache %} 把一段渲染结果
+  按数据版本缓存在应用缓存 (cache.get_cache()) 中，数据变更后版本改变，旧片段不会再被读取
+"""
+import datetime
+import functools
+import hashlib
+import os
+
+import psycopg2
+from flask import current_app, g, get_flashed_messages, has_app_context, request, session
+from jinja2 import nodes
+from jinja2.ext import Extension
+from werkzeug.http import is_resource_modified
+
+from . import cache, db
+
+VERSIONS_DEFAULTS = {
+    'PAGE_CONDITIONAL_REQUESTS': True,    # 列表页是否生成 ETag/Last-Modified 并响应 304
+    'FRAGMENT_CACHE': True,               # 是否缓存模板中 {% cache %} 块的渲染结果
+    'FRAGMENT_CACHE_TTL': 300.0,          # 片段缓存项的存活秒数
+    'FRAGMENT_CACHE_MAX_SIZE': 1000000,   # 超过该字符数的片段不缓存 (例如未分页的大列表)
+}
+
+# 各表的版本为所有分片之和，修改时间为各分片中最晚的一个
+TABLE_VERSIONS = db.register_statement('table_versions', """
+    SELECT table_name, SUM(version)::bigint AS version, MAX(changed_at) AS changed_at, CURRENT_DATE AS today
+    FROM table_versions
+    WHERE table_name = ANY(%s)
+    GROUP BY table_name
+    ORDER BY table_name
+""")
+
+
+def init_app(app):
+    """按同名环境变量或 app.config 设置配置，注册片段缓存的模板扩展和 data_version 模板变量。"""
+    for key, default in VERSIONS_DEFAULTS.items():
+        value = app.config.get(key, os.environ.get(key, default))
+        if isinstance(default, bool):
+            if isinstance(value, str):
+                value = value.lower() in ('1', 'true', 'yes', 'on')
+        else:
+            value = type(default)(value)
+        app.config[key] = value
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.context_processor(lambda: {'data_version': g.get('data_version')})
+
+
+def current_version(tables, readonly=False, daily=False):
+    """
+    读取 tables 的当前版本。
+    :param readonly: 与页面的数据查询一致时可以读只读副本。版本必须在数据之前、从同一个库读取，
+                     这样缓存的内容最多比它的版本新，而不会比版本旧。
+    :param daily: 页面内容还随日期变化 (例如逾期天数) 时为 True，版本中包含数据库的当前日期。
+    :return: (tag, last_modified)，tag 形如 'books=12;loans=40'，last_modified 是最近一次变更的时间；
+             没有这些表的计数器时 tag 为空字符串。
+    """
+    rows = db.query_db(TABLE_VERSIONS, [sorted(tables)], row_factory='record', readonly=readonly)
+    tag = ';'.join(f'{row.table_name}={row.version}' for row in rows)
+    last_modified = max((row.changed_at for row in rows), default=None)
+    if daily and rows:
+        today = rows[0].today
+        tag += f';date={today.isoformat()}'
+        midnight = datetime.datetime.combine(today, datetime.time(), tzinfo=last_modified.tzinfo)
+        last_modified = max(last_modified, midnight)
+    return tag, last_modified
+
+
+def set_validators(response, etag, last_modified):
+    """设置 ETag/Last-Modified；客户端可以缓存页面，但每次使用前都要重新验证。"""
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+
+def conditional_page(*tables, readonly=False, daily=False):
+    """
+    视图装饰器: 按 tables 的数据版本和请求的完整路径生成 ETag，
+    条件请求命中时返回 304，否则执行视图并在响应上设置 ETag/Last-Modified。
+    有待显示的 flash 消息时不处理条件请求，页面上的消息不能被 304 吞掉；
+    视图本身产生了 flash 消息 (例如查询出错) 时也不设置验证器，出错的页面不会被当作最新版本。
+    读取版本失败时按普通请求处理。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if (not current_app.config['PAGE_CONDITIONAL_REQUESTS'] or request.method not in ('GET', 'HEAD')
+                    or session.get('_flashes')):
+                return view(*args, **kwargs)
+            try:
+                tag, last_modified = current_version(tables, readonly=readonly, daily=daily)
+            except psycopg2.Error as e:
+                current_app.logger.warning(f"读取数据版本失败，跳过条件请求处理: {e}")
+                return view(*args, **kwargs)
+            if not tag:  # table_versions 中没有这些表的计数器
+                return view(*args, **kwargs)
+            etag = hashlib.sha1(f'{tag}|{request.full_path}'.encode('utf-8')).hexdigest()
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = current_app.response_class(status=304)
+                set_validators(response, etag, last_modified)
+                return response
+            g.data_version = tag
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not get_flashed_messages():
+                set_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+class FragmentCacheExtension(Extension):
+    """
+    {% cache 'name', data_version, key... %}...{% endcache %}
+    按名称和其余参数缓存块的渲染结果。第二个参数 (数据版本) 为空时不缓存，直接渲染，
+    因此没有经过 conditional_page 的请求 (或 ASGI 模式的异步视图) 使用同一模板时照常渲染。
+    块中的循环遍历流式结果时，块之后依赖遍历结果的内容 (例如下一页链接) 也要放在块内。
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', [nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key_parts, caller):
+        if len(key_parts) < 2 or not key_parts[1] or not has_app_context() \
+                or not current_app.config['FRAGMENT_CACHE']:
+            return caller()
+        key = 'fragment:' + hashlib.sha1('|'.join(map(str, key_parts)).encode('utf-8')).hexdigest()
+        fragment_cache = cache.get_cache()
+        value = fragment_cache.get(key)
+        if value is cache.MISSING:
+            value = caller()
+            if len(value) <= current_app.config['FRAGMENT_CACHE_MAX_SIZE']:
+                fragment_cache.set(key, value, ttl=current_app.config['FRAGMENT_CACHE_TTL'])
+        return value
@@ -1,14 +1,24 @@
 import pytest
 from personal_library.app import app
 from personal_library.db import get_db
+from personal_library.cache import get_cache
 
 @pytest.fixture(autouse=True)
 def clear_database():
     """
     在每个测试前清空数据库，确保测试环境干净。
+    测试数据只有几行，DELETE 加重置序列比 TRUNCATE (每次都要重建各分区和统计表的文件) 快一个数量级。
     """
     with app.app_context():  # 显式设置应用上下文
         db = get_db()
         with db.cursor() as cur:
-            cur.execute("TRUNCATE TABLE loans, books, readers RESTART IDENTITY CASCADE;")
-        db.commit()
\ No newline at end of file
+            cur.execute("""
+                DELETE FROM loans;
+                DELETE FROM books;
+                DELETE FROM readers;
+                SELECT setval(pg_get_serial_sequence('loans', 'loan_id'), 1, false),
+                       setval(pg_get_serial_sequence('books', 'book_id'), 1, false),
+                       setval(pg_get_serial_sequence('readers', 'reader_id'), 1, false);
+            """)
+        db.commit()
+        get_cache().clear()  # 不等待删除触发的异步失效通知
@@ -0,0 +1,74 @@
+import gzip
+import json
+from personal_library.app import app
+from personal_library import db
+
+
+def add_books(count):
+    with app.app_context():
+        db.query_db("""
+            INSERT INTO books (title, author, isbn, category, total_stock, available_stock)
+            SELECT '接口书籍' || lpad(g::text, 3, '0'), '接口作者', 'api_' || g, '测试', 2, 2
+            FROM generate_series(1, %s) AS g
+        """, [count], commit=True)
+
+def test_api_books_cursor_pagination():
+    add_books(5)
+    client = app.test_client()
+    first = client.get('/api/v1/books?limit=2').get_json()
+    assert [book['title'] for book in first['data']] == ['接口书籍001', '接口书籍002']
+    assert first['prev_cursor'] is None
+    second = client.get(f"/api/v1/books?limit=2&after={first['next_cursor']}").get_json()
+    assert [book['title'] for book in second['data']] == ['接口书籍003', '接口书籍004']
+    back = client.get(f"/api/v1/books?limit=2&before={second['prev_cursor']}").get_json()
+    assert back['data'] == first['data']
+    last = client.get(f"/api/v1/books?limit=2&after={second['next_cursor']}").get_json()
+    assert len(last['data']) == 1 and last['next_cursor'] is None
+
+def test_api_books_multi_get_and_fields():
+    add_books(3)
+    response = app.test_client().get('/api/v1/books?ids=3,1,99,3&fields=book_id,title')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['data'] == [{'book_id': 3, 'title': '接口书籍003'}, {'book_id': 1, 'title': '接口书籍001'}]
+    assert body['missing'] == [99]
+
+def test_api_rejects_invalid_parameters():
+    client = app.test_client()
+    assert client.get('/api/v1/books?fields=title,password').status_code == 400
+    assert client.get('/api/v1/books?ids=1,abc').status_code == 400
+    assert client.get('/api/v1/loans?status=lost').status_code == 400
+    response = client.get('/api/v1/books/12345')
+    assert response.status_code == 404
+    assert 'error' in response.get_json()
+
+def test_api_loans_filters_and_dates():
+    add_books(1)
+    with app.app_context():
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('接口读者', 'api_r1')", commit=True)
+        db.query_db("INSERT INTO loans (book_id, reader_id, loan_date, due_date) VALUES "
+                    "(1, 1, '2024-01-01', '2024-01-31'), (1, 1, CURRENT_DATE, CURRENT_DATE + 30)", commit=True)
+    client = app.test_client()
+    overdue = client.get('/api/v1/loans?status=overdue&reader_id=1').get_json()
+    assert overdue['data'] == [{'loan_id': 1, 'book_id': 1, 'reader_id': 1, 'loan_date': '2024-01-01',
+                                'due_date': '2024-01-31', 'return_date': None}]
+    assert len(client.get('/api/v1/loans?status=active').get_json()['data']) == 2
+    assert client.get('/api/v1/readers/1?fields=name').get_json() == {'name': '接口读者'}
+
+def test_api_etag_and_gzip():
+    add_books(50)
+    client = app.test_client()
+    response = client.get('/api/v1/books?limit=50')
+    etag = response.headers['ETag']
+    assert response.headers.get('Content-Encoding') is None
+    assert client.get('/api/v1/books?limit=50', headers={'If-None-Match': etag}).status_code == 304
+
+    compressed = client.get('/api/v1/books?limit=50', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['ETag'] != etag
+    assert json.loads(gzip.decompress(compressed.data)) == response.get_json()
+
+    # 数据变化后 ETag 随之变化
+    with app.app_context():
+        db.query_db("UPDATE books SET available_stock = 1 WHERE book_id = 1", commit=True)
+    assert client.get('/api/v1/books?limit=50', headers={'If-None-Match': etag}).status_code == 200
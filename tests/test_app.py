@@ -1,6 +1,9 @@
 import pytest
 from personal_library.app import app
+from personal_library import db
 import json
+import re
+import threading
 
 @pytest.fixture
 def client():
@@ -170,3 +173,281 @@ def test_book_loan_history(client):
     assert '<h2>借阅历史</h2>' in response.data.decode("utf-8")  # 检查标题是否正确
     assert '测试读者' in response.data.decode("utf-8")  # 检查借阅记录是否正确显示
 
+
+# --- 图书列表分页测试 ---
+def add_books(client, count, prefix='分页书籍'):
+    for i in range(count):
+        client.post('/books/new', data={
+            'title': f'{prefix}{i:02d}',
+            'author': '分页作者',
+            'isbn': f'page_isbn_{prefix}_{i}',
+            'total_stock': '1'
+        })
+
+def test_list_books_keyset_pagination(client):
+    add_books(client, 15)
+    response = client.get('/books')
+    html = response.data.decode('utf-8')
+    assert response.status_code == 200
+    assert '分页书籍09' in html and '分页书籍10' not in html
+    next_url = re.search(r'href="(/books\?after=[^"]+)"', html).group(1)
+
+    response = client.get(next_url.replace('&amp;', '&'))
+    html = response.data.decode('utf-8')
+    assert '分页书籍10' in html and '分页书籍14' in html
+    assert '分页书籍09' not in html
+    prev_url = re.search(r'href="(/books\?before=[^"]+)"', html).group(1)
+
+    response = client.get(prev_url.replace('&amp;', '&'))
+    html = response.data.decode('utf-8')
+    assert '分页书籍00' in html and '分页书籍09' in html
+
+def test_list_books_offset_pagination_still_supported(client):
+    add_books(client, 12)
+    response = client.get('/books?page=2')
+    html = response.data.decode('utf-8')
+    assert '分页书籍10' in html and '分页书籍11' in html
+    assert '分页书籍00' not in html
+
+def test_list_books_invalid_cursor_falls_back_to_first_page(client):
+    add_books(client, 3)
+    response = client.get('/books?after=not-a-cursor')
+    assert response.status_code == 200
+    assert '分页书籍00' in response.data.decode('utf-8')
+
+# --- 图书搜索测试 ---
+def test_search_books_fulltext_cjk(client):
+    for i, (title, author) in enumerate([('三体', '刘慈欣'), ('数据库系统概念', 'Abraham Silberschatz'),
+                                         ('Python编程从入门到实践', 'Eric Matthes')]):
+        client.post('/books/new', data={'title': title, 'author': author,
+                                        'isbn': f'search_isbn_{i}', 'total_stock': '1'})
+    html = client.get('/books?search=数据').data.decode('utf-8')
+    assert '数据库系统概念' in html and '三体' not in html
+
+    html = client.get('/books?search=慈欣').data.decode('utf-8')  # 作者中间的子串
+    assert '三体' in html
+
+    html = client.get('/books?search=python 入门').data.decode('utf-8')
+    assert 'Python编程从入门到实践' in html and '数据库系统概念' not in html
+
+    html = client.get('/books?search=search_isbn_0').data.decode('utf-8')  # ISBN 精确匹配
+    assert '三体' in html
+
+def test_search_books_ranks_title_matches_first(client):
+    client.post('/books/new', data={'title': '普通的书', 'author': '机器学习研究者',
+                                    'isbn': 'rank_isbn_1', 'total_stock': '1'})
+    client.post('/books/new', data={'title': '机器学习', 'author': '周志华',
+                                    'isbn': 'rank_isbn_2', 'total_stock': '1'})
+    html = client.get('/books?search=机器学习').data.decode('utf-8')
+    assert html.index('周志华') < html.index('机器学习研究者')  # 书名匹配的权重更高
+
+def test_search_books_substring_mode(client):
+    client.post('/books/new', data={'title': '深入理解计算机系统', 'author': 'Randal E. Bryant',
+                                    'isbn': 'substring_isbn_1', 'total_stock': '1'})
+    html = client.get('/books?search=ndal&search_mode=substring').data.decode('utf-8')
+    assert '深入理解计算机系统' in html
+
+# --- 借阅列表分页测试 ---
+def borrow_many(client, count, due_dates):
+    client.post('/books/new', data={'title': '热门书籍', 'author': '作者',
+                                    'isbn': 'loan_list_isbn', 'total_stock': str(count)})
+    client.post('/readers/new', data={'name': '读者甲', 'reader_number': 'loan_list_r1'})
+    client.post('/readers/new', data={'name': '读者乙', 'reader_number': 'loan_list_r2'})
+    for i in range(count):
+        client.post('/loans/borrow', data={'book_id': '1', 'reader_id': str(1 + i % 2),
+                                           'due_date': due_dates[i]})
+
+def test_active_loans_keyset_pagination(client):
+    borrow_many(client, 5, [f'2030-01-0{i + 1}' for i in range(5)])
+    html = client.get('/loans/active?per_page=2').data.decode('utf-8')
+    assert '2030-01-01' in html and '2030-01-02' in html and '2030-01-03' not in html
+    next_url = re.search(r'href="(/loans/active\?after=[^"]+)"', html).group(1).replace('&amp;', '&')
+    html = client.get(next_url).data.decode('utf-8')
+    assert '2030-01-03' in html and '2030-01-04' in html and '2030-01-02' not in html
+
+def test_active_loans_filter_by_reader(client):
+    borrow_many(client, 4, [f'2030-02-0{i + 1}' for i in range(4)])
+    html = client.get('/loans/active?reader_id=2').data.decode('utf-8')
+    assert '读者乙' in html and '读者甲' not in html
+
+def test_overdue_loans_min_days_filter(client):
+    borrow_many(client, 2, ['2000-01-01', '2999-01-01'])
+    html = client.get('/loans/overdue').data.decode('utf-8')
+    assert '2000-01-01' in html and '2999-01-01' not in html
+    html = client.get('/loans/overdue?min_days=100000').data.decode('utf-8')
+    assert '没有逾期的借阅记录' in html
+
+# --- 乐观借书测试 ---
+@pytest.fixture
+def optimistic_borrow():
+    app.config['BORROW_MODE'] = 'optimistic'
+    yield
+    app.config['BORROW_MODE'] = 'locking'
+
+def test_optimistic_borrow(client, optimistic_borrow):
+    client.post('/books/new', data={'title': '乐观书籍', 'author': '作者', 'isbn': 'optimistic_isbn', 'total_stock': '1'})
+    client.post('/readers/new', data={'name': '乐观读者', 'reader_number': 'optimistic_r1'})
+    response = client.post('/loans/borrow', data={'book_id': '1', 'reader_id': '1', 'due_date': '2030-01-01'})
+    assert response.status_code == 302
+    assert client.get('/books/1').get_json()['available_stock'] == 0
+    html = client.post('/loans/borrow', data={'book_id': '1', 'reader_id': '1', 'due_date': '2030-01-01'}).data.decode('utf-8')
+    assert '库存不足' in html
+    html = client.post('/loans/borrow', data={'book_id': '99', 'reader_id': '1', 'due_date': '2030-01-01'}).data.decode('utf-8')
+    assert '未找到该图书' in html
+
+def test_optimistic_borrow_concurrent(optimistic_borrow):
+    with app.test_client() as setup:
+        setup.post('/books/new', data={'title': '热门书籍', 'author': '作者', 'isbn': 'hot_isbn', 'total_stock': '5'})
+        setup.post('/readers/new', data={'name': '读者', 'reader_number': 'hot_r1'})
+    statuses = []
+
+    def borrow():
+        with app.test_client() as c:
+            statuses.append(c.post('/loans/borrow', data={'book_id': '1', 'reader_id': '1',
+                                                          'due_date': '2030-01-01'}).status_code)
+
+    threads = [threading.Thread(target=borrow) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses.count(302) == 5  # 恰好借出库存数量，其余请求得到库存不足
+    with app.test_client() as c:
+        assert c.get('/books/1').get_json()['available_stock'] == 0
+
+# --- 借书表单输入提示测试 ---
+def test_borrow_typeahead(client):
+    client.post('/books/new', data={'title': 'Python 编程', 'author': '作者', 'isbn': 'typeahead_isbn_1', 'total_stock': '1'})
+    client.post('/books/new', data={'title': 'python_100%', 'author': '作者', 'isbn': 'typeahead_isbn_2', 'total_stock': '1'})
+    client.post('/books/new', data={'title': 'Pythonic', 'author': '作者', 'isbn': 'typeahead_isbn_3', 'total_stock': '0'})
+    client.post('/readers/new', data={'name': '张三', 'reader_number': 'TA001'})
+    client.post('/readers/new', data={'name': '李四', 'reader_number': 'TA002'})
+
+    titles = [r['text'] for r in client.get('/loans/borrow/books?q=PYTHON').get_json()['results']]
+    assert titles == ['Python 编程 (库存: 1)', 'python_100% (库存: 1)']  # 不区分大小写，跳过无库存的图书
+    assert len(client.get('/loans/borrow/books?q=python_').get_json()['results']) == 1  # _ 不是通配符
+    assert client.get('/loans/borrow/books?q=typeahead_isbn_2').get_json()['results'][0]['id'] == 2
+    assert client.get('/loans/borrow/books?q=').get_json()['results'] == []
+
+    assert [r['id'] for r in client.get('/loans/borrow/readers?q=张').get_json()['results']] == [1]
+    assert [r['id'] for r in client.get('/loans/borrow/readers?q=TA00').get_json()['results']] == [1, 2]
+
+def test_borrow_form_keeps_selection(client):
+    client.post('/books/new', data={'title': '表单书籍', 'author': '作者', 'isbn': 'form_isbn_1', 'total_stock': '0'})
+    client.post('/readers/new', data={'name': '表单读者', 'reader_number': 'form_r1'})
+    html = client.post('/loans/borrow', data={'book_id': '1', 'reader_id': '1', 'due_date': '2030-01-01'}).data.decode('utf-8')
+    assert '库存不足' in html
+    assert '<option value="1" selected>表单书籍' in html and '<option value="1" selected>表单读者' in html
+    assert 'value="2030-01-01"' in html
+
+# --- 批量借还书测试 ---
+def setup_batch(client, stock):
+    client.post('/books/new', data={'title': '批量书籍', 'author': '作者',
+                                    'isbn': 'batch_isbn_1', 'total_stock': str(stock)})
+    client.post('/books/new', data={'title': '批量书籍2', 'author': '作者',
+                                    'isbn': 'batch_isbn_2', 'total_stock': '5'})
+    client.post('/readers/new', data={'name': '批量读者', 'reader_number': 'batch_r1'})
+
+def test_batch_borrow_per_item_results(client):
+    setup_batch(client, 2)
+    response = client.post('/loans/batch/borrow', json={'loans': [
+        {'book_id': 1, 'reader_id': 1, 'due_date': '2030-01-01'},
+        {'book_id': 2, 'reader_id': 1, 'due_date': '2030-01-01'},
+        {'book_id': 1, 'reader_id': 1, 'due_date': '2030-01-01'},
+        {'book_id': 1, 'reader_id': 1, 'due_date': '2030-01-01'},  # 超出库存
+        {'book_id': 99, 'reader_id': 1, 'due_date': '2030-01-01'},  # 图书不存在
+        {'book_id': 2, 'reader_id': 99, 'due_date': '2030-01-01'},  # 读者不存在
+        {'book_id': 2, 'reader_id': 1},  # 缺少应归还日期
+    ]})
+    data = response.get_json()
+    assert response.status_code == 200
+    assert [r['status'] for r in data['results']] == ['ok', 'ok', 'ok', 'error', 'error', 'error', 'error']
+    assert data['succeeded'] == 3 and data['failed'] == 4
+    assert client.get('/books/1').get_json()['available_stock'] == 0
+    assert client.get('/books/2').get_json()['available_stock'] == 4
+
+def test_batch_return(client):
+    setup_batch(client, 3)
+    borrowed = client.post('/loans/batch/borrow', json=[
+        {'book_id': 1, 'reader_id': 1, 'due_date': '2030-01-01'} for _ in range(3)]).get_json()
+    loan_ids = [r['loan_id'] for r in borrowed['results']]
+    response = client.post('/loans/batch/return', json={'loan_ids': loan_ids + [loan_ids[0], 12345, 'x']})
+    data = response.get_json()
+    assert [r['status'] for r in data['results']] == ['ok', 'ok', 'ok', 'error', 'error', 'error']
+    assert client.get('/books/1').get_json()['available_stock'] == 3
+
+def test_batch_rejects_invalid_body(client):
+    assert client.post('/loans/batch/return', json={'loan_ids': []}).status_code == 400
+    assert client.post('/loans/batch/borrow', data='not json').status_code == 400
+
+# --- 读者目录测试 ---
+def test_reader_directory_keyset_pages(client):
+    for i in range(5):
+        client.post('/readers/new', data={'name': f'目录读者{i}', 'reader_number': f'dir_r{i}'})
+    client.get('/')  # 取走 flash 消息
+    page = client.get('/readers?format=json&per_page=2').get_json()
+    assert [reader['name'] for reader in page['data']] == ['目录读者0', '目录读者1']
+    assert page['prev_cursor'] is None
+    page = client.get(f"/readers?format=json&per_page=2&after={page['next_cursor']}").get_json()
+    assert [reader['name'] for reader in page['data']] == ['目录读者2', '目录读者3']
+    page = client.get(f"/readers?format=json&per_page=2&before={page['prev_cursor']}").get_json()
+    assert [reader['name'] for reader in page['data']] == ['目录读者0', '目录读者1']
+    # 上一页不足 per_page 行时返回完整的第一页
+    page = client.get('/readers?format=json&per_page=1').get_json()
+    page = client.get(f"/readers?format=json&per_page=2&after={page['next_cursor']}").get_json()
+    assert [reader['name'] for reader in page['data']] == ['目录读者1', '目录读者2']
+    page = client.get(f"/readers?format=json&per_page=2&before={page['prev_cursor']}").get_json()
+    assert [reader['name'] for reader in page['data']] == ['目录读者0', '目录读者1']
+    assert page['prev_cursor'] is None and page['next_cursor'] is not None
+    html = client.get('/readers?per_page=2').data.decode('utf-8')
+    assert '目录读者1' in html and '目录读者2' not in html and 'after=' in html
+
+def test_reader_directory_search(client):
+    client.post('/readers/new', data={'name': 'Alice', 'reader_number': 'S001', 'contact': 'alice@example.com'})
+    client.post('/readers/new', data={'name': '张三', 'reader_number': 'S002', 'contact': '13800000000'})
+    client.post('/readers/new', data={'name': '李四', 'reader_number': 'T003', 'contact': 'li@example.com'})
+
+    def search(term):
+        return [reader['reader_id'] for reader in
+                client.get('/readers', query_string={'format': 'json', 'search': term}).get_json()['data']]
+    assert search('ali') == [1]       # 姓名前缀，不区分大小写
+    assert search('S00') == [1, 2]    # 读者编号前缀
+    assert search('138') == [2]       # 联系方式前缀
+    assert search('LI@') == [3]
+    assert search('%') == []          # LIKE 通配符按字面匹配
+    assert '张三' in client.get('/readers?search=张').data.decode('utf-8')
+
+# --- 借阅历史摘要与分页测试 ---
+def test_loan_history_summary_and_pages(client):
+    with app.app_context():
+        db.query_db("""
+            INSERT INTO readers (name, reader_number) VALUES ('历史读者', 'hist_r1');
+            INSERT INTO books (title, author, isbn, total_stock, available_stock) VALUES ('历史书籍', '作者', 'hist_b1', 9, 9);
+            INSERT INTO loans (book_id, reader_id, loan_date, due_date, return_date) VALUES
+                (1, 1, CURRENT_DATE - 40, CURRENT_DATE - 20, CURRENT_DATE - 25),
+                (1, 1, CURRENT_DATE - 30, CURRENT_DATE - 10, NULL),
+                (1, 1, CURRENT_DATE - 30, CURRENT_DATE + 10, NULL),
+                (1, 1, CURRENT_DATE - 5, CURRENT_DATE + 20, NULL);
+        """, commit=True)
+    html = client.get('/search/reader_loans/1?per_page=2').data.decode('utf-8')
+    # 摘要: 累计 4 次，未归还 3 本，其中 1 本逾期
+    assert '累计借阅 4 次，当前借阅 3 本，其中逾期 1 本' in html
+    assert '加载更早的记录' in html
+    page = client.get('/search/reader_loans/1?format=json&per_page=2').get_json()
+    # 按借阅日期倒序，同一天的按 loan_id 倒序
+    assert [loan['loan_id'] for loan in page['data']] == [4, 3]
+    assert page['data'][0]['book_title'] == '历史书籍'
+    page = client.get(f"/search/reader_loans/1?format=json&per_page=2&after={page['next_cursor']}").get_json()
+    assert [loan['loan_id'] for loan in page['data']] == [2, 1]
+    assert page['next_cursor'] is None
+    assert page['data'][1]['return_date'] is not None
+    book_page = client.get('/search/book_loans/1?format=json').get_json()
+    assert [loan['reader_name'] for loan in book_page['data']] == ['历史读者'] * 4
+    assert '累计借阅 4 次' in client.get('/search/book_loans/1').data.decode('utf-8')
+
+def test_loan_history_missing_owner_redirects(client):
+    assert client.get('/search/reader_loans/999').status_code == 302
+    assert client.get('/search/book_loans/999').status_code == 302
+    response = client.get('/search/reader_loans/999?format=json')
+    assert response.status_code == 404 and response.get_json() == {'error': 'Reader not found'}
+    assert client.get('/search/book_loans/999?format=json').status_code == 404
@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+from personal_library.app import app
+from personal_library import db, pagination
+
+pytest.importorskip('quart')
+pytest.importorskip('aiopg')
+from personal_library import asgi  # noqa: E402
+
+
+def add_loan_data():
+    with app.app_context():
+        db.query_db("INSERT INTO books (title, author, isbn, total_stock, available_stock) "
+                    "VALUES ('异步书籍', '异步作者', 'asgi_1', 3, 3)", commit=True)
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('异步读者', 'asgi_r1')", commit=True)
+        db.query_db("INSERT INTO loans (book_id, reader_id, loan_date, due_date) "
+                    "VALUES (1, 1, '2024-01-01', '2024-01-31')", commit=True)
+
+def run_async_client(requests):
+    """在 Quart 测试客户端上依次发送 (method, path)，返回响应列表。"""
+    async def run():
+        async with asgi.quart_app.test_app() as test_app:
+            client = test_app.test_client()
+            responses = []
+            for method, path in requests:
+                response = await client.open(path, method=method)
+                responses.append((response.status_code, await response.get_data(as_text=True)))
+            return responses
+    return asyncio.run(run())
+
+def test_async_read_views():
+    add_loan_data()
+    (books, book, overdue, reader_history, missing_book, missing_json, empty_json) = run_async_client([
+        ('GET', '/books'), ('GET', '/books/1'), ('GET', '/loans/overdue'),
+        ('GET', '/search/reader_loans/1'), ('GET', '/search/book_loans/999'),
+        ('GET', '/search/book_loans/999?format=json'),
+        ('GET', f"/search/reader_loans/1?format=json&after={pagination.encode_cursor('2000-01-01', 1)}"),
+    ])
+    assert books[0] == 200 and '异步书籍' in books[1]
+    assert book[0] == 200 and '"available_stock":2' in book[1].replace(' ', '')
+    assert overdue[0] == 200 and '异步读者' in overdue[1]
+    assert reader_history[0] == 200 and '异步书籍' in reader_history[1]
+    assert missing_book[0] == 302
+    assert missing_json[0] == 404
+    assert empty_json[0] == 200 and '"data":[]' in empty_json[1].replace(' ', '')  # 读者存在，只是没有更早的记录
+
+def test_hybrid_app_dispatch():
+    hybrid = asgi.application
+    assert hybrid.is_async({'path': '/books', 'method': 'GET'})
+    assert hybrid.is_async({'path': '/loans/active', 'method': 'GET'})
+    assert not hybrid.is_async({'path': '/books/new', 'method': 'POST'})
+    assert not hybrid.is_async({'path': '/readers', 'method': 'GET'})
+    assert not hybrid.is_async({'path': '/api/v1/books', 'method': 'GET'})
+    assert not hybrid.is_async({'path': '/no-such-page', 'method': 'GET'})
+
+def test_hybrid_app_forwards_to_flask():
+    with app.app_context():
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('同步读者', 'asgi_r2')", commit=True)
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': '/readers',
+             'raw_path': b'/readers', 'root_path': '', 'query_string': b'', 'headers': [],
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 1234)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.application(scope, receive, send))
+    assert messages[0]['status'] == 200
+    assert '同步读者' in b''.join(m.get('body', b'') for m in messages[1:]).decode('utf-8')
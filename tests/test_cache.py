@@ -0,0 +1,114 @@
+import fnmatch
+import time
+import psycopg2
+from personal_library import cache, db
+from personal_library.app import app
+
+
+class FakeRedis:
+    """SharedCache 使用的本地替身，只实现用到的几个方法。"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+# --- 缓存后端测试 ---
+def test_memory_cache_lru_and_ttl():
+    c = cache.MemoryCache(max_entries=2)
+    c.set('a', 1)
+    c.set('b', 2)
+    assert c.get('a') == 1  # a 变成最近使用
+    c.set('c', 3)  # 淘汰最久未使用的 b
+    assert c.get('b') is cache.MISSING
+    c.set('d', 4, ttl=0)
+    assert c.get('d') is cache.MISSING  # 已过期
+    stats = c.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 2 and stats['evictions'] >= 1
+
+def test_memory_cache_generation_survives_eviction():
+    c = cache.MemoryCache(max_entries=3)
+    c.bump('books')
+    c.bump('books')
+    for key in 'abcd':
+        c.set(key, 1)
+    assert c.generation('books') == 2
+    stats = c.stats()
+    assert stats['hits'] == 0 and stats['misses'] == 0  # 读取版本号不计入命中统计
+
+def test_invalidate_all_keeps_shared_entries():
+    shared = cache.SharedCache(FakeRedis())
+    shared.set('book:1', 'x')
+    shared.invalidate_all()
+    assert shared.get('book:1') == 'x' and shared.generation('books') == 1
+    memory = cache.MemoryCache()
+    memory.set('book:1', 'x')
+    memory.invalidate_all()
+    assert memory.get('book:1') is cache.MISSING
+
+def test_shared_cache_with_local_stand_in():
+    c = cache.SharedCache(FakeRedis())
+    assert c.get_or_set('book:1', lambda: {'title': '三体'}) == {'title': '三体'}
+    assert c.get('book:1') == {'title': '三体'}
+    assert c.generation('books') == 0
+    c.bump('books')
+    assert c.generation('books') == 1
+    c.delete('book:1')
+    assert c.get('book:1') is cache.MISSING
+
+def test_apply_notification():
+    c = cache.MemoryCache()
+    c.set('book:7', {'title': 'x'})
+    cache.apply_notification(c, 'book:7')
+    assert c.get('book:7') is cache.MISSING
+    assert c.generation('books') == 1
+
+# --- 路由缓存测试 ---
+def add_book(client):
+    client.post('/books/new', data={'title': '缓存测试', 'author': '作者',
+                                    'isbn': 'cache_isbn', 'total_stock': '3'})
+
+def test_get_book_is_served_from_cache():
+    client = app.test_client()
+    add_book(client)
+    client.get('/books/1')
+    hits = client.get('/cache/stats').get_json()['hits']
+    assert client.get('/books/1').get_json()['title'] == '缓存测试'
+    assert client.get('/cache/stats').get_json()['hits'] == hits + 1
+
+def test_edit_book_invalidates_cache():
+    client = app.test_client()
+    add_book(client)
+    assert client.get('/books/1').get_json()['title'] == '缓存测试'
+    client.post('/books/edit/1', data={'title': '新书名', 'author': '作者', 'isbn': 'cache_isbn',
+                                       'total_stock': '3', 'available_stock': '3'})
+    assert client.get('/books/1').get_json()['title'] == '新书名'
+    assert '新书名' in client.get('/books').data.decode('utf-8')
+
+def test_external_change_invalidates_through_notify():
+    client = app.test_client()
+    add_book(client)
+    assert client.get('/books/1').get_json()['available_stock'] == 3
+    # 绕过应用直接修改数据库，依赖触发器的 NOTIFY 使缓存失效
+    with psycopg2.connect(db.DATABASE_URL) as conn, conn.cursor() as cur:
+        cur.execute("UPDATE books SET available_stock = 1 WHERE book_id = 1")
+    conn.close()
+    for _ in range(50):
+        if client.get('/books/1').get_json()['available_stock'] == 1:
+            break
+        time.sleep(0.05)
+    assert client.get('/books/1').get_json()['available_stock'] == 1
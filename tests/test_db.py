@@ -0,0 +1,340 @@
+import os
+import pickle
+import time
+import flask
+import psycopg2.errors
+import psycopg2.extensions
+import pytest
+from personal_library import db, partitions
+from personal_library.app import app, create_app
+
+
+def make_pool(**kwargs):
+    options = dict(min_size=0, max_size=2, timeout=0.2)
+    options.update(kwargs)
+    return db.ConnectionPool(db.DATABASE_URL, **options)
+
+# --- 连接池测试 ---
+def test_pool_reuses_connection():
+    pool = make_pool()
+    conn = pool.getconn()
+    pid = conn.get_backend_pid()
+    pool.putconn(conn)
+    conn = pool.getconn()
+    assert conn.get_backend_pid() == pid  # 同一个后端进程，没有重新建立连接
+    pool.putconn(conn)
+    stats = pool.stats()
+    assert stats['connections_created'] == 1
+    assert stats['checkouts'] == 2
+    pool.close()
+
+def test_pool_rolls_back_on_return():
+    pool = make_pool(max_size=1)
+    conn = pool.getconn()
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    pool.putconn(conn)  # 未提交的事务应被回滚
+    conn = pool.getconn()
+    assert conn.get_transaction_status() == 0  # TRANSACTION_STATUS_IDLE
+    pool.putconn(conn)
+    pool.close()
+
+def test_pool_timeout_when_exhausted():
+    pool = make_pool(max_size=1)
+    conn = pool.getconn()
+    with pytest.raises(db.PoolTimeoutError):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+    pool.putconn(conn)
+    pool.close()
+
+def test_pool_replaces_broken_connection():
+    pool = make_pool(check_interval=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.close()  # 模拟连接在空闲期间断开
+    conn = pool.getconn()
+    assert not conn.closed
+    assert pool.stats()['health_check_failures'] == 1
+    pool.putconn(conn)
+    pool.close()
+
+def test_pool_reaps_idle_connections():
+    pool = make_pool(min_size=1, idle_timeout=0)
+    first, second = pool.getconn(), pool.getconn()
+    pool.putconn(first)
+    time.sleep(0.01)
+    pool.putconn(second)  # 多余的空闲连接立即被回收，只保留 min_size 个
+    assert pool.stats()['size'] == 1
+    pool.close()
+
+def test_get_db_uses_process_pool():
+    with app.app_context():
+        conn = db.get_db()
+        pool = db.get_pool()
+        assert pool.stats()['in_use'] >= 1
+    assert conn.closed == 0  # 上下文结束后连接被归还而不是关闭
+
+# --- 只读副本路由测试 ---
+# 用同一个数据库模拟副本: 副本 DSN 带不同的 application_name，按它判断查询发往了哪里
+APPLICATION_NAME = "SELECT current_setting('application_name')"
+
+@pytest.fixture
+def replicas():
+    def configure(*names, dsns=()):
+        app.config['DB_REPLICA_URLS'] = list(dsns) or [
+            psycopg2.extensions.make_dsn(db.DATABASE_URL, application_name=name) for name in names]
+    yield configure
+    app.config['DB_REPLICA_URLS'] = ''
+    db.close_pool()
+
+def test_readonly_queries_use_replicas_round_robin(replicas):
+    replicas('replica_a', 'replica_b')
+    seen = set()
+    for _ in range(2):
+        with app.test_request_context():
+            seen.add(db.query_db(APPLICATION_NAME, one=True, readonly=True)[0])
+            assert db.query_db(APPLICATION_NAME, one=True)[0] not in ('replica_a', 'replica_b')
+    assert seen == {'replica_a', 'replica_b'}
+
+def test_reads_stick_to_primary_after_write(replicas):
+    replicas('replica_a')
+    with app.test_request_context():
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('副本读者', 'replica_r1')", commit=True)
+        assert db.query_db(APPLICATION_NAME, one=True, readonly=True)[0] != 'replica_a'
+    client = app.test_client()
+    client.post('/readers/new', data={'name': '副本读者2', 'reader_number': 'replica_r2'})
+    with client.session_transaction() as session:
+        assert session['db_primary_until'] > time.time()
+    with app.test_request_context():
+        flask.session['db_primary_until'] = time.time() + 5
+        assert not db.use_replica()
+
+def test_replica_failover_to_primary(replicas):
+    replicas(dsns=['postgresql://postgres@/postgres?host=/nonexistent'])
+    with app.test_request_context():
+        assert db.query_db("SELECT 1", one=True, readonly=True)[0] == 1
+        stats = db.get_replicas().stats()
+    assert stats['replicas_down'] == 1 and stats['primary_fallbacks'] == 1
+
+def test_replica_query_retried_on_primary_when_connection_lost(replicas):
+    replicas('replica_a')
+    with app.test_request_context():
+        db.query_db(APPLICATION_NAME, one=True, readonly=True)
+        pid = flask.g.db_replica.get_backend_pid()
+        with psycopg2.connect(db.DATABASE_URL) as admin, admin.cursor() as cur:
+            cur.execute("SELECT pg_terminate_backend(%s)", [pid])
+        time.sleep(0.1)
+        assert db.query_db(APPLICATION_NAME, one=True, readonly=True)[0] != 'replica_a'
+        assert db.get_replicas().stats()['query_failovers'] == 1
+        assert db.get_replicas().stats()['replicas_down'] == 1
+
+# --- 迁移测试 ---
+def test_migrations_are_applied_once():
+    with app.app_context():
+        db.apply_migrations()
+        assert db.apply_migrations() == []  # 第二次执行时没有待执行的迁移
+        versions = {row['version'] for row in db.query_db("SELECT version FROM schema_migrations")}
+    assert set(db.list_migrations()) <= versions
+
+def test_migrate_db_command():
+    result = app.test_cli_runner().invoke(args=['migrate-db'])
+    assert '数据库已是最新版本' in result.output or '已执行迁移' in result.output
+
+@pytest.fixture
+def scratch_database():
+    """新建一个空数据库，返回它的连接串；测试结束后删除。"""
+    name = 'library_migration_test'
+    admin = psycopg2.connect(db.DATABASE_URL)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        try:
+            cur.execute(f'CREATE DATABASE "{name}"')
+        except psycopg2.errors.InsufficientPrivilege:
+            admin.close()
+            pytest.skip('没有 CREATEDB 权限')
+    yield psycopg2.extensions.make_dsn(db.DATABASE_URL, dbname=name)
+    db.close_pool()
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    admin.close()
+
+def test_migrations_upgrade_baseline_schema(scratch_database):
+    """在最初的表结构上执行全部迁移，分区与按 schema.sql 新建的数据库一致，不留下空的早年分区。"""
+    with app.app_context():
+        expected = sorted(partitions.list_partitions() + [(2020, 'loans_y2020')])
+    db.close_pool()  # 连接池是进程级的，换数据库前关闭
+    other = create_app({'DATABASE_URL': scratch_database, 'CACHE_LISTEN': False})
+    with other.app_context():
+        db.execute_sql_file(os.path.join(os.path.dirname(__file__), 'baseline_schema.sql'))
+        db.query_db("INSERT INTO books (title, author, isbn, total_stock, available_stock) "
+                    "VALUES ('旧书', '作者', 'baseline_1', 1, 1)", commit=True)
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('读者', 'baseline_r1')", commit=True)
+        db.query_db("INSERT INTO loans (book_id, reader_id, loan_date, due_date) "
+                    "VALUES (1, 1, '2020-03-01', '2020-04-01')", commit=True)
+        assert db.apply_migrations() == db.list_migrations()
+        assert partitions.list_partitions() == expected
+        assert db.query_db("SELECT tableoid::regclass::text FROM loans", one=True)[0] == 'loans_y2020'
+
+        # 旧版 008 迁移留下的空分区由 013 分离并删除
+        db.query_db("CREATE TABLE loans_y2021 PARTITION OF loans "
+                    "FOR VALUES FROM ('2021-01-01') TO ('2022-01-01')", commit=True)
+        db.execute_sql_file(os.path.join(db.MIGRATIONS_DIR, '013_active_loan_partition_pruning.sql'))
+        assert partitions.list_partitions() == expected
+    db.close_pool()
+
+# --- 索引检查测试 ---
+def test_check_indexes_command():
+    result = app.test_cli_runner().invoke(args=['check-indexes'])
+    assert result.exit_code == 0, result.output
+    assert 'FAIL' not in result.output
+
+# --- 流式查询测试 ---
+def test_iter_query_streams_and_returns_connection():
+    with app.app_context():
+        pool = db.get_pool()
+        in_use = pool.stats()['in_use']
+        rows = db.iter_query("SELECT g AS n FROM generate_series(1, 1000) AS g", itersize=100)
+        assert pool.stats()['in_use'] == in_use + 1  # 游标持有单独的连接
+        assert sum(row['n'] for row in rows) == 500500
+        assert pool.stats()['in_use'] == in_use  # 遍历结束后连接被归还
+
+def test_streamed_loan_page_returns_connection():
+    with app.app_context():
+        in_use = db.get_pool().stats()['in_use']
+    response = app.test_client().get('/loans/active')
+    assert response.status_code == 200
+    response.close()
+    with app.app_context():
+        assert db.get_pool().stats()['in_use'] == in_use
+
+# --- 库存触发器测试 ---
+def stock_of(book_id):
+    return db.query_db("SELECT available_stock FROM books WHERE book_id = %s", [book_id], one=True)[0]
+
+def test_statement_level_stock_triggers():
+    with app.app_context():
+        db.query_db("INSERT INTO books (title, author, isbn, total_stock, available_stock) "
+                    "VALUES ('甲', '作者', 'trg_1', 10, 10), ('乙', '作者', 'trg_2', 10, 10)", commit=True)
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('读者', 'trg_r1')", commit=True)
+        # 一条语句插入多条借阅，其中一条已归还
+        db.query_db("""
+            INSERT INTO loans (book_id, reader_id, due_date, return_date)
+            SELECT 1 + mod(g, 2), 1, DATE '2030-01-01', CASE WHEN g = 0 THEN CURRENT_DATE END
+            FROM generate_series(0, 5) AS g
+        """, commit=True)
+        assert (stock_of(1), stock_of(2)) == (8, 7)
+
+        # 批量归还图书 1 的借阅
+        db.query_db("UPDATE loans SET return_date = CURRENT_DATE WHERE book_id = 1 AND return_date IS NULL", commit=True)
+        assert stock_of(1) == 10
+
+        # 把一条未归还借阅改到另一本书
+        db.query_db("UPDATE loans SET book_id = 1 WHERE loan_id = 2", commit=True)
+        assert (stock_of(1), stock_of(2)) == (9, 8)
+
+        db.query_db("DELETE FROM loans", commit=True)
+        assert (stock_of(1), stock_of(2)) == (10, 10)
+
+# --- 行类型测试 ---
+def test_record_rows():
+    with app.app_context():
+        rows = db.query_db("SELECT g AS book_id, 'title ' || g AS title FROM generate_series(1, 3) AS g",
+                           row_factory='record')
+        row = rows[1]
+        assert row.title == row['title'] == row[1] == 'title 2'
+        assert dict(row) == row.as_dict() == {'book_id': 2, 'title': 'title 2'}
+        assert row.get('missing') is None
+        assert type(rows[0]) is type(row)  # 同一查询形状共用一个类
+        assert pickle.loads(pickle.dumps(row)).title == 'title 2'  # 可以写入共享缓存
+
+        rows = db.query_db("SELECT 1 AS a, 2 AS b", row_factory='tuple')
+        assert rows == [(1, 2)] and rows.columns == {'a': 0, 'b': 1}
+        with pytest.raises(ValueError):
+            db.query_db("SELECT 1", row_factory='unknown')
+
+def test_iter_query_records():
+    with app.app_context():
+        rows = db.iter_query("SELECT g AS n FROM generate_series(1, 10) AS g", itersize=3, row_factory='record')
+        assert [row.n for row in rows] == list(range(1, 11))
+
+# --- 预备语句测试 ---
+def test_prepared_statement_reused_and_recovers():
+    statement = db.register_statement('test_add_one', "SELECT %s::int + 1 AS n")
+    with app.app_context():
+        conn = db.get_db()
+        assert db.query_db(statement, [1], one=True)['n'] == 2
+        assert 'test_add_one' in conn.prepared_statements
+        assert db.query_db(statement, [2], one=True)['n'] == 3
+
+        # 会话被重置后 (例如 DISCARD ALL) 自动重新 PREPARE
+        db.query_db("DEALLOCATE ALL", commit=True)
+        assert db.query_db(statement, [3], one=True)['n'] == 4
+
+        with pytest.raises(ValueError):
+            db.register_statement('test_add_one', "SELECT 2")
+
+def test_prepared_statements_can_be_disabled():
+    statement = db.register_statement('test_disabled', "SELECT %s::int AS n")
+    app.config['DB_PREPARED_STATEMENTS'] = False
+    try:
+        with app.app_context():
+            assert db.query_db(statement, [5], one=True)['n'] == 5
+            assert 'test_disabled' not in db.get_db().prepared_statements
+    finally:
+        app.config['DB_PREPARED_STATEMENTS'] = True
+
+# --- 分区测试 ---
+@pytest.fixture
+def restore_partitions():
+    """测试结束后分离并删除测试中新建的分区 (包括归档的)，数据库可以重复运行测试。"""
+    with app.app_context():
+        existing = partitions.list_partitions()
+    yield
+    with app.app_context():
+        for _, name in partitions.list_partitions():
+            if (_, name) not in existing:
+                db.query_db(f'ALTER TABLE loans DETACH PARTITION "{name}"', commit=True)
+                db.query_db(f'DROP TABLE "{name}"', commit=True)
+        db.query_db(f"DROP SCHEMA IF EXISTS {partitions.ARCHIVE_SCHEMA} CASCADE", commit=True)
+        partitions.refresh_active_since()
+
+def active_since():
+    return db.query_db("SELECT since FROM loans_active_since", one=True)[0]
+
+def test_partition_creation_and_archive(restore_partitions):
+    with app.app_context():
+        before = partitions.list_partitions()
+        db.query_db("INSERT INTO books (title, author, isbn, total_stock, available_stock) "
+                    "VALUES ('旧书', '作者', 'part_1', 1, 1)", commit=True)
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('读者', 'part_r1')", commit=True)
+        # 补录的早年借阅没有对应分区，落入默认分区
+        db.query_db("INSERT INTO loans (book_id, reader_id, loan_date, due_date) "
+                    "VALUES (1, 1, '2001-03-01', '2001-04-01')", commit=True)
+        assert db.query_db("SELECT tableoid::regclass::text FROM loans", one=True)[0] == 'loans_default'
+        assert str(active_since()) == '2001-03-01'  # 触发器降低未归还借阅的下界
+    assert '旧书' in app.test_client().get('/loans/active').data.decode('utf-8')
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['create-partitions'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert db.query_db("SELECT tableoid::regclass::text FROM loans", one=True)[0] == 'loans_y2001'
+        # 只为默认分区中有行的年份建分区，不补齐 2002 年到去年之间的空年份
+        assert partitions.list_partitions() == sorted(before + [(2001, 'loans_y2001')])
+
+    result = runner.invoke(args=['archive-loans', '--before', '2002'])
+    assert '跳过 loans_y2001' in result.output  # 还没有归还
+
+    with app.app_context():
+        db.query_db("UPDATE loans SET return_date = '2001-03-20'", commit=True)
+    result = runner.invoke(args=['archive-loans', '--before', '2002'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert (2001, 'loans_y2001') not in partitions.list_partitions()
+        assert db.query_db("SELECT COUNT(*) FROM loans", one=True)[0] == 0
+        assert db.query_db("SELECT COUNT(*) FROM loans_archive.loans_y2001", one=True)[0] == 1
+        assert active_since() == db.query_db("SELECT CURRENT_DATE", one=True)[0]  # 归档后重新计算
+        # 分离的分区不影响库存
+        assert stock_of(1) == 1
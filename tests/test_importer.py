@@ -0,0 +1,47 @@
+import json
+from personal_library.app import app
+from personal_library import db, importer
+
+
+def write_csv(path, rows):
+    lines = ['title,author,isbn,publisher,publication_year,category,total_stock']
+    lines += [','.join(str(value) for value in row) for row in rows]
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+def test_import_books_csv_command(tmp_path):
+    path = tmp_path / 'books.csv'
+    write_csv(path, [
+        ('三体', '刘慈欣', 'imp_1', '重庆出版社', 2008, '科幻', 5),
+        ('机器学习', '周志华', 'imp_2', '清华大学出版社', 2016, '人工智能', 3),
+        ('', '缺少书名', 'imp_3', '', '', '', 1),  # 无效记录被跳过
+    ])
+    result = app.test_cli_runner().invoke(args=['import-books', str(path), '--batch-size', '1'])
+    assert '新增 2 条' in result.output
+    assert '跳过 1 条' in result.output
+    with app.app_context():
+        book = db.query_db("SELECT * FROM books WHERE isbn = 'imp_1'", one=True)
+    assert book['title'] == '三体' and book['available_stock'] == 5
+
+def test_import_books_upserts_on_isbn(tmp_path):
+    with app.app_context():
+        db.query_db("INSERT INTO books (title, author, isbn, total_stock, available_stock) "
+                    "VALUES ('旧书名', '旧作者', 'imp_up', 5, 3)", commit=True)  # 已借出 2 本
+    path = tmp_path / 'books.jsonl'
+    path.write_text('\n'.join(json.dumps(record, ensure_ascii=False) for record in [
+        {'title': '新书名', 'author': '新作者', 'isbn': 'imp_up', 'total_stock': 10},
+        {'title': '另一本书', 'author': '作者', 'isbn': 'imp_new', 'total_stock': 1},
+    ]), encoding='utf-8')
+    with app.app_context():
+        stats = importer.import_books(db.get_db(), importer.read_records(str(path)))
+        book = db.query_db("SELECT * FROM books WHERE isbn = 'imp_up'", one=True)
+    assert (stats.inserted, stats.updated) == (1, 1)
+    assert book['title'] == '新书名'
+    assert book['available_stock'] == 8  # 已借出的 2 本保持不变
+
+def test_import_books_deduplicates_isbn_within_batch():
+    records = [{'title': f'版本{i}', 'author': '作者', 'isbn': 'imp_dup', 'total_stock': i} for i in range(3)]
+    with app.app_context():
+        stats = importer.import_books(db.get_db(), records)
+        book = db.query_db("SELECT * FROM books WHERE isbn = 'imp_dup'", one=True)
+    assert stats.inserted == 1
+    assert book['title'] == '版本2'
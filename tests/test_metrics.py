@@ -0,0 +1,46 @@
+from personal_library.app import app
+from personal_library import db, metrics
+
+
+def test_fingerprint_normalizes_literals_and_placeholders():
+    assert metrics.fingerprint("SELECT * FROM books WHERE book_id = %s") == \
+        metrics.fingerprint("SELECT *\n  FROM books WHERE book_id = 42;") == "SELECT * FROM books WHERE book_id = ?"
+    assert metrics.fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2, 3) -- note") == \
+        "SELECT * FROM t WHERE a = ? AND b IN (?)"
+    assert metrics.fingerprint(b"INSERT INTO t VALUES (1,'a'),(2,'b'),(3,'c')") == "INSERT INTO t VALUES (?), ..."
+
+def test_server_timing_and_metrics_endpoint():
+    client = app.test_client()
+    response = client.get('/books')
+    assert response.status_code == 200
+    assert 'queries"' in response.headers['Server-Timing']
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'library_http_requests_total{endpoint="list_books",method="GET",status="200"}' in body
+    assert 'library_db_queries_per_request_bucket{endpoint="list_books",le="+Inf"}' in body
+    assert 'library_db_pool_checkouts ' in body
+    assert 'library_cache_hits ' in body
+
+def test_raw_cursors_are_instrumented():
+    client = app.test_client()
+    with app.app_context():
+        db.query_db("INSERT INTO books (title, author, isbn, total_stock, available_stock) "
+                    "VALUES ('插桩书籍', '作者', 'metrics_1', 1, 1)", commit=True)
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('读者', 'metrics_r1')", commit=True)
+    response = client.post('/loans/borrow', data={'book_id': 1, 'reader_id': 1, 'due_date': '2030-01-01'})
+    assert response.status_code == 302
+    counters, _ = metrics.registry.snapshot()
+    statements = {dict(labels).get('statement') for name, labels in counters if name == 'library_db_statements_total'}
+    assert "SELECT available_stock FROM books WHERE book_id = ? FOR UPDATE" in statements
+
+def test_slow_query_log_captures_explain():
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = 0.0
+    try:
+        metrics.slow_queries.clear()
+        metrics._last_explain.clear()
+        app.test_client().get('/search/book_loans/1')
+    finally:
+        app.config['SLOW_QUERY_THRESHOLD_MS'] = metrics.METRICS_DEFAULTS['SLOW_QUERY_THRESHOLD_MS']
+    entries = app.test_client().get('/metrics/slow-queries').get_json()['slow_queries']
+    book_query = next(entry for entry in entries if entry['fingerprint'].startswith('SELECT book_id, title, author'))
+    assert book_query['endpoint'] == 'book_loan_history'
+    assert 'Scan' in book_query['plan']
@@ -0,0 +1,99 @@
+import datetime
+import json
+import threading
+import pytest
+from personal_library.app import app
+from personal_library import db, notices
+
+
+class ListSink:
+    def __init__(self, fail_on=None):
+        self.notices = []
+        self.fail_on = fail_on
+        self._lock = threading.Lock()
+
+    def send(self, notice):
+        if notice['reader_id'] == self.fail_on:
+            raise OSError('sink unavailable')
+        with self._lock:
+            self.notices.append(notice)
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def add_overdue_loans():
+    """三位读者: 1 有两本逾期，2 没有联系方式，3 有一本逾期和一本未到期。"""
+    with app.app_context():
+        db.query_db("""
+            INSERT INTO readers (name, reader_number, contact) VALUES
+                ('甲', 'notice_r1', 'a@example.com'), ('乙', 'notice_r2', NULL), ('丙', 'notice_r3', 'c@example.com');
+            INSERT INTO books (title, author, isbn, total_stock, available_stock) VALUES
+                ('书一', '作者', 'notice_b1', 5, 5), ('书二', '作者', 'notice_b2', 5, 5);
+            INSERT INTO loans (book_id, reader_id, loan_date, due_date) VALUES
+                (1, 1, CURRENT_DATE - 30, CURRENT_DATE - 10),
+                (2, 1, CURRENT_DATE - 30, CURRENT_DATE - 2),
+                (1, 2, CURRENT_DATE - 30, CURRENT_DATE - 5),
+                (2, 3, CURRENT_DATE - 30, CURRENT_DATE - 1),
+                (1, 3, CURRENT_DATE, CURRENT_DATE + 14);
+        """, commit=True)
+
+def run(sink, **kwargs):
+    with app.app_context():
+        return notices.send_overdue_notices(app.jinja_env, sink, workers=2, **kwargs)
+
+def test_one_notice_per_reader():
+    add_overdue_loans()
+    sink = ListSink()
+    stats = run(sink)
+    assert (stats.readers, stats.loans, stats.sent, stats.skipped) == (3, 4, 2, 1)
+    assert [notice['to'] for notice in sink.notices] == ['a@example.com', 'c@example.com']
+    first = sink.notices[0]
+    assert first['loan_ids'] == [1, 2]  # 按应还日期排列
+    assert '书一' in first['body'] and '书二' in first['body'] and 'notice_r1' in first['body']
+    assert '已逾期 10 天' in first['body']
+
+def test_min_days_filters_recent_overdue():
+    add_overdue_loans()
+    sink = ListSink()
+    stats = run(sink, min_days=3)
+    assert (stats.readers, stats.loans, stats.sent) == (2, 2, 1)
+    assert sink.notices[0]['loan_ids'] == [1]
+
+def test_checkpoint_resume_after_failure(tmp_path):
+    add_overdue_loans()
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    with pytest.raises(OSError):
+        run(ListSink(fail_on=3), checkpoint=checkpoint, checkpoint_every=1)
+    # 检查点停在失败读者之前
+    today = datetime.date.today()
+    assert notices.load_checkpoint(checkpoint, today) == 2
+    assert notices.load_checkpoint(checkpoint, today - datetime.timedelta(days=1)) == 0
+    sink = ListSink()
+    stats = run(sink, after_reader_id=2, checkpoint=checkpoint)
+    assert [notice['reader_id'] for notice in sink.notices] == [3]
+    assert stats.readers == 1 and notices.load_checkpoint(checkpoint, today) == 3
+
+def test_notify_overdue_command(tmp_path):
+    add_overdue_loans()
+    output = tmp_path / 'notices.jsonl'
+    checkpoint = tmp_path / 'checkpoint.json'
+    args = ['notify-overdue', '--sink', f'file:{output}', '--checkpoint', str(checkpoint)]
+    result = app.test_cli_runner().invoke(args=args)
+    assert '发送 2 条通知' in result.output and '跳过 1 位' in result.output
+    lines = [json.loads(line) for line in output.read_text(encoding='utf-8').splitlines()]
+    assert [line['reader_number'] for line in lines] == ['notice_r1', 'notice_r3']
+    # 当天再次运行并 --resume 时没有剩余的读者
+    result = app.test_cli_runner().invoke(args=args + ['--resume'])
+    assert '从读者 3 之后继续' in result.output and '发送 0 条通知' in result.output
+
+def test_create_sink_rejects_unknown_spec():
+    with pytest.raises(ValueError):
+        notices.create_sink('kafka://localhost')
+    sink = notices.create_sink('smtp://mail.example.com:2525')
+    assert (sink.host, sink.port) == ('mail.example.com', 2525)
+    assert sink.send({'to': '13800000000', 'subject': '', 'body': ''}) is False  # 无法投递的联系方式
@@ -0,0 +1,49 @@
+import pytest
+from personal_library.app import app, create_app
+from personal_library import db, startup
+
+
+def test_create_app_returns_independent_apps():
+    other = create_app({'TESTING': True, 'READERS_PER_PAGE': 7})
+    assert other is not app
+    assert other.config['READERS_PER_PAGE'] == 7 and app.config['READERS_PER_PAGE'] != 7
+    assert {rule.endpoint for rule in other.url_map.iter_rules()} == \
+        {rule.endpoint for rule in app.url_map.iter_rules()}
+    assert 'notify-overdue' in other.cli.commands
+    assert other.test_client().get('/readers').status_code == 200
+
+def test_database_url_from_config():
+    other = create_app({'DATABASE_URL': 'postgresql://nobody@/missing'})
+    with other.app_context():
+        assert db.database_url() == 'postgresql://nobody@/missing'
+    with app.app_context():
+        assert db.database_url() == db.DATABASE_URL == app.config['DATABASE_URL']
+
+def test_unknown_borrow_mode_rejected():
+    with pytest.raises(ValueError):
+        create_app({'BORROW_MODE': 'optimstic'})
+
+def test_unknown_warmup_step_rejected():
+    assert startup.warmup_steps({'WARMUP': ' cache, templates '}) == ['templates', 'cache']
+    with pytest.raises(ValueError):
+        create_app({'WARMUP': 'templates,jit'})
+
+def test_warm_up_prepares_statements():
+    other = create_app({'WARMUP': 'db,cache'})
+    with other.app_context():
+        conn = db.get_db()
+        assert db.prepare_statements(conn) == 0  # 预热时已全部 PREPARE
+    listener = other.extensions['library_cache']['listener']
+    assert listener is not None and listener.is_alive()
+    listener.stop()
+
+def test_precompile_templates(tmp_path):
+    result = app.test_cli_runner().invoke(args=['precompile-templates'])
+    assert result.exit_code == 1 and 'TEMPLATE_CACHE_DIR' in result.output
+    other = create_app({'TEMPLATE_CACHE_DIR': str(tmp_path / 'templates')})
+    result = other.test_cli_runner().invoke(args=['precompile-templates'])
+    assert result.exit_code == 0, result.output
+    assert len(list((tmp_path / 'templates').iterdir())) == len(other.jinja_env.list_templates())
+    # 新应用从缓存加载编译结果，渲染结果不变
+    cached = create_app({'TEMPLATE_CACHE_DIR': str(tmp_path / 'templates')})
+    assert cached.test_client().get('/books/new').data == app.test_client().get('/books/new').data
@@ -0,0 +1,53 @@
+from personal_library.app import app
+from personal_library import db, stats
+
+
+def add_books_and_readers():
+    with app.app_context():
+        db.query_db("INSERT INTO books (title, author, isbn, category, total_stock, available_stock) VALUES "
+                    "('热门书', '作者', 'stats_1', '文学', 5, 5), ('冷门书', '作者', 'stats_2', '历史', 5, 5)",
+                    commit=True)
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('甲', 'stats_r1'), ('乙', 'stats_r2')",
+                    commit=True)
+
+def book_stats():
+    return {row['book_id']: (row['loan_count'], row['active_count'])
+            for row in db.query_db("SELECT * FROM stats_book_loans")}
+
+def test_stats_tables_follow_loans():
+    add_books_and_readers()
+    client = app.test_client()
+    for book_id, reader_id in ((1, 1), (1, 2), (2, 1)):
+        client.post('/loans/borrow', data={'book_id': book_id, 'reader_id': reader_id, 'due_date': '2030-01-01'})
+    with app.app_context():
+        assert book_stats() == {1: (2, 2), 2: (1, 1)}
+        reader = db.query_db("SELECT * FROM stats_reader_loans WHERE reader_id = 1", one=True)
+        assert (reader['loan_count'], reader['active_count']) == (2, 2)
+
+    client.post('/loans/return/1')
+    with app.app_context():
+        assert book_stats() == {1: (2, 1), 2: (1, 1)}
+        # 一条语句删除多条借阅
+        db.query_db("DELETE FROM loans WHERE reader_id = 1", commit=True)
+        assert book_stats() == {1: (1, 1), 2: (0, 0)}
+
+def test_refresh_stats_and_dashboard():
+    add_books_and_readers()
+    with app.app_context():
+        db.query_db("INSERT INTO loans (book_id, reader_id, due_date) VALUES (1, 1, '2030-01-01'), "
+                    "(1, 2, '2030-01-01')", commit=True)
+        # 在触发器之外修改统计后，--rebuild 从 loans 重算
+        db.query_db("UPDATE stats_book_loans SET loan_count = 100", commit=True)
+    result = app.test_cli_runner().invoke(args=['refresh-stats', '--rebuild'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert book_stats() == {1: (2, 2)}
+        categories = {row.category: row.loan_count for row in stats.category_loans()}
+        assert categories == {'文学': 2, '历史': 0}
+
+    response = app.test_client().get('/stats')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert '热门书' in body and 'stats_r2' in body
+    assert '冷门书' not in body  # 没有借阅的图书不进排行榜
+    assert body.index('文学') < body.index('历史')  # 分类按借阅数排序
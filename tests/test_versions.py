@@ -0,0 +1,88 @@
+from personal_library.app import app
+from personal_library import cache, db, versions
+
+
+def add_book(client, isbn='version_isbn', title='版本测试'):
+    client.post('/books/new', data={'title': title, 'author': '作者', 'isbn': isbn, 'total_stock': '3'})
+    client.get('/')  # 取走添加成功的 flash 消息
+
+def table_version(table):
+    with app.app_context():
+        return db.query_db("SELECT SUM(version) FROM table_versions WHERE table_name = %s", [table], one=True)[0]
+
+def test_triggers_bump_table_versions():
+    client = app.test_client()
+    books, loans = table_version('books'), table_version('loans')
+    add_book(client)
+    assert table_version('books') == books + 1
+    with app.app_context():
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('甲', 'version_r1')", commit=True)
+    client.post('/loans/borrow', data={'book_id': '1', 'reader_id': '1', 'due_date': '2030-01-01'})
+    # 借书插入借阅记录，库存触发器又更新了图书
+    assert table_version('loans') == loans + 1
+    assert table_version('books') == books + 2
+
+def test_books_list_conditional_get():
+    client = app.test_client()
+    add_book(client)
+    response = client.get('/books')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('W/') and response.last_modified is not None
+    assert 'no-cache' in response.headers['Cache-Control']
+    last_modified = response.headers['Last-Modified']
+
+    response = client.get('/books', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+    assert client.get('/books', headers={'If-Modified-Since': last_modified}).status_code == 304
+    # 查询参数不同的页面有不同的 ETag
+    assert client.get('/books?search=版本', headers={'If-None-Match': etag}).status_code == 200
+
+    add_book(client, isbn='version_isbn_2', title='另一本书')
+    response = client.get('/books', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert '另一本书' in response.data.decode('utf-8')
+
+def test_pending_flash_skips_not_modified():
+    client = app.test_client()
+    add_book(client)
+    etag = client.get('/books').headers['ETag']
+    with client.session_transaction() as session:
+        session['_flashes'] = [('warning', '待显示的消息')]
+    response = client.get('/books', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert '待显示的消息' in response.data.decode('utf-8')
+    # 消息显示过之后恢复条件请求
+    assert client.get('/books', headers={'If-None-Match': etag}).status_code == 304
+
+def test_overdue_page_version_includes_date():
+    client = app.test_client()
+    response = client.get('/loans/overdue')
+    assert response.status_code == 200
+    assert client.get('/loans/overdue', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    with app.test_request_context():
+        tag, _ = versions.current_version(('loans',), daily=True)
+        assert ';date=' in tag
+
+def test_fragment_cache_reuses_rendered_rows():
+    client = app.test_client()
+    with app.app_context():
+        db.query_db("INSERT INTO readers (name, reader_number) VALUES ('片段缓存读者', 'fragment_r1')", commit=True)
+        cache.get_cache().clear()
+    first = client.get('/readers').data
+    hits = client.get('/cache/stats').get_json()['hits']
+    assert client.get('/readers').data == first
+    assert client.get('/cache/stats').get_json()['hits'] == hits + 1
+    # 数据变更后版本改变，旧片段不再被使用
+    with app.app_context():
+        db.query_db("UPDATE readers SET name = '改名后的读者' WHERE reader_number = 'fragment_r1'", commit=True)
+    assert '改名后的读者' in client.get('/readers').data.decode('utf-8')
+
+def test_fragment_cache_disabled_without_version():
+    template = app.jinja_env.from_string("{% cache 'x', data_version %}{{ value }}{% endcache %}")
+    with app.test_request_context():
+        assert template.render(data_version=None, value=1) == '1'
+        assert template.render(data_version=None, value=2) == '2'
+        assert template.render(data_version='v1', value=3) == '3'
+        assert template.render(data_version='v1', value=4) == '3'  # 同一版本命中缓存